@@ -1,6 +1,5 @@
-import http.server
-import socketserver
 import sys
+from webrtc_static import StaticAsset, serve_threaded, vendored_script, VENDORED_SCRIPTS
 
 # Define the port
 PORT = 80
@@ -51,8 +50,18 @@ HTML_CONTENT = """<!DOCTYPE html>
 </div>
 
 <script>
-  const brokerURL = 'wss://e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud:8884/mqtt';
+  // ?broker=ws://<hub>:8765/mqtt points the page at a LAN broker (webrtc_signaling_hub.py) on isolated networks
+  const brokerURL = new URLSearchParams(location.search).get('broker')
+    || 'wss://e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud:8884/mqtt';
   const signalingTopic = 'webrtc/signaling';
+  const presencePrefix = `${signalingTopic}/presence/`;
+  const presenceTopic = (id) => presencePrefix + id;
+  const inboxTopic = (id) => `${signalingTopic}/${id}`;
+
+  // Presence is retained and cleared by our MQTT Last Will; refreshes are only a safety net
+  const presenceKeepaliveMs = 60000;
+  const presenceTimeoutMs = presenceKeepaliveMs * 3;
+  let presenceTimer = null;
 
   const peerId = localStorage.getItem('persistentPeerId') || 'peer_' + Math.random().toString(36).substr(2, 6);
   localStorage.setItem('persistentPeerId', peerId);
@@ -65,23 +74,109 @@ HTML_CONTENT = """<!DOCTYPE html>
     clientId: 'signaling_' + peerId,
     username: 'admin',
     password: 'admin1234S',
-    protocol: 'wss'
+    protocol: brokerURL.split(':')[0],
+    will: { topic: presenceTopic(peerId), payload: '', qos: 1, retain: true }
   });
 
   client.on('connect', () => {
-    client.subscribe(signalingTopic);
+    // Personal inbox for addressed messages + every peer's retained presence record
+    client.subscribe([inboxTopic(peerId), presencePrefix + '+']);
     sendPresence();
-    setInterval(sendPresence, 1000);
+    if (!presenceTimer) presenceTimer = setInterval(sendPresence, presenceKeepaliveMs);
   });
 
-  client.on('message', (_, payload) => {
+  // --- Signaling codec: compact JSON text or msgpack with a zlib-compressed SDP ---
+  function msgpackDecode(bytes) {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const utf8 = new TextDecoder();
+    let pos = 0;
+    const str = (n) => { const s = utf8.decode(bytes.subarray(pos, pos + n)); pos += n; return s; };
+    const bin = (n) => { const b = bytes.subarray(pos, pos + n); pos += n; return b; };
+    const arr = (n) => { const a = []; for (let i = 0; i < n; i++) a.push(read()); return a; };
+    const map = (n) => { const m = {}; for (let i = 0; i < n; i++) { const k = read(); m[k] = read(); } return m; };
+    const u8 = () => bytes[pos++];
+    const u16 = () => { const v = view.getUint16(pos); pos += 2; return v; };
+    const u32 = () => { const v = view.getUint32(pos); pos += 4; return v; };
+
+    function read() {
+      const t = bytes[pos++];
+      if (t <= 0x7f) return t;
+      if (t >= 0xe0) return t - 0x100;
+      if ((t & 0xf0) === 0x80) return map(t & 0x0f);
+      if ((t & 0xf0) === 0x90) return arr(t & 0x0f);
+      if ((t & 0xe0) === 0xa0) return str(t & 0x1f);
+      let v;
+      switch (t) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: return bin(u8());
+        case 0xc5: return bin(u16());
+        case 0xc6: return bin(u32());
+        case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+        case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+        case 0xcc: return u8();
+        case 0xcd: return u16();
+        case 0xce: return u32();
+        case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+        case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+        case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+        case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+        case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+        case 0xd9: return str(u8());
+        case 0xda: return str(u16());
+        case 0xdb: return str(u32());
+        case 0xdc: return arr(u16());
+        case 0xdd: return arr(u32());
+        case 0xde: return map(u16());
+        case 0xdf: return map(u32());
+      }
+      throw new Error('Unsupported msgpack type 0x' + t.toString(16));
+    }
+    return read();
+  }
+
+  async function inflateText(bytes) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return await new Response(stream).text();
+  }
+
+  async function decodeSignal(payload) {
+    // JSON text always starts with '{'; anything else is the compact msgpack form
+    if (payload[0] === 0x7b) return JSON.parse(payload.toString());
+    const msg = msgpackDecode(new Uint8Array(payload));
+    if (msg.data && msg.data.sdp instanceof Uint8Array) msg.data.sdp = await inflateText(msg.data.sdp);
+    return msg;
+  }
+
+  // Candidates trickled within this window are published as one message
+  const iceBatchWindowMs = 50;
+  let pendingIce = [];
+  let iceFlushTimer = null;
+
+  function queueIce(candidate) {
+    pendingIce.push(candidate.toJSON());
+    if (!iceFlushTimer) iceFlushTimer = setTimeout(flushIce, iceBatchWindowMs);
+  }
+
+  function flushIce() {
+    iceFlushTimer = null;
+    if (pendingIce.length) sendSignal('ice', pendingIce);
+    pendingIce = [];
+  }
+
+  client.on('message', async (topic, payload) => {
     try {
-      const msg = JSON.parse(payload.toString());
-      if (msg.type === 'presence') {
-        peerRegistry[msg.from] = Date.now();
+      if (topic.startsWith(presencePrefix)) {
+        const pid = topic.slice(presencePrefix.length);
+        // Empty retained payload means the peer's Last Will fired
+        if (payload.length === 0) delete peerRegistry[pid];
+        else peerRegistry[pid] = Date.now();
         return;
       }
 
+      const msg = await decodeSignal(payload);
+
       if (msg.to !== peerId) return;
       targetPeerId = msg.from;
 
@@ -91,7 +186,7 @@ HTML_CONTENT = """<!DOCTYPE html>
   });
 
   function sendPresence() {
-    client.publish(signalingTopic, JSON.stringify({ type: 'presence', from: peerId }));
+    client.publish(presenceTopic(peerId), JSON.stringify({ type: 'presence', from: peerId }), { qos: 1, retain: true });
   }
 
   function togglePeerList() {
@@ -115,10 +210,10 @@ HTML_CONTENT = """<!DOCTYPE html>
     for (const pid in peerRegistry) {
       if (pid === peerId) continue;
       const age = now - peerRegistry[pid];
-      if (age > 5000) { delete peerRegistry[pid]; continue; }
+      if (age > presenceTimeoutMs) { delete peerRegistry[pid]; continue; }
 
       const li = document.createElement('li');
-      if (age > 2000) {
+      if (age > presenceKeepaliveMs * 1.5) {
         li.className = 'offline';
         li.textContent = `[lagging]: ${pid}`;
       } else {
@@ -135,6 +230,7 @@ HTML_CONTENT = """<!DOCTYPE html>
 
   async function initiateCall() {
     if (pc) pc.close();
+    pendingIce = [];
     
     pc = new RTCPeerConnection({
       iceServers: [{ urls: "stun:stun.l.google.com:19302" }]
@@ -149,7 +245,7 @@ HTML_CONTENT = """<!DOCTYPE html>
     };
 
     pc.onicecandidate = e => {
-      if (e.candidate) sendSignal('ice', e.candidate);
+      if (e.candidate) queueIce(e.candidate);
     };
 
     const offer = await pc.createOffer();
@@ -162,17 +258,20 @@ HTML_CONTENT = """<!DOCTYPE html>
     await pc.setRemoteDescription(new RTCSessionDescription(answer));
   }
 
-  async function handleRemoteICE(candidate) {
+  async function handleRemoteICE(data) {
     if (!pc) return;
-    try {
-      await pc.addIceCandidate(new RTCIceCandidate(candidate));
-    } catch (e) { console.error("Error adding ICE", e); }
+    // Accepts a single trickled candidate or a batched list
+    for (const candidate of (Array.isArray(data) ? data : [data])) {
+      try {
+        await pc.addIceCandidate(new RTCIceCandidate(candidate));
+      } catch (e) { console.error("Error adding ICE", e); }
+    }
   }
 
   function sendSignal(type, data) {
     if (!targetPeerId) return;
     client.publish(
-      signalingTopic,
+      inboxTopic(targetPeerId),
       JSON.stringify({ type, from: peerId, to: targetPeerId, data })
     );
   }
@@ -181,24 +280,31 @@ HTML_CONTENT = """<!DOCTYPE html>
 </body>
 </html>"""
 
-class EmbeddedHTMLHandler(http.server.BaseHTTPRequestHandler):
-    def do_GET(self):
-        # Respond with a successful 200 OK
-        self.send_response(200)
-        self.send_header("Content-type", "text/html; charset=utf-8")
-        self.end_headers()
-        # Write the embedded HTML string into the response
-        self.wfile.write(HTML_CONTENT.encode('utf-8'))
+# The script tag as written above; replaced by the vendored copy or the same pinned release on the CDN
+MQTT_PAGE_URL = "https://unpkg.com/mqtt/dist/mqtt.min.js"
+ASSETS = {}
+
+# Client library from vendor/ once fetched (`python webrtc_static.py --fetch`), served from memory
+# under a content-hashed URL so browsers cache it for good; without it the page needs the CDN
+MQTT_SCRIPT = vendored_script("mqtt.min.js")
+if MQTT_SCRIPT is not None:
+    ASSETS[MQTT_SCRIPT.url] = MQTT_SCRIPT
+    HTML_CONTENT = HTML_CONTENT.replace(MQTT_PAGE_URL, MQTT_SCRIPT.url)
+else:
+    HTML_CONTENT = HTML_CONTENT.replace(MQTT_PAGE_URL, VENDORED_SCRIPTS["mqtt.min.js"])
+
+# Encoded, gzipped (and brotli-compressed when available) once; requests only pick the bytes
+INDEX_PAGE = StaticAsset(HTML_CONTENT)
+ASSETS["/"] = ASSETS["/index.html"] = INDEX_PAGE
 
 if __name__ == "__main__":
-    # Allows the server to bind immediately even if the port was recently used
-    socketserver.TCPServer.allow_reuse_address = True
-    
     try:
-        with socketserver.TCPServer(("", PORT), EmbeddedHTMLHandler) as httpd:
-            print(f"Serving custom page locally at http://localhost:{PORT}")
-            print("Press Ctrl+C to stop.")
-            httpd.serve_forever()
+        print(f"Serving custom page locally at http://localhost:{PORT}")
+        print("Press Ctrl+C to stop.")
+        # One thread per connection, so a wall of kiosk screens reloading at once is not serialized
+        serve_threaded(ASSETS, PORT)
+    except KeyboardInterrupt:
+        pass
     except PermissionError:
         print(f"Error: You need root/administrator privileges to run a server on port {PORT}.", file=sys.stderr)
         print("Try running with 'sudo python server.py' on Linux/macOS, or use an Administrator command prompt on Windows.", file=sys.stderr)
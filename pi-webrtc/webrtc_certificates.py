@@ -0,0 +1,156 @@
+import os
+import time
+import logging
+import datetime
+
+from aiortc import rtcdtlstransport, rtcpeerconnection
+from aiortc.rtcdtlstransport import RTCCertificate
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+logger = logging.getLogger("WebRTC-Certificates")
+
+DEFAULT_ROTATE_AFTER = 24 * 3600  # seconds
+# aiortc certificates are valid for 30 days; never hand out one this close to expiry
+EXPIRY_MARGIN = datetime.timedelta(days=1)
+
+_generate_certificate = RTCCertificate.generateCertificate
+_active_cache = None
+
+
+class CertificateCache:
+    """
+    Hands the same DTLS certificate to every RTCPeerConnection of the process.
+
+    The certificate is generated once (or loaded from `path` when given) and
+    replaced after `rotate_after` seconds. Rotation only affects connections
+    created afterwards; established ones keep the certificate they negotiated.
+    """
+
+    def __init__(self, path=None, rotate_after=DEFAULT_ROTATE_AFTER):
+        self.path = path
+        self.rotate_after = rotate_after
+        self.generated = 0
+        self._certificate = None
+        self._created_at = 0.0
+
+    def get(self):
+        if self._certificate is None or self._needs_rotation():
+            self._certificate = self._load() or self._generate()
+        return self._certificate
+
+    def rotate(self):
+        """Forces a fresh certificate for the next connection."""
+        self._certificate = self._generate()
+
+    def _needs_rotation(self):
+        if self.rotate_after and time.time() - self._created_at >= self.rotate_after:
+            return True
+        return _expires(self._certificate) - EXPIRY_MARGIN <= datetime.datetime.now(datetime.timezone.utc)
+
+    def _generate(self):
+        started = time.perf_counter()
+        certificate = _generate_certificate()
+        self._created_at = time.time()
+        self.generated += 1
+        logger.info(f"🔐 Generated DTLS certificate in {(time.perf_counter() - started) * 1000:.1f} ms "
+                    f"({_fingerprint(certificate)})")
+        if self.path:
+            self._save(certificate)
+        return certificate
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        # A certificate already rotated away in memory must not be picked up again from disk
+        created_at = os.path.getmtime(self.path)
+        if self.rotate_after and time.time() - created_at >= self.rotate_after:
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                certificate = _certificate_from_pem(f.read())
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable certificate cache {self.path}: {e}")
+            return None
+        if _expires(certificate) - EXPIRY_MARGIN <= datetime.datetime.now(datetime.timezone.utc):
+            return None
+
+        self._created_at = created_at
+        logger.info(f"🔐 Loaded DTLS certificate from {self.path} ({_fingerprint(certificate)})")
+        return certificate
+
+    def _save(self, certificate):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(_certificate_to_pem(certificate))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not persist DTLS certificate to {self.path}: {e}")
+
+
+class _CachedCertificate(RTCCertificate):
+    @classmethod
+    def generateCertificate(cls):
+        return _active_cache.get()
+
+
+def install_certificate_cache(path=None, rotate_after=DEFAULT_ROTATE_AFTER):
+    """
+    Makes RTCPeerConnection() reuse one cached certificate instead of generating a key pair per connection.
+    aiortc has no configuration hook for certificates, so the class it looks up in its own namespace is swapped.
+    """
+    global _active_cache
+    if _active_cache is None:
+        _active_cache = CertificateCache(path, rotate_after)
+    else:
+        _active_cache.path = path
+        _active_cache.rotate_after = rotate_after
+    rtcpeerconnection.RTCCertificate = _CachedCertificate
+    return _active_cache
+
+
+def uninstall_certificate_cache():
+    global _active_cache
+    rtcpeerconnection.RTCCertificate = RTCCertificate
+    _active_cache = None
+
+
+def _expires(certificate):
+    cert = _x509(certificate._cert)
+    expires = getattr(cert, "not_valid_after_utc", None)
+    return expires or cert.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+
+
+def _fingerprint(certificate):
+    fingerprint = certificate.getFingerprints()[0]
+    return f"{fingerprint.algorithm} {fingerprint.value[:23]}…"
+
+
+def _x509(cert):
+    # Older aiortc releases keep pyOpenSSL wrappers, newer ones cryptography objects
+    return cert.to_cryptography() if hasattr(cert, "to_cryptography") else cert
+
+
+def _certificate_to_pem(certificate):
+    key = certificate._key
+    if hasattr(key, "to_cryptography_key"):
+        key = key.to_cryptography_key()
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return key_pem + _x509(certificate._cert).public_bytes(serialization.Encoding.PEM)
+
+
+def _certificate_from_pem(data):
+    key = serialization.load_pem_private_key(data, password=None)
+    cert = x509.load_pem_x509_certificate(data[data.index(b"-----BEGIN CERTIFICATE-----"):])
+    if hasattr(rtcdtlstransport, "crypto"):
+        # aiortc builds its DTLS context with pyOpenSSL and expects its wrapper types
+        key = rtcdtlstransport.crypto.PKey.from_cryptography_key(key)
+        cert = rtcdtlstransport.crypto.X509.from_cryptography(cert)
+    return RTCCertificate(key=key, cert=cert)
@@ -1,17 +1,26 @@
 import asyncio
-import json
+import concurrent.futures
 import os
 import sys
 import uuid
 import tkinter as tk
 from tkinter import messagebox, ttk
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate
-import paho.mqtt.client as mqtt
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from webrtc_certificates import install_certificate_cache
+from webrtc_signaling import CLOSE_TIMEOUT, parse_ice_candidates, PresenceTable
+from webrtc_tk_bridge import NetworkThread, TkDispatcher, sync_listbox
+from webrtc_transports import create_signaling
+
+# One DTLS certificate per process, rotated daily (see webrtc_certificates.py)
+install_certificate_cache()
 
 class WebRTCGuiChat:
-    def __init__(self, root, loop):
+    def __init__(self, root, network):
         self.root = root
-        self.loop = loop
+        self.network = network
+        self.loop = network.loop
+        # Network callbacks never touch widgets directly: they post here, Tk applies it once per frame
+        self.ui = TkDispatcher(root)
         self.peer_id = f"peer_{uuid.uuid4().hex[:4]}"
         self.remote_id = None
         self.signaling_topic = "webrtc/signaling"
@@ -20,7 +29,7 @@ class WebRTCGuiChat:
         self.channel = None
         
         # State containers
-        self.online_peers = {}        
+        self.online_peers = PresenceTable()  # expires peers that stop announcing
         self.incoming_offers = {}      
 
         # Window Config
@@ -30,14 +39,15 @@ class WebRTCGuiChat:
 
         self.setup_ui()
 
-        # Setup MQTT client
-        self.mqtt_client = mqtt.Client(
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2, 
-            client_id=self.peer_id, 
-            protocol=mqtt.MQTTv5
+        # Signaling backend picked per deployment (WEBRTC_SIGNALING, MQTT by default) on the network thread
+        self.signaling = create_signaling(
+            self.peer_id,
+            base_topic=self.signaling_topic,
+            on_message=self._process_signal,
+            on_presence=self._on_presence,
+            on_connect=self.on_mqtt_connect,
+            subscribe_presence=True
         )
-        self.mqtt_client.tls_set()
-        self.mqtt_client.username_pw_set("admin", "admin1234S")
 
     def setup_ui(self):
         # Discovery Hub
@@ -79,68 +89,45 @@ class WebRTCGuiChat:
         self.chat_display.bind("<Return>", self.on_chat_box_return)
 
     def console_log(self, text):
-        def log():
-            self.log_display.config(state="normal")
-            self.log_display.insert(tk.END, f">> {text}\n")
-            self.log_display.config(state="disabled")
-            self.log_display.see(tk.END)
-        self.loop.call_soon_threadsafe(log)
+        self.ui.append(self.log_display, f">> {text}\n")
 
     def connect_mqtt(self):
-        self.mqtt_client.on_connect = lambda c, u, f, rc, p: self.on_mqtt_connect(rc)
-        self.mqtt_client.on_message = self.on_mqtt_message
-        try:
-            self.console_log("Connecting to HiveMQ cloud pipeline...")
-            self.mqtt_client.connect("e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud", 8883, 60)
-            self.mqtt_client.loop_start()
-            
-            asyncio.run_coroutine_threadsafe(self.presence_broadcast(), self.loop)
-            asyncio.run_coroutine_threadsafe(self.peer_expiry_monitor(), self.loop)
-        except Exception as e:
-            self.console_log(f"Connection error: {e}")
+        self.console_log("Connecting to HiveMQ cloud pipeline...")
+        asyncio.run_coroutine_threadsafe(self.signaling.start(), self.loop)
+        asyncio.run_coroutine_threadsafe(self.peer_expiry_monitor(), self.loop)
 
-    def on_mqtt_connect(self, rc):
-        self.mqtt_client.subscribe(self.signaling_topic)
+    def on_mqtt_connect(self):
         self.console_log("Connected successfully to cloud network!")
 
-    async def presence_broadcast(self):
-        while True:
-            msg = {"type": "presence", "from": self.peer_id}
-            self.mqtt_client.publish(self.signaling_topic, json.dumps(msg))
-            await asyncio.sleep(2)
-
     async def peer_expiry_monitor(self):
         while True:
             await asyncio.sleep(1)
-            now = asyncio.get_event_loop().time()
-            expired = [pid for pid, ts in self.online_peers.items() if now - ts > 5]
+            # Only peers whose deadline passed are visited, however many are online
+            expired = self.online_peers.expire()
             if expired:
                 for pid in expired:
-                    del self.online_peers[pid]
-                    if pid in self.incoming_offers:
-                        del self.incoming_offers[pid]
+                    self.incoming_offers.pop(pid, None)
                 self._update_gui_lists_sync()
 
-    def on_mqtt_message(self, client, userdata, msg):
-        payload_raw = msg.payload.decode()
-        self.loop.call_soon_threadsafe(lambda: self._process_signal_in_loop(payload_raw))
+    def _on_presence(self, pid, online):
+        if not online:
+            # Empty retained payload: the peer's Last Will (or clean exit) cleared its presence
+            self._drop_peer(pid)
+            return
+        # A refresh from a known peer changes nothing on screen
+        if self.online_peers.touch(pid):
+            self.console_log(f"Discovered online node: {pid}")
+            self._update_gui_lists_sync()
 
-    def _process_signal_in_loop(self, raw_data):
+    def _process_signal(self, payload):
         try:
-            payload = json.loads(raw_data)
             msg_type = payload.get("type")
             sender = payload.get("from")
 
             if sender == self.peer_id:
                 return
 
-            if msg_type == "presence":
-                if sender not in self.online_peers:
-                    self.console_log(f"Discovered online node: {sender}")
-                self.online_peers[sender] = asyncio.get_event_loop().time()
-                self._update_gui_lists_sync()
-
-            elif payload.get("to") == self.peer_id:
+            if payload.get("to") == self.peer_id:
                 if msg_type == "offer":
                     self.console_log(f"Incoming call request from {sender}!")
                     self.incoming_offers[sender] = payload["data"]
@@ -151,38 +138,36 @@ class WebRTCGuiChat:
                         RTCSessionDescription(sdp=payload["data"]["sdp"], type=payload["data"]["type"])
                     ))
                 elif msg_type == "ice" and self.pc:
-                    data = payload["data"]
-                    candidate = RTCIceCandidate(
-                        sdpMid=data["sdpMid"], sdpMLineIndex=data["sdpMLineIndex"], candidate=data["candidate"]
-                    )
-                    asyncio.create_task(self.pc.addIceCandidate(candidate))
+                    # Accepts a single trickled candidate or a batched list
+                    for candidate in parse_ice_candidates(payload["data"]):
+                        asyncio.create_task(self.pc.addIceCandidate(candidate))
         except Exception as e:
             self.console_log(f"Signaling error: {e}")
 
+    def _drop_peer(self, pid):
+        if self.online_peers.discard(pid):
+            self.incoming_offers.pop(pid, None)
+            self.console_log(f"Node went offline: {pid}")
+            self._update_gui_lists_sync()
+
     def _update_gui_lists_sync(self):
+        # Snapshot on the network thread, which owns the peer state; only the latest refresh per frame is drawn
+        peers = list(self.online_peers)
+        offers = list(self.incoming_offers.keys())
+
         def refresh():
-            current_selection = self.peer_listbox.get(tk.ACTIVE)
-            self.peer_listbox.delete(0, tk.END)
-            for pid in self.online_peers.keys():
-                self.peer_listbox.insert(tk.END, pid)
-                
-            if current_selection and current_selection in self.online_peers:
-                idx = list(self.online_peers.keys()).index(current_selection)
-                self.peer_listbox.activate(idx)
-
-            offers = list(self.incoming_offers.keys())
+            # Inserts and removes only the changed rows; the selection stays where it was
+            sync_listbox(self.peer_listbox, peers)
+
             if offers:
                 self.btn_accept.config(text=f"🔥 Accept Call from {offers[0]}", state="normal")
             else:
                 self.btn_accept.config(text="📥 No Incoming Requests", state="disabled")
-        self.loop.call_soon_threadsafe(refresh)
+        self.ui.post(refresh, key="peer_lists")
 
     def append_incoming_text(self, sender, text):
-        def write():
-            # Injects the incoming text on a clean new line above your cursor
-            self.chat_display.insert(tk.END, f"\n[{sender}]: {text}\n")
-            self.chat_display.see(tk.END)
-        self.loop.call_soon_threadsafe(write)
+        # Injects the incoming text on a clean new line above your cursor
+        self.ui.append(self.chat_display, f"\n[{sender}]: {text}\n")
 
     def on_call_clicked(self):
         selection = self.peer_listbox.get(tk.ACTIVE)
@@ -192,10 +177,8 @@ class WebRTCGuiChat:
         asyncio.run_coroutine_threadsafe(self.dial_peer(selection), self.loop)
 
     def on_accept_clicked(self):
-        offers = list(self.incoming_offers.keys())
-        if not offers:
-            return
-        asyncio.run_coroutine_threadsafe(self.accept_incoming_call(offers[0]), self.loop)
+        # The offer is picked on the network thread, which owns incoming_offers
+        asyncio.run_coroutine_threadsafe(self.accept_incoming_call(), self.loop)
 
     def on_chat_box_return(self, event):
         """Grabs the last line typed into the box on Enter and transmits it."""
@@ -232,7 +215,7 @@ class WebRTCGuiChat:
         @self.pc.on("icecandidate")
         async def on_candidate(candidate):
             if candidate:
-                self.send_signaling_msg("ice", {
+                self.signaling.send_ice(self.remote_id, {
                     "sdpMid": candidate.sdpMid, 
                     "sdpMLineIndex": candidate.sdpMLineIndex, 
                     "candidate": candidate.candidate
@@ -248,9 +231,7 @@ class WebRTCGuiChat:
         @self.channel.on("open")
         def on_open():
             self.append_incoming_text("SYSTEM", "Connected directly! Type here & hit enter...")
-            def force_focus():
-                self.chat_display.focus_force()
-            self.loop.call_soon_threadsafe(force_focus)
+            self.ui.post(self.chat_display.focus_force)
 
         @self.channel.on("message")
         def on_message(msg):
@@ -267,7 +248,12 @@ class WebRTCGuiChat:
         await self.pc.setLocalDescription(offer)
         self.send_signaling_msg("offer", {"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type})
 
-    async def accept_incoming_call(self, target_id):
+    async def accept_incoming_call(self, target_id=None):
+        if target_id is None:
+            target_id = next(iter(self.incoming_offers), None)
+        offer_sdp = self.incoming_offers.get(target_id)
+        if offer_sdp is None:
+            return  # the caller went offline since the button was drawn
         self.remote_id = target_id
         self.console_log(f"Answering offer from {target_id}...")
         self.init_peer_connection()
@@ -277,35 +263,29 @@ class WebRTCGuiChat:
             self.channel = channel
             self.attach_datachannel_listeners()
 
-        offer_sdp = self.incoming_offers[target_id]
         await self.pc.setRemoteDescription(RTCSessionDescription(sdp=offer_sdp["sdp"], type=offer_sdp["type"]))
         answer = await self.pc.createAnswer()
         await self.pc.setLocalDescription(answer)
         self.send_signaling_msg("answer", {"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type})
 
     def send_signaling_msg(self, msg_type, data):
-        payload = {"type": msg_type, "from": self.peer_id, "to": self.remote_id, "data": data}
-        self.mqtt_client.publish(self.signaling_topic, json.dumps(payload))
+        self.signaling.send(msg_type, self.remote_id, data)
 
     def on_close(self):
-        self.mqtt_client.loop_stop()
+        try:
+            # Signaling belongs to the network thread; wait until our presence clear is sent before exiting
+            asyncio.run_coroutine_threadsafe(self.signaling.aclose(), self.loop).result(CLOSE_TIMEOUT + 1)
+        except concurrent.futures.TimeoutError:
+            pass
         self.root.destroy()
         os._exit(0)
 
-async def run_tk_loop(root, interval=0.03):
-    try:
-        while True:
-            root.update()
-            await asyncio.sleep(interval)
-    except tk.TclError:
-        pass
-
 if __name__ == "__main__":
     root = tk.Tk()
-    async_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(async_loop)
-    
-    app = WebRTCGuiChat(root, async_loop)
+    # aiortc, SCTP and signaling run on their own loop, so redraws and dialogs never stall them
+    network = NetworkThread().start()
+
+    app = WebRTCGuiChat(root, network)
     app.connect_mqtt()
 
-    async_loop.run_until_complete(run_tk_loop(root))
+    root.mainloop()
@@ -0,0 +1,540 @@
+"""
+Headless file transfer: the engine of webrtc_file-tranfer-gui.py without Tk, for
+scripts, servers and measurements.
+
+    python webrtc_file-tranfer-cli.py receive [--dir DIR] [--once]
+    python webrtc_file-tranfer-cli.py send [--to PEER] PATH [PATH ...]
+    python webrtc_file-tranfer-cli.py bench [--sizes 1M,16M,64M] [--chunks 16K,64K] [--channels 1,4]
+
+send and receive meet through the signaling backend named by WEBRTC_SIGNALING
+(MQTT by default) on the GUI's topic, so the other end may be the GUI as well.
+
+bench needs no broker: both peers live in one process and connect over loopback
+ICE. Every case runs in a fresh process, so its CPU time and peak RSS are its own.
+Use --json to keep the numbers and compare them between revisions.
+
+Optional packages: zstandard (zstd compression) and numpy (delta sync chunking,
+about six times faster than the pure Python scan).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from aiortc import RTCPeerConnection, RTCConfiguration, RTCSessionDescription
+from webrtc_certificates import install_certificate_cache
+from webrtc_file_transfer import (FileReceiver, TransferQueue, negotiated_max_message_size, parse_stripe_label,
+                                  DEFAULT_CONCURRENCY, DOWNLOAD_DIR, INITIAL_CHUNK_SIZE, MAX_STRIPES,
+                                  STRIPE_HEADER)
+from webrtc_signaling import parse_ice_candidates
+from webrtc_transports import SIGNALING_ENV, create_signaling
+
+# Logging Setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+logging.getLogger("aioice").setLevel(logging.WARNING)
+logger = logging.getLogger("WebRTC-FileCLI")
+
+# Same room as webrtc_file-tranfer-gui.py
+FILE_SIGNALING_TOPIC = "webrtc/file_signaling"
+CONNECT_TIMEOUT = 30  # seconds from offer to an open data channel
+RETRY_DELAY = 2
+DEFAULT_RETRIES = 3
+
+# Loopback only: no STUN round trips, so the numbers are the transfer engine's
+LOOPBACK_CONFIG = RTCConfiguration(iceServers=[])
+BENCH_SIZES = "1M,16M,64M"
+BENCH_CHANNELS = "1,4"
+BENCH_WARMUP_SIZE = 1 << 20  # sent first on every pair so SCTP/DTLS ramp-up is not timed as throughput
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def parse_size(text):
+    """'64K' -> 65536; plain numbers are bytes."""
+    text = text.strip().upper().removesuffix("B")
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+
+def size_list(text):
+    try:
+        return [parse_size(part) for part in text.split(",") if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a list of sizes: {text}")
+
+
+def chunk_list(text):
+    """Chunk sizes for bench; 'auto' is whatever the two ends negotiate."""
+    chunks = [None if part.strip().lower() == "auto" else parse_size(part) for part in text.split(",") if part.strip()]
+    if any(chunk is not None and chunk < INITIAL_CHUNK_SIZE for chunk in chunks):
+        raise argparse.ArgumentTypeError(f"chunks start at {INITIAL_CHUNK_SIZE} bytes, so none can be smaller")
+    return chunks
+
+
+def int_list(text):
+    try:
+        return [int(part) for part in text.split(",") if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a list of numbers: {text}")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB, None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)  # bytes on macOS, KiB elsewhere
+
+
+class HeadlessPeer:
+    """
+    One signaling identity and at most one peer connection, driven from the command
+    line instead of buttons. Speaks the GUI's signaling, so the two interoperate.
+    """
+
+    def __init__(self, download_dir=DOWNLOAD_DIR, accept_from=None, peer_id=None):
+        self.peer_id = peer_id or f"cli_{uuid.uuid4().hex[:4]}"
+        self.remote_id = None
+        self.accept_from = accept_from  # receive: only answer offers from this peer (any peer if None)
+        self.accepting = False
+        self.pc = None
+        self.channel = None
+
+        self.peer_found = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.downloads_done = asyncio.Event()
+        self.online_peers = []
+        self.last_reported_progress = -1
+
+        self.receiver = FileReceiver(
+            download_dir,
+            on_start=self.on_download_started,
+            on_progress=self.on_download_progress,
+            on_complete=self.on_download_complete,
+            on_error=self.on_download_failed,
+            on_manifest=self.on_download_batch
+        )
+        self.signaling = create_signaling(
+            self.peer_id,
+            base_topic=FILE_SIGNALING_TOPIC,
+            on_message=self._process_signal,
+            on_presence=self._on_presence,
+            on_connect=lambda: logger.info("🔌 Signaling connected"),
+            subscribe_presence=True
+        )
+
+    async def start(self):
+        logger.info(f"🚀 Peer {self.peer_id} joining {FILE_SIGNALING_TOPIC}")
+        await self.signaling.start()
+
+    async def close(self):
+        await self._close_connection()
+        self.signaling.close()
+
+    # --- Signaling ---
+
+    def _on_presence(self, pid, online):
+        if not online:
+            if pid in self.online_peers:
+                self.online_peers.remove(pid)
+                logger.info(f"👋 {pid} went offline")
+            return
+        if pid != self.peer_id and pid not in self.online_peers:
+            self.online_peers.append(pid)
+            logger.info(f"👀 Found {pid}")
+            self.peer_found.set()
+
+    def _process_signal(self, payload):
+        msg_type = payload.get("type")
+        sender = payload.get("from")
+        if sender == self.peer_id or payload.get("to") != self.peer_id:
+            return
+
+        if msg_type == "offer":
+            if self.accepting and self.accept_from in (None, sender):
+                asyncio.ensure_future(self.accept(sender, payload["data"]))
+            else:
+                logger.info(f"🚫 Ignoring offer from {sender}")
+        elif msg_type == "answer" and self.pc and sender == self.remote_id:
+            asyncio.ensure_future(self.pc.setRemoteDescription(
+                RTCSessionDescription(sdp=payload["data"]["sdp"], type=payload["data"]["type"])
+            ))
+        elif msg_type == "ice" and self.pc and sender == self.remote_id:
+            for candidate in parse_ice_candidates(payload["data"]):
+                asyncio.ensure_future(self.pc.addIceCandidate(candidate))
+
+    async def wait_for_peer(self):
+        """First peer seen on the topic (the GUI's and other CLIs' presence)."""
+        await self.peer_found.wait()
+        return self.online_peers[0]
+
+    # --- Connection ---
+
+    async def dial(self, target_id):
+        await self._new_connection(target_id)
+        self._use_channel(self.pc.createDataChannel("file_stream"))
+        await self.pc.setLocalDescription(await self.pc.createOffer())
+        self.signaling.send("offer", target_id, {"sdp": self.pc.localDescription.sdp,
+                                                 "type": self.pc.localDescription.type})
+
+    async def accept(self, target_id, offer):
+        logger.info(f"🤝 Accepting connection from {target_id}")
+        await self._new_connection(target_id)
+        await self.pc.setRemoteDescription(RTCSessionDescription(sdp=offer["sdp"], type=offer["type"]))
+        await self.pc.setLocalDescription(await self.pc.createAnswer())
+        self.signaling.send("answer", target_id, {"sdp": self.pc.localDescription.sdp,
+                                                  "type": self.pc.localDescription.type})
+
+    async def _new_connection(self, target_id):
+        await self._close_connection()
+        self.remote_id = target_id
+        self.ready.clear()
+        self.pc = pc = RTCPeerConnection()
+
+        @pc.on("icecandidate")
+        async def on_candidate(candidate):
+            if candidate:
+                self.signaling.send_ice(target_id, {
+                    "sdpMid": candidate.sdpMid, "sdpMLineIndex": candidate.sdpMLineIndex, "candidate": candidate.candidate
+                })
+
+        @pc.on("connectionstatechange")
+        async def on_state_change():
+            logger.info(f"🔗 Link to {target_id}: {pc.connectionState}")
+            if pc.connectionState in ("failed", "closed") and pc is self.pc:
+                self.ready.clear()
+                # Keep partial downloads (and their block bitmaps) for when the sender reconnects
+                await self.receiver.close()
+
+        @pc.on("datachannel")
+        def on_datachannel(channel):
+            if parse_stripe_label(channel.label) is not None:
+                self.receiver.attach_stripe(channel)
+            else:
+                self._use_channel(channel)
+
+    def _use_channel(self, channel):
+        self.channel = channel
+        channel.on("open", self.ready.set)
+        if channel.readyState == "open":
+            self.ready.set()
+        self.receiver.attach(channel)
+
+    async def _close_connection(self):
+        pc, self.pc, self.channel = self.pc, None, None
+        if pc is not None:
+            await pc.close()
+            await self.receiver.close()
+
+    # --- Sending ---
+
+    async def send(self, upload, target_id, retries=DEFAULT_RETRIES):
+        """Dials target_id and sends `upload`; an interrupted link is redialled and the queue resumes."""
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(RETRY_DELAY)
+                logger.info(f"🔁 Reconnecting to {target_id} (attempt {attempt} of {retries})")
+            await self.dial(target_id)
+            try:
+                await asyncio.wait_for(self.ready.wait(), CONNECT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ No data channel to {target_id} after {CONNECT_TIMEOUT}s")
+                continue
+            try:
+                return await upload.send(self.channel, self.pc, negotiated_max_message_size(self.pc))
+            except ConnectionError as e:
+                logger.warning(f"⚠️ Upload interrupted: {e}")
+        raise ConnectionError(f"gave up on {target_id} after {retries + 1} attempts")
+
+    def on_upload_progress(self, sent, total):
+        self._report_progress("⬆️ Sent", int(sent * 100 / total) if total else 100)
+
+    # --- Receiving ---
+
+    def on_download_started(self, incoming):
+        stripes = f" over {incoming.stripes} channels" if incoming.stripes > 1 else ""
+        resumed = f", resuming at {incoming.resumed} bytes" if incoming.resumed else ""
+        logger.info(f"📥 Receiving {incoming.name} ({incoming.size} bytes{stripes}{resumed})")
+
+    def on_download_batch(self, batch):
+        self.last_reported_progress = -1
+        logger.info(f"📦 Incoming batch: {batch.get('files')} files ({batch.get('size')} bytes) "
+                    f"in {batch.get('transfers')} transfers")
+
+    def on_download_progress(self, incoming):
+        progress = self.receiver.batch_progress
+        self._report_progress("⬇️ Received", incoming.progress if progress is None else progress)
+
+    def on_download_complete(self, incoming, output_path):
+        if incoming.members:
+            logger.info(f"✅ {len(incoming.members)} files unpacked into {output_path}")
+        else:
+            logger.info(f"✅ Saved {output_path}")
+        if self.receiver.batch and not self.receiver.batch_complete:
+            return
+        self.receiver.batch = None
+        self.last_reported_progress = -1
+        self.downloads_done.set()
+
+    def on_download_failed(self, incoming, error):
+        logger.error(f"❌ {incoming.name}: {error}")
+
+    def _report_progress(self, label, progress):
+        # One line per 10%, not per chunk
+        step = progress // 10 * 10
+        if step > self.last_reported_progress:
+            self.last_reported_progress = step
+            logger.info(f"{label} {step}%")
+
+
+async def run_receive(args):
+    peer = HeadlessPeer(args.dir, accept_from=args.accept_from, peer_id=args.peer_id)
+    peer.accepting = True
+    await peer.start()
+    logger.info(f"📂 Saving into {os.path.abspath(args.dir)}, waiting for senders...")
+    try:
+        if args.once:
+            await peer.downloads_done.wait()
+            # Let file_done reach the sender before the link goes away
+            await asyncio.sleep(1)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await peer.close()
+    return 0
+
+
+async def run_send(args):
+    peer = HeadlessPeer(peer_id=args.peer_id)
+    try:
+        # Walking a large folder must not stall signaling
+        upload = await asyncio.get_running_loop().run_in_executor(None, lambda: TransferQueue(
+            args.paths, args.concurrency, args.channels, not args.no_compress, args.delta,
+            on_progress=peer.on_upload_progress))
+    except OSError as e:
+        logger.error(f"❌ Cannot read {e.filename}: {e.strerror}")
+        return 1
+
+    await peer.start()
+    try:
+        target = args.to
+        if target is None:
+            logger.info("🔎 Waiting for a peer on the topic...")
+            target = await peer.wait_for_peer()
+        logger.info(f"📤 Sending {upload.files} file(s), {upload.size} bytes to {target}")
+        await peer.send(upload, target, args.retries)
+    except ConnectionError as e:
+        logger.error(f"❌ {e}")
+        return 1
+    finally:
+        await peer.close()
+
+    wire = sum(item.wire_bytes for item in upload.uploads)
+    copied = sum(item.copied for item in upload.uploads)
+    logger.info(f"🏁 Done: {upload.throughput:.1f} MB/s, {wire} bytes on the wire, {copied} bytes reused, "
+                f"{len(upload.failed)} failed")
+    for name, error in upload.failed:
+        logger.error(f"❌ {name}: {error}")
+    return 1 if upload.failed else 0
+
+
+# --- Loopback benchmark ---
+
+def write_payload(path, size, data):
+    """random: incompressible bytes. text: CSV-like rows that compress well, as logs and exports do."""
+    with open(path, "wb") as f:
+        written = row = 0
+        while written < size:
+            if data == "random":
+                piece = os.urandom(min(1 << 20, size - written))
+            else:
+                piece = "".join(f"{n},{n * 7919 % 100003},sensor-{n % 64},{n * 37 % 1000 / 10:.1f},ok\n"
+                                for n in range(row, row + 20000)).encode()[:size - written]
+                row += 20000
+            f.write(piece)
+            written += len(piece)
+
+async def loopback_pair(receiver):
+    """Offerer and answerer in this process; returns (offerer, answerer, control channel) once it is open."""
+    offerer = RTCPeerConnection(LOOPBACK_CONFIG)
+    answerer = RTCPeerConnection(LOOPBACK_CONFIG)
+    channel = offerer.createDataChannel("file_stream")
+    opened = asyncio.Event()
+    channel.on("open", opened.set)
+
+    @answerer.on("datachannel")
+    def on_datachannel(incoming):
+        if parse_stripe_label(incoming.label) is not None:
+            receiver.attach_stripe(incoming)
+        else:
+            receiver.attach(incoming)
+
+    await offerer.setLocalDescription(await offerer.createOffer())
+    await answerer.setRemoteDescription(offerer.localDescription)
+    await answerer.setLocalDescription(await answerer.createAnswer())
+    await offerer.setRemoteDescription(answerer.localDescription)
+    await asyncio.wait_for(opened.wait(), timeout=10)
+    return offerer, answerer, channel
+
+
+async def bench_case(size, chunk, channels, data, compress, delta):
+    with tempfile.TemporaryDirectory(prefix="webrtc-bench-") as workdir:
+        source = os.path.join(workdir, f"payload-{format_size(size)}.bin")
+        write_payload(source, size, data)
+        receiver = FileReceiver(os.path.join(workdir, "received"))
+        offerer, answerer, channel = await loopback_pair(receiver)
+        negotiated = negotiated_max_message_size(offerer)
+        max_message_size = negotiated if chunk is None else min(negotiated, chunk + STRIPE_HEADER.size)
+
+        # A brand-new association is several times slower for its first megabyte (cwnd ramp-up,
+        # stripe channels opening); time that separately and measure the payload on a warm link
+        warmup = os.path.join(workdir, "warmup.bin")
+        write_payload(warmup, BENCH_WARMUP_SIZE, data)
+        warm_started = time.perf_counter()
+        warmed = await TransferQueue([warmup], 1, channels, compress, delta).send(channel, offerer, max_message_size)
+        setup = time.perf_counter() - warm_started
+
+        upload = TransferQueue([source], 1, channels, compress, delta)
+        cpu_started = time.process_time()  # all threads: hashing, compression and disk pools included
+        started = time.perf_counter()
+        await upload.send(channel, offerer, max_message_size)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+        received = os.path.join(receiver.download_dir, os.path.basename(source))
+        ok = not warmed.failed and not upload.failed and os.path.exists(received) and os.path.getsize(received) == size
+        await offerer.close()
+        await answerer.close()
+        await receiver.close()
+
+    return {
+        "size": size,
+        "chunk": max_message_size - STRIPE_HEADER.size,
+        "channels": channels,
+        "data": data,
+        "ok": ok,
+        "seconds": elapsed,
+        "setup_seconds": setup,
+        "mb_per_s": size / elapsed / 1e6,
+        "wire_ratio": sum(item.wire_bytes for item in upload.uploads) / size if size else 1.0,
+        "cpu_seconds": cpu,
+        "cpu_percent": cpu * 100 / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_bench_case(*case):
+    """Entry point of a benchmark child process."""
+    logging.disable(logging.WARNING)  # per-file log lines would be measured too
+    return asyncio.run(bench_case(*case))
+
+
+def run_bench(args):
+    cases = list(itertools.product(args.sizes, args.chunks, args.channels))
+    print("-" * 80)
+    print(f"⏱️ FILE TRANSFER BENCHMARK ({len(cases)} cases x {args.repeat}, {args.data} data, loopback)")
+    print("-" * 80)
+    print(f"{'size':>6} {'chunk':>6} {'chans':>5} | {'MB/s':>7} {'setup':>6} {'wire':>5} {'CPU s':>6} {'CPU %':>6} "
+          f"{'RSS MB':>7} | ok")
+
+    # spawn, not fork: a child must not start out with the parent's (or a previous case's) memory
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size, chunk, channels in cases:
+        runs = []
+        for _ in range(args.repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(run_bench_case, size, chunk, channels, args.data,
+                                        not args.no_compress, args.delta).result())
+        # Median run by throughput; RSS is the worst seen
+        runs.sort(key=lambda run: run["mb_per_s"])
+        result = dict(runs[len(runs) // 2], runs=[run["mb_per_s"] for run in runs],
+                      ok=all(run["ok"] for run in runs))
+        if result["peak_rss_mb"] is not None:
+            result["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+        results.append(result)
+
+        rss = f"{result['peak_rss_mb']:7.1f}" if result["peak_rss_mb"] is not None else f"{'n/a':>7}"
+        spread = f"  (±{statistics.pstdev(result['runs']):.1f})" if len(runs) > 1 else ""
+        print(f"{format_size(size):>6} {format_size(result['chunk']):>6} {channels:>5} | "
+              f"{result['mb_per_s']:7.1f} {result['setup_seconds']:6.2f} {result['wire_ratio']:5.0%} {result['cpu_seconds']:6.2f} "
+              f"{result['cpu_percent']:6.0f} {rss} | {'✅' if result['ok'] else '❌'}{spread}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"created": time.time(), "python": sys.version.split()[0], "cases": results}, f, indent=2)
+        print(f"results written to {args.json}")
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless WebRTC file transfer and loopback benchmark")
+    parser.add_argument("--peer-id", help="signaling identity (random by default)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    receive = commands.add_parser("receive", help="accept connections and save incoming files")
+    receive.add_argument("--dir", default=DOWNLOAD_DIR, help=f"download directory (default: {DOWNLOAD_DIR})")
+    receive.add_argument("--from", dest="accept_from", metavar="PEER", help="only accept this peer")
+    receive.add_argument("--once", action="store_true", help="exit after the first complete file or batch")
+
+    send = commands.add_parser("send", help="send files or folders to a receiver")
+    send.add_argument("paths", nargs="+", help="files and/or directories")
+    send.add_argument("--to", metavar="PEER", help="receiver's peer id (default: the first peer seen)")
+    send.add_argument("--channels", type=int, default=1, choices=range(1, MAX_STRIPES + 1), metavar="N",
+                      help=f"parallel data channels per file, 1-{MAX_STRIPES}")
+    send.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="files in flight")
+    send.add_argument("--no-compress", action="store_true", help="never compress blocks")
+    send.add_argument("--delta", action="store_true", help="reuse what the receiver has of an older version (slow links)")
+    send.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="reconnects after a broken link")
+
+    bench = commands.add_parser("bench", help="loopback throughput, CPU and memory, no broker needed")
+    bench.add_argument("--sizes", type=size_list, default=size_list(BENCH_SIZES), help=f"default {BENCH_SIZES}")
+    bench.add_argument("--chunks", type=chunk_list, default=[None],
+                       help="largest chunk per message, e.g. 16K,32K,64K (default: auto, the negotiated limit)")
+    bench.add_argument("--channels", type=int_list, default=int_list(BENCH_CHANNELS),
+                       help=f"data channels per file (default {BENCH_CHANNELS})")
+    bench.add_argument("--data", choices=("random", "text"), default="random",
+                       help="incompressible or CSV-like payload (default random)")
+    bench.add_argument("--no-compress", action="store_true", help="never compress blocks")
+    bench.add_argument("--delta", action="store_true", help="include the delta-sync handshake")
+    bench.add_argument("--repeat", type=int, default=1, help="runs per case; the median is reported")
+    bench.add_argument("--json", metavar="FILE", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        if any(not 1 <= channels <= MAX_STRIPES for channels in args.channels):
+            parser.error(f"--channels must be between 1 and {MAX_STRIPES}")
+        return run_bench(args)
+
+    # One DTLS certificate per process, rotated daily (see webrtc_certificates.py)
+    install_certificate_cache()
+    logger.info(f"Signaling via {os.environ.get(SIGNALING_ENV, 'mqtt')}")
+    return asyncio.run(run_receive(args) if args.command == "receive" else run_send(args))
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
@@ -1,19 +1,28 @@
 import asyncio
-import json
+import concurrent.futures
 import os
 import sys
 import uuid
 import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate
-import paho.mqtt.client as mqtt
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from webrtc_certificates import install_certificate_cache
+from webrtc_file_transfer import (FileReceiver, TransferQueue, negotiated_max_message_size, parse_stripe_label,
+                                  DEFAULT_CONCURRENCY, MAX_CONCURRENCY, MAX_STRIPES)
+from webrtc_signaling import CLOSE_TIMEOUT, parse_ice_candidates, PresenceTable
+from webrtc_tk_bridge import NetworkThread, TkDispatcher, sync_listbox
+from webrtc_transports import create_signaling
 
-CHUNK_SIZE = 16384  # 16 KB optimized chunks for WebRTC DataChannels
+# One DTLS certificate per process, rotated daily (see webrtc_certificates.py)
+install_certificate_cache()
 
 class WebRTCFileTransfer:
-    def __init__(self, root, loop):
+    def __init__(self, root, network):
         self.root = root
-        self.loop = loop
+        self.network = network
+        self.loop = network.loop
+        # Network callbacks never touch widgets directly: they post here, Tk applies it once per frame
+        self.ui = TkDispatcher(root)
         self.peer_id = f"peer_{uuid.uuid4().hex[:4]}"
         self.remote_id = None
         self.signaling_topic = "webrtc/file_signaling"
@@ -22,10 +31,17 @@ class WebRTCFileTransfer:
         self.channel = None
         
         # Internal Transfer Memory Map
-        self.online_peers = {}        
+        self.online_peers = PresenceTable()  # expires peers that stop announcing
         self.incoming_offers = {}      
-        self.incoming_file_metadata = {}
-        self.received_chunks = []
+        # Streams downloads to disk (in-band or striped over extra channels)
+        self.interrupted_upload = None  # TransferQueue to continue once a link is back
+        self.receiver = FileReceiver(
+            on_start=self.on_download_started,
+            on_progress=self.on_download_progress,
+            on_complete=self.on_download_complete,
+            on_error=self.on_download_failed,
+            on_manifest=self.on_download_batch
+        )
 
         # Window Setup
         self.root.title(f"P2P File Stream Engine - {self.peer_id}")
@@ -34,14 +50,15 @@ class WebRTCFileTransfer:
 
         self.setup_ui()
 
-        # Connect Signaler Pipeline
-        self.mqtt_client = mqtt.Client(
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2, 
-            client_id=self.peer_id, 
-            protocol=mqtt.MQTTv5
+        # Signaling backend picked per deployment (WEBRTC_SIGNALING, MQTT by default) on the network thread
+        self.signaling = create_signaling(
+            self.peer_id,
+            base_topic=self.signaling_topic,
+            on_message=self._process_signal,
+            on_presence=self._on_presence,
+            on_connect=self.on_mqtt_connect,
+            subscribe_presence=True
         )
-        self.mqtt_client.tls_set()
-        self.mqtt_client.username_pw_set("admin", "admin1234S")
 
     def setup_ui(self):
         # 1. Peer Discovery Segment
@@ -65,8 +82,29 @@ class WebRTCFileTransfer:
         self.file_frame = ttk.LabelFrame(self.root, text=" Shared P2P File Pipeline ", padding=10)
         self.file_frame.pack(fill="x", padx=10, pady=5)
 
-        self.btn_select_file = ttk.Button(self.file_frame, text="📁 Select File to Stream", command=self.on_select_file_clicked, state="disabled")
+        self.btn_select_file = ttk.Button(self.file_frame, text="📁 Select Files to Stream", command=self.on_select_file_clicked, state="disabled")
         self.btn_select_file.pack(fill="x", pady=2)
+        self.btn_select_folder = ttk.Button(self.file_frame, text="🗂️ Select Folder to Stream", command=self.on_select_folder_clicked, state="disabled")
+        self.btn_select_folder.pack(fill="x", pady=2)
+
+        # Parallel channels per upload: >1 stripes the file over unordered channels (helps on lossy links)
+        self.stripe_frame = ttk.Frame(self.file_frame)
+        self.stripe_frame.pack(fill="x", pady=2)
+        ttk.Label(self.stripe_frame, text="Parallel channels:").pack(side="left")
+        self.stripe_count = tk.IntVar(value=1)
+        ttk.Spinbox(self.stripe_frame, from_=1, to=MAX_STRIPES, width=4, textvariable=self.stripe_count,
+                    state="readonly").pack(side="left", padx=5)
+        # Compress uploads when the peer supports it; incompressible blocks are detected and sent as is
+        self.compress_uploads = tk.BooleanVar(value=True)
+        ttk.Checkbutton(self.stripe_frame, text="Compress", variable=self.compress_uploads).pack(side="left", padx=10)
+        # Delta sync: only send what changed when the peer already has a file of the same name
+        self.delta_uploads = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.stripe_frame, text="Delta sync", variable=self.delta_uploads).pack(side="left")
+        # Files in flight at once when sending several (small files are bundled regardless)
+        self.concurrency = tk.IntVar(value=DEFAULT_CONCURRENCY)
+        ttk.Spinbox(self.stripe_frame, from_=1, to=MAX_CONCURRENCY, width=4, textvariable=self.concurrency,
+                    state="readonly").pack(side="right")
+        ttk.Label(self.stripe_frame, text="Files in flight:").pack(side="right", padx=5)
 
         self.progress_bar = ttk.Progressbar(self.file_frame, orient="horizontal", mode="determinate")
         self.progress_bar.pack(fill="x", pady=5)
@@ -81,74 +119,51 @@ class WebRTCFileTransfer:
         self.log_display.pack(fill="both", expand=True)
 
     def console_log(self, text):
-        def log():
-            self.log_display.config(state="normal")
-            self.log_display.insert(tk.END, f">> {text}\n")
-            self.log_display.config(state="disabled")
-            self.log_display.see(tk.END)
-        self.loop.call_soon_threadsafe(log)
+        self.ui.append(self.log_display, f">> {text}\n")
 
     def set_status(self, text):
-        self.loop.call_soon_threadsafe(lambda: self.lbl_status.config(text=f"Status: {text}"))
+        self.ui.post(lambda: self.lbl_status.config(text=f"Status: {text}"), key="status")
 
     def set_progress(self, val):
-        self.loop.call_soon_threadsafe(lambda: self.progress_bar.config(value=val))
+        self.ui.post(lambda: self.progress_bar.config(value=val), key="progress")
 
     def connect_mqtt(self):
-        self.mqtt_client.on_connect = lambda c, u, f, rc, p: self.on_mqtt_connect(rc)
-        self.mqtt_client.on_message = self.on_mqtt_message
-        try:
-            self.console_log("Connecting to core MQTT control broker...")
-            self.mqtt_client.connect("e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud", 8883, 60)
-            self.mqtt_client.loop_start()
-            
-            asyncio.run_coroutine_threadsafe(self.presence_broadcast(), self.loop)
-            asyncio.run_coroutine_threadsafe(self.peer_expiry_monitor(), self.loop)
-        except Exception as e:
-            self.console_log(f"Broker error: {e}")
+        self.console_log("Connecting to core MQTT control broker...")
+        asyncio.run_coroutine_threadsafe(self.signaling.start(), self.loop)
+        asyncio.run_coroutine_threadsafe(self.peer_expiry_monitor(), self.loop)
 
-    def on_mqtt_connect(self, rc):
-        self.mqtt_client.subscribe(self.signaling_topic)
+    def on_mqtt_connect(self):
         self.console_log("Mesh signaling route connected successfully.")
 
-    async def presence_broadcast(self):
-        while True:
-            msg = {"type": "presence", "from": self.peer_id}
-            self.mqtt_client.publish(self.signaling_topic, json.dumps(msg))
-            await asyncio.sleep(2)
-
     async def peer_expiry_monitor(self):
         while True:
             await asyncio.sleep(1)
-            now = asyncio.get_event_loop().time()
-            expired = [pid for pid, ts in self.online_peers.items() if now - ts > 5]
+            # Only peers whose deadline passed are visited, however many are online
+            expired = self.online_peers.expire()
             if expired:
                 for pid in expired:
-                    del self.online_peers[pid]
-                    if pid in self.incoming_offers:
-                        del self.incoming_offers[pid]
+                    self.incoming_offers.pop(pid, None)
                 self._update_gui_lists_sync()
 
-    def on_mqtt_message(self, client, userdata, msg):
-        payload_raw = msg.payload.decode()
-        self.loop.call_soon_threadsafe(lambda: self._process_signal_in_loop(payload_raw))
+    def _on_presence(self, pid, online):
+        if not online:
+            # Empty retained payload: the peer's Last Will (or clean exit) cleared its presence
+            self._drop_peer(pid)
+            return
+        # A refresh from a known peer changes nothing on screen
+        if self.online_peers.touch(pid):
+            self.console_log(f"Found node available for sync: {pid}")
+            self._update_gui_lists_sync()
 
-    def _process_signal_in_loop(self, raw_data):
+    def _process_signal(self, payload):
         try:
-            payload = json.loads(raw_data)
             msg_type = payload.get("type")
             sender = payload.get("from")
 
             if sender == self.peer_id:
                 return
 
-            if msg_type == "presence":
-                if sender not in self.online_peers:
-                    self.console_log(f"Found node available for sync: {sender}")
-                self.online_peers[sender] = asyncio.get_event_loop().time()
-                self._update_gui_lists_sync()
-
-            elif payload.get("to") == self.peer_id:
+            if payload.get("to") == self.peer_id:
                 if msg_type == "offer":
                     self.console_log(f"Incoming connection request from {sender}")
                     self.incoming_offers[sender] = payload["data"]
@@ -158,30 +173,32 @@ class WebRTCFileTransfer:
                         RTCSessionDescription(sdp=payload["data"]["sdp"], type=payload["data"]["type"])
                     ))
                 elif msg_type == "ice" and self.pc:
-                    data = payload["data"]
-                    candidate = RTCIceCandidate(
-                        sdpMid=data["sdpMid"], sdpMLineIndex=data["sdpMLineIndex"], candidate=data["candidate"]
-                    )
-                    asyncio.create_task(self.pc.addIceCandidate(candidate))
+                    # Accepts a single trickled candidate or a batched list
+                    for candidate in parse_ice_candidates(payload["data"]):
+                        asyncio.create_task(self.pc.addIceCandidate(candidate))
         except Exception as e:
             self.console_log(f"Signaling routing leak: {e}")
 
+    def _drop_peer(self, pid):
+        if self.online_peers.discard(pid):
+            self.incoming_offers.pop(pid, None)
+            self.console_log(f"Node went offline: {pid}")
+            self._update_gui_lists_sync()
+
     def _update_gui_lists_sync(self):
+        # Snapshot on the network thread, which owns the peer state; only the latest refresh per frame is drawn
+        peers = list(self.online_peers)
+        offers = list(self.incoming_offers.keys())
+
         def refresh():
-            current_selection = self.peer_listbox.get(tk.ACTIVE)
-            self.peer_listbox.delete(0, tk.END)
-            for pid in self.online_peers.keys():
-                self.peer_listbox.insert(tk.END, pid)
-            if current_selection and current_selection in self.online_peers:
-                idx = list(self.online_peers.keys()).index(current_selection)
-                self.peer_listbox.activate(idx)
-
-            offers = list(self.incoming_offers.keys())
+            # Inserts and removes only the changed rows; the selection stays where it was
+            sync_listbox(self.peer_listbox, peers)
+
             if offers:
                 self.btn_accept.config(text=f"🔥 Accept Link from {offers[0]}", state="normal")
             else:
                 self.btn_accept.config(text="📥 No Incoming Requests", state="disabled")
-        self.loop.call_soon_threadsafe(refresh)
+        self.ui.post(refresh, key="peer_lists")
 
     def on_connect_clicked(self):
         selection = self.peer_listbox.get(tk.ACTIVE)
@@ -191,15 +208,29 @@ class WebRTCFileTransfer:
         asyncio.run_coroutine_threadsafe(self.dial_peer(selection), self.loop)
 
     def on_accept_clicked(self):
-        offers = list(self.incoming_offers.keys())
-        if not offers:
-            return
-        asyncio.run_coroutine_threadsafe(self.accept_incoming_call(offers[0]), self.loop)
+        # The offer is picked on the network thread, which owns incoming_offers
+        asyncio.run_coroutine_threadsafe(self.accept_incoming_call(), self.loop)
 
     def on_select_file_clicked(self):
-        file_path = filedialog.askopenfilename()
-        if file_path:
-            asyncio.run_coroutine_threadsafe(self.stream_file_payload(file_path), self.loop)
+        file_paths = filedialog.askopenfilenames()
+        if file_paths:
+            self.start_upload(list(file_paths))
+
+    def on_select_folder_clicked(self):
+        folder = filedialog.askdirectory()
+        if folder:
+            self.start_upload([folder])
+
+    def start_upload(self, paths):
+        options = dict(concurrency=self.concurrency.get(), stripes=self.stripe_count.get(),
+                       compress=self.compress_uploads.get(), delta=self.delta_uploads.get())
+        asyncio.run_coroutine_threadsafe(self.stream_file_payload(paths, **options), self.loop)
+
+    def set_upload_buttons(self, state):
+        def apply():
+            self.btn_select_file.config(state=state)
+            self.btn_select_folder.config(state=state)
+        self.ui.post(apply, key="upload_buttons")
 
     def init_peer_connection(self):
         self.pc = RTCPeerConnection()
@@ -207,7 +238,7 @@ class WebRTCFileTransfer:
         @self.pc.on("icecandidate")
         async def on_candidate(candidate):
             if candidate:
-                self.send_signaling_msg("ice", {
+                self.signaling.send_ice(self.remote_id, {
                     "sdpMid": candidate.sdpMid, "sdpMLineIndex": candidate.sdpMLineIndex, "candidate": candidate.candidate
                 })
 
@@ -216,105 +247,134 @@ class WebRTCFileTransfer:
             self.console_log(f"WebRTC Link State Change: {self.pc.connectionState}")
             if self.pc.connectionState in ["failed", "closed"]:
                 self.set_status("Link Broken/Disconnected")
-                self.loop.call_soon_threadsafe(lambda: self.btn_select_file.config(state="disabled"))
+                self.set_upload_buttons("disabled")
+                # Keep partial downloads (and their block bitmaps) for when the sender reconnects
+                await self.receiver.close()
+
+        @self.pc.on("datachannel")
+        def on_datachannel(channel):
+            if parse_stripe_label(channel.label) is not None:
+                # Extra unordered channel carrying part of a striped transfer
+                self.receiver.attach_stripe(channel)
+                return
+            self.channel = channel
+            self.attach_datachannel_listeners()
+            if self.channel.readyState == "open":
+                self.console_log("Remote pipeline detected open instantly.")
+                self.on_pipeline_ready()
 
     def attach_datachannel_listeners(self):
         @self.channel.on("open")
         def on_open():
             self.console_log("Data pipeline established perfectly.")
-            self.set_status("Connected and Ready to Sync")
-            self.loop.call_soon_threadsafe(lambda: self.btn_select_file.config(state="normal"))
-
-        @self.channel.on("message")
-        def on_message(msg):
-            if isinstance(msg, str):
-                try:
-                    meta = json.loads(msg)
-                    if meta.get("type") == "file_start":
-                        self.incoming_file_metadata = meta
-                        self.received_chunks = []
-                        self.set_status(f"Receiving: {meta['name']}")
-                        self.console_log(f"Incoming download: {meta['name']} ({meta['size']} bytes)")
-                    elif meta.get("type") == "file_end":
-                        self.save_received_file()
-                except Exception as e:
-                    self.console_log(f"Frame validation drop: {e}")
-            else:
-                self.received_chunks.append(msg)
-                current_bytes = sum(len(c) for c in self.received_chunks)
-                total = self.incoming_file_metadata.get("size", 1)
-                
-                # Receiver-side Throttling to prevent receiver flicker
-                progress = int((current_bytes / total) * 100)
-                if progress % 2 == 0 or progress == 100:
-                    self.set_progress(progress)
-
-    async def stream_file_payload(self, file_path):
+            self.on_pipeline_ready()
+
+        # Control messages and in-band chunks; stripe channels are attached in on_datachannel
+        self.receiver.attach(self.channel)
+
+    def on_pipeline_ready(self):
+        self.set_status("Connected and Ready to Sync")
+        self.set_upload_buttons("normal")
+        if self.interrupted_upload:
+            # Finished files are skipped; for the others the receiver answers with the blocks it already has
+            upload = self.interrupted_upload
+            self.interrupted_upload = None
+            self.console_log(f"Resuming interrupted upload of {upload.files} file(s)...")
+            asyncio.ensure_future(self.send_queue(upload))
+
+    def on_download_started(self, incoming):
+        self.last_reported_progress = -1
+        self.set_status(f"Receiving: {incoming.name}")
+        if incoming.resumed:
+            self.console_log(f"Resuming {incoming.name}: {incoming.resumed} of {incoming.size} bytes already on disk")
+        stripes = f" over {incoming.stripes} channels" if incoming.stripes > 1 else ""
+        self.console_log(f"Incoming download: {incoming.name} ({incoming.size} bytes){stripes}")
+
+    def on_download_batch(self, batch):
+        self.last_reported_progress = -1
+        self.console_log(f"Incoming batch: {batch.get('files')} files ({batch.get('size')} bytes) "
+                         f"in {batch.get('transfers')} transfers")
+
+    def on_download_progress(self, incoming):
+        # Receiver-side Throttling to prevent receiver flicker; a batch shows its overall progress
+        progress = self.receiver.batch_progress
+        if progress is None:
+            progress = incoming.progress
+        if progress != self.last_reported_progress:
+            self.set_progress(progress)
+            self.last_reported_progress = progress
+
+    def on_download_complete(self, incoming, output_path):
+        if incoming.members:
+            self.console_log(f"Success! {len(incoming.members)} files unpacked into: {output_path}")
+        else:
+            self.console_log(f"Success! File saved cleanly to: {output_path}")
+        if self.receiver.batch and not self.receiver.batch_complete:
+            return
+        self.set_status("Download Complete!")
+        self.set_progress(0)
+        if self.receiver.batch:
+            batch, self.receiver.batch = self.receiver.batch, None
+            self.show_info("Stream complete", f"{batch.get('files')} files saved to:\n{self.receiver.download_dir}")
+        else:
+            self.show_info("Stream complete", f"File saved directly to:\n{output_path}")
+
+    def show_info(self, title, text):
+        # Opened from its own after() callback rather than inside the drain, so the window keeps updating behind it
+        self.ui.post(lambda: self.root.after(0, lambda: messagebox.showinfo(title, text)))
+
+    def on_download_failed(self, incoming, error):
+        self.console_log(f"Disk IO error compiling incoming chunks: {error}")
+        self.set_status("Write crash")
+
+    async def stream_file_payload(self, paths, concurrency=DEFAULT_CONCURRENCY, stripes=1, compress=True, delta=False):
         if not self.channel or self.channel.readyState != "open":
             self.console_log("Cannot send: Data channel is not open yet.")
             return
-            
-        file_name = os.path.basename(file_path)
-        file_size = os.path.getsize(file_path)
-        
-        self.console_log(f"Starting stream for {file_name}...")
-        self.set_status(f"Uploading: {file_name}")
-
-        meta_header = {"type": "file_start", "name": file_name, "size": file_size}
-        self.channel.send(json.dumps(meta_header))
-        await asyncio.sleep(0.2)
-
-        bytes_sent = 0
-        max_buffer_size = 1024 * 1024  # 1 MB Backpressure Limit
-        last_reported_progress = -1
-
-        with open(file_path, "rb") as f:
-            while bytes_sent < file_size:
-                # Flow Control: Halt loop if WebRTC buffer is currently backed up
-                while self.channel.bufferedAmount > max_buffer_size:
-                    await asyncio.sleep(0.01)
-
-                chunk = f.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                
-                self.channel.send(chunk)
-                bytes_sent += len(chunk)
-                
-                # THROTTLING FIX: Only trigger Tkinter layout updates when integer percentage changes
-                current_progress = int((bytes_sent / file_size) * 100)
-                if current_progress != last_reported_progress:
-                    self.set_progress(current_progress)
-                    last_reported_progress = current_progress
-                
-                # Tiny tick sleep to allow background execution frames to clear cleanly
-                await asyncio.sleep(0.001)
-
-        # Confirm buffer is completely flushed before dispatching the final flag
-        while self.channel.bufferedAmount > 0:
-            await asyncio.sleep(0.05)
-
-        self.channel.send(json.dumps({"type": "file_end"}))
-        self.console_log("Streaming transaction successfully uploaded!")
-        self.set_status("Upload complete")
-        self.set_progress(0)
 
-    def save_received_file(self):
-        file_name = self.incoming_file_metadata.get("name", "synced_payload.bin")
-        output_path = os.path.expanduser(f"~/Downloads/{file_name}")
-        
+        self.console_log(f"Scanning {len(paths)} selected path(s)...")
         try:
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            with open(output_path, "wb") as f:
-                for chunk in self.received_chunks:
-                    f.write(chunk)
-            self.console_log(f"Success! File saved cleanly to: {output_path}")
-            self.set_status("Download Complete!")
-            self.set_progress(0)
-            messagebox.showinfo("Stream complete", f"File saved directly to:\n{output_path}")
-        except Exception as e:
-            self.console_log(f"Disk IO error compiling incoming chunks: {e}")
-            self.set_status("Write crash")
+            # Walking a large folder must not freeze the window
+            upload = await self.loop.run_in_executor(None, lambda: TransferQueue(
+                paths, concurrency, stripes, compress, delta, on_progress=self.on_upload_progress))
+        except OSError as e:
+            self.console_log(f"Cannot read selection: {e}")
+            return
+        await self.send_queue(upload)
+
+    def on_upload_progress(self, sent, total):
+        # THROTTLING FIX: Only trigger Tkinter layout updates when integer percentage changes
+        current_progress = int((sent / total) * 100) if total else 100
+        if current_progress != self.last_reported_progress:
+            self.set_progress(current_progress)
+            self.last_reported_progress = current_progress
+
+    async def send_queue(self, upload):
+        self.console_log(f"Starting stream of {upload.files} file(s), {upload.size} bytes...")
+        self.set_status(f"Uploading {upload.files} file(s)")
+        self.last_reported_progress = -1
+
+        # Paced by bufferedamountlow events, chunks grow up to the negotiated SCTP message size
+        try:
+            await upload.send(self.channel, self.pc, negotiated_max_message_size(self.pc))
+        except ConnectionError as e:
+            self.interrupted_upload = upload
+            self.console_log(f"Upload interrupted: {e}. It resumes where it stopped once the link is back.")
+            self.set_status("Upload interrupted")
+            return
+
+        for name, error in upload.failed:
+            # Local read error, or the receiver rejected the file after verification
+            self.console_log(f"Upload failed: {name}: {error}")
+        wire = sum(item.wire_bytes for item in upload.uploads)
+        copied = sum(item.copied for item in upload.uploads)
+        details = f", {wire} bytes on the wire" if wire != upload.size else ""
+        if copied:
+            details += f", {copied} bytes reused from the peer's copy"
+        self.console_log(f"Streaming transaction successfully uploaded! ({upload.throughput:.1f} MB/s{details})")
+        self.set_status(f"Upload complete ({upload.throughput:.1f} MB/s)" if not upload.failed
+                        else f"Upload finished, {len(upload.failed)} file(s) failed")
+        self.set_progress(0)
 
     async def dial_peer(self, target_id):
         self.remote_id = target_id
@@ -327,49 +387,39 @@ class WebRTCFileTransfer:
         await self.pc.setLocalDescription(offer)
         self.send_signaling_msg("offer", {"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type})
 
-    async def accept_incoming_call(self, target_id):
+    async def accept_incoming_call(self, target_id=None):
+        if target_id is None:
+            target_id = next(iter(self.incoming_offers), None)
+        offer_sdp = self.incoming_offers.get(target_id)
+        if offer_sdp is None:
+            return  # the caller went offline since the button was drawn
         self.remote_id = target_id
         self.console_log(f"Hooking tunnel directly to {target_id}...")
         self.init_peer_connection()
 
-        @self.pc.on("datachannel")
-        def on_datachannel(channel):
-            self.channel = channel
-            self.attach_datachannel_listeners()
-            if self.channel.readyState == "open":
-                self.console_log("Remote pipeline detected open instantly.")
-                self.set_status("Connected and Ready to Sync")
-                self.loop.call_soon_threadsafe(lambda: self.btn_select_file.config(state="normal"))
-
-        offer_sdp = self.incoming_offers[target_id]
         await self.pc.setRemoteDescription(RTCSessionDescription(sdp=offer_sdp["sdp"], type=offer_sdp["type"]))
         answer = await self.pc.createAnswer()
         await self.pc.setLocalDescription(answer)
         self.send_signaling_msg("answer", {"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type})
 
     def send_signaling_msg(self, msg_type, data):
-        payload = {"type": msg_type, "from": self.peer_id, "to": self.remote_id, "data": data}
-        self.mqtt_client.publish(self.signaling_topic, json.dumps(payload))
+        self.signaling.send(msg_type, self.remote_id, data)
 
     def on_close(self):
-        self.mqtt_client.loop_stop()
+        try:
+            # Signaling belongs to the network thread; wait until our presence clear is sent before exiting
+            asyncio.run_coroutine_threadsafe(self.signaling.aclose(), self.loop).result(CLOSE_TIMEOUT + 1)
+        except concurrent.futures.TimeoutError:
+            pass
         self.root.destroy()
         os._exit(0)
 
-async def run_tk_loop(root, interval=0.03):
-    try:
-        while True:
-            root.update()
-            await asyncio.sleep(interval)
-    except tk.TclError:
-        pass
-
 if __name__ == "__main__":
     root = tk.Tk()
-    async_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(async_loop)
-    
-    app = WebRTCFileTransfer(root, async_loop)
+    # aiortc, SCTP, signaling and transfers run on their own loop, so redraws and dialogs never stall them
+    network = NetworkThread().start()
+
+    app = WebRTCFileTransfer(root, network)
     app.connect_mqtt()
 
-    async_loop.run_until_complete(run_tk_loop(root))
+    root.mainloop()
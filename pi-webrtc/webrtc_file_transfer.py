@@ -0,0 +1,1707 @@
+"""
+Transfer engine behind the P2P file transfer GUI.
+
+The sending side is paced by the DataChannel's bufferedamountlow event rather
+than by polling or sleeping, and grows its message size up to the negotiated
+SCTP max-message-size while the link keeps up.
+
+Files are sent as fixed 1 MB blocks, each message prefixed with its file offset.
+With stripes > 1 the payload travels over that many extra unordered channels
+("stripe:<transfer id>:<n>"), so a retransmission on one SCTP stream no longer
+holds back the others. Idle stripes pull the next block, so a slow stripe simply
+carries less of the file.
+
+Transfers are resumable. The transfer id is derived from the file's path, size
+and mtime, so the same file keeps its id across reconnects; the receiver keeps
+the .part file plus a bitmap of completed blocks (.state, checkpointed every
+CHECKPOINT_BLOCKS) and answers file_start with file_resume, listing the blocks
+it already holds. Only the missing blocks are sent again.
+
+Transfers are verified end to end with BLAKE2b-128. The sender hashes each block
+on HASH_POOL while its chunks are on the wire and follows the block with a
+digest message (offset field | DIGEST_FLAG); the receiver assembles the block in
+memory, checks it on HASH_POOL and only then writes it, answering a mismatch with
+block_nack so just that block is sent again. file_end carries the whole-file
+digest (a hash over the block digests), checked before the .part file is renamed
+into place; the receiver reports the verdict with file_done or file_failed.
+
+Data may be compressed per message. file_start offers the codecs this side has
+(zstd when the optional `zstandard` package is installed, zlib always) and the
+receiver picks one in file_resume. The sender compresses each block on
+CODEC_POOL one block ahead of the wire, probes the block's first frame and
+sends incompressible blocks (and frames that did not shrink) as they are;
+compressed messages carry COMPRESSED_FLAG in the offset field. The level drops
+when the sender waits for the pool and rises when it waits for the link.
+
+Delta sync: when the destination already holds a file of the same name, the
+receiver maps it (the basis) and streams its content-defined chunk signatures
+(gear rolling hash boundaries, BLAKE2b per chunk) in file_signature messages.
+The sender chunks the new file the same way and, for every chunk the receiver
+already has, sends a copy record (COPY_FLAG) instead of the bytes; the receiver
+fills those ranges from the mapped basis. Copied ranges are part of the block
+digest like any other byte, so a bad copy is caught and the block resent whole.
+Both ends chunk on CDC_POOL. The boundary scan is the costly part: with the
+optional `numpy` package it runs at about 25 MB/s on a desktop CPU, in pure
+Python at about 4 MB/s (around 1 MB/s on a Raspberry Pi). That is no faster
+than a LAN link, so delta sync is opt-in (delta=True) for slow or metered links.
+
+Many files or whole directories go through a TransferQueue: a file_manifest
+announces the batch, files below SMALL_FILE_SIZE are packed into bundles (one
+transfer, split again by the receiver) and up to `concurrency` transfers run at
+once, each on its own channel. Names may then carry relative directories.
+
+The receiving side never holds a file in memory: chunks are coalesced into
+large blocks and written by a background thread to a hidden .part file next to
+the destination, which is renamed into place once the transfer completes. The
+event loop never waits for that thread: when more than WRITE_QUEUE_DEPTH blocks
+are waiting for the disk the receiver sends file_pause, holds whatever is still
+in flight and sends file_continue once the disk has caught up. The sender
+stops between blocks; senders that predate file_pause ignore it.
+"""
+import os
+import re
+import json
+import time
+import queue
+import uuid
+import bisect
+import struct
+import hashlib
+import asyncio
+import logging
+import threading
+import zlib
+import mmap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("WebRTC-FileTransfer")
+
+DOWNLOAD_DIR = os.path.expanduser("~/Downloads")
+
+# Sender pacing: refill the channel when it drains below LOW, stop queueing above HIGH
+INITIAL_CHUNK_SIZE = 16384
+BUFFER_HIGH_WATER = 4 * 1024 * 1024
+BUFFER_LOW_WATER = 1024 * 1024
+# RFC 8841 default when the SDP carries no a=max-message-size (aiortc advertises this too)
+DEFAULT_MAX_MESSAGE_SIZE = 65536
+# A refill wait this long means the link, not the sender, is the bottleneck: use smaller messages
+SLOW_DRAIN_SECONDS = 0.5
+
+# Every data message starts with its file offset; blocks are the unit of striping and resuming
+STRIPE_LABEL_PREFIX = "stripe:"
+STRIPE_HEADER = struct.Struct("!Q")
+BLOCK_SIZE = 1024 * 1024
+MAX_STRIPES = 8
+
+# Receiver persists its block bitmap after this many newly completed blocks (and when suspended)
+CHECKPOINT_BLOCKS = 16
+# Every receiver of framed transfers answers file_start with file_resume; after this long without
+# one (it may be flushing an earlier attempt first) the attempt ends as a lost link and is retried
+RESUME_REPLY_TIMEOUT = 30.0
+
+# Integrity: block digests go in-band with this bit set in the offset field
+HASH_NAME = "blake2b-128"
+DIGEST_FLAG = 1 << 63
+# A block failing verification this many times fails the transfer
+MAX_BLOCK_RETRIES = 3
+# How long a sender waits for the receiver's verdict after file_end (the receiver fsyncs first)
+FILE_DONE_TIMEOUT = 60.0
+# hashlib drops the GIL on large buffers, so hashing here overlaps with the event loop
+HASH_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="file-hash")
+
+# Compression: frames come back from CODEC_POOL ready to send, marked with this bit
+COMPRESSED_FLAG = 1 << 62
+# codec -> (lowest, initial, highest) level the sender moves between
+COMPRESSION_LEVELS = {"zstd": (1, 3, 12), "zlib": (1, 6, 9)}
+# A frame must shrink below this fraction of its size to be sent compressed
+COMPRESS_MIN_RATIO = 0.95
+CODEC_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="file-codec")
+# Sender block reads, so SD card latency stalls a worker instead of the event loop
+READ_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="file-read")
+
+# Delta sync: a cut where the top CDC_MASK bits of the gear hash are zero (about every 32 KB),
+# with chunks kept between CDC_MIN_SIZE and CDC_MAX_SIZE
+COPY_FLAG = 1 << 61
+CDC_MASK = 0xFFFE0000
+CDC_MIN_SIZE = 8 * 1024
+CDC_MAX_SIZE = 128 * 1024
+CDC_WINDOW = 32
+CDC_SEGMENT_SIZE = 4 * 1024 * 1024
+GEAR = [int.from_bytes(hashlib.blake2b(bytes([value]), digest_size=4).digest(), "big") for value in range(256)]
+GEAR_ARRAY = np.array(GEAR, dtype=np.uint32) if np is not None else None
+# file_signature carries hex-packed (offset, length, digest) records; copy messages (new, old, length).
+# A batch goes out when it is full or SIGNATURE_FLUSH_INTERVAL after the previous one, however slow the scan
+SIGNATURE_RECORD = struct.Struct("!QI16s")
+SIGNATURE_BATCH = 256
+SIGNATURE_FLUSH_INTERVAL = 2.0
+COPY_RECORD = struct.Struct("!QQI")
+# The sender gives up on delta when the signature stream pauses this long
+SIGNATURE_IDLE_TIMEOUT = 30.0
+# Whole-file chunking for delta sync, apart from HASH_POOL so a long scan never holds up block digests
+CDC_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="file-cdc")
+
+# Transfer queue: smaller files are packed into bundles of up to BUNDLE_SIZE / BUNDLE_MAX_FILES
+SMALL_FILE_SIZE = 256 * 1024
+BUNDLE_SIZE = 16 * 1024 * 1024
+BUNDLE_MAX_FILES = 512
+# Files in flight at once, each on its own channel(s)
+DEFAULT_CONCURRENCY = 3
+MAX_CONCURRENCY = 8
+
+# Chunks are coalesced into blocks of this size before they are handed to the disk thread
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Blocks waiting for the disk before the receiver pauses the sender (file_pause); it
+# continues (file_continue) once the disk is down to half of that
+WRITE_QUEUE_DEPTH = 8
+# Non-contiguous write positions buffered at once (one per stripe in practice)
+MAX_OPEN_RUNS = 16
+
+
+def safe_file_name(name, default="synced_payload.bin"):
+    """Strips any directory part a remote peer put into the name."""
+    name = os.path.basename(str(name or "").replace("\\", "/"))
+    return name if name not in ("", ".", "..") else default
+
+
+def safe_relative_path(name, default="synced_payload.bin"):
+    """Keeps the directories of a queued file's name, but never lets them leave the download directory."""
+    parts = [part.replace(":", "_") for part in str(name or "").replace("\\", "/").split("/")
+             if part not in ("", ".", "..")]
+    return os.path.join(*parts) if parts else default
+
+
+def negotiated_max_message_size(pc):
+    """Largest DataChannel message both ends accept, from a=max-message-size in the two descriptions."""
+    limits = []
+    for description in (pc.localDescription, pc.remoteDescription):
+        match = re.search(r"a=max-message-size:(\d+)", description.sdp if description else "")
+        value = int(match.group(1)) if match else DEFAULT_MAX_MESSAGE_SIZE
+        if value > 0:  # 0 means "no limit"
+            limits.append(value)
+    return min(limits, default=DEFAULT_MAX_MESSAGE_SIZE)
+
+
+def file_transfer_id(path):
+    """Stable id for one version of a file: it resumes under the same id after a reconnect."""
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def block_ranges(size, block_size=BLOCK_SIZE):
+    return [(offset, min(offset + block_size, size)) for offset in range(0, size, block_size)]
+
+
+def block_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def root_digest(digests):
+    """Whole-file digest: a hash over the block digests in file order."""
+    return hashlib.blake2b(b"".join(digests), digest_size=16).digest()
+
+
+def available_codecs():
+    """Compression codecs this side can use, preferred first."""
+    return (["zstd"] if zstandard is not None else []) + ["zlib"]
+
+
+def compress_block(block, codec, level, frame_size, gaps=None):
+    """
+    Splits the gaps ((start, end) ranges, default the whole block) into
+    (position, raw length, payload, flag) frames, compressing those that shrink.
+    A first frame that does not shrink sends the rest of the block raw.
+    """
+    if codec == "zstd":
+        compress = zstandard.ZstdCompressor(level=level).compress
+    else:
+        compress = lambda data: zlib.compress(data, level)
+    view = memoryview(block)
+    positions = [(position, min(end, position + frame_size))
+                 for start, end in (gaps if gaps is not None else [(0, len(block))])
+                 for position in range(start, end, frame_size)]
+    frames = []
+    for number, (position, end) in enumerate(positions):
+        raw = view[position:end]
+        packed = compress(raw)
+        if len(packed) < len(raw) * COMPRESS_MIN_RATIO:
+            frames.append((position, len(raw), packed, COMPRESSED_FLAG))
+            continue
+        frames.append((position, len(raw), raw, 0))
+        if number == 0:
+            # Probe failed (already compressed media, archives, ...): skip the rest of the block
+            frames.extend((rest, rest_end - rest, view[rest:rest_end], 0) for rest, rest_end in positions[1:])
+            break
+    return frames
+
+
+def decompress_frame(data, codec, limit):
+    """Inflates one frame, refusing output larger than limit (a block) from a misbehaving peer."""
+    if codec == "zstd":
+        try:
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=limit)
+        except zstandard.ZstdError as e:
+            raise IOError(f"corrupt zstd frame: {e}")
+    inflater = zlib.decompressobj()
+    try:
+        out = inflater.decompress(data, limit)
+    except zlib.error as e:
+        raise IOError(f"corrupt zlib frame: {e}")
+    if inflater.unconsumed_tail or not inflater.eof:
+        raise IOError("zlib frame larger than a block or truncated")
+    return out
+
+
+def _gear_cuts_python(segment, context):
+    h = 0
+    for value in context:
+        h = ((h << 1) + GEAR[value]) & 0xFFFFFFFF
+    cuts = []
+    for end, value in enumerate(segment, 1):
+        h = ((h << 1) + GEAR[value]) & 0xFFFFFFFF
+        if not h & CDC_MASK:
+            cuts.append(end)
+    return cuts
+
+
+def _gear_cuts_numpy(segment, context):
+    # The 32-bit gear hash only remembers the last CDC_WINDOW bytes, so it is a windowed sum
+    g = GEAR_ARRAY[np.frombuffer(context + segment, dtype=np.uint8)]
+    h = g.copy()
+    for shift in range(1, CDC_WINDOW):
+        h[shift:] += g[:-shift] << np.uint32(shift)
+    cuts = np.flatnonzero((h & np.uint32(CDC_MASK)) == 0) + (1 - len(context))
+    return cuts[cuts > 0].tolist()
+
+
+def content_chunks(path):
+    """
+    Yields (offset, length, digest) for the content-defined chunks of a file.
+    Boundaries depend only on nearby content, so an insertion shifts the
+    chunks after it instead of changing them. numpy, when installed, only
+    makes the boundary scan faster; both ends find the same chunks.
+    """
+    gear_cuts = _gear_cuts_numpy if np is not None else _gear_cuts_python
+    with open(path, "rb") as f:
+        base, data, context = 0, b"", b""   # data holds the file from offset base (a chunk start) on
+        while True:
+            segment = f.read(CDC_SEGMENT_SIZE)
+            if segment:
+                cuts = [base + len(data) + end for end in gear_cuts(segment, context)]
+                context = (context + segment)[-(CDC_WINDOW - 1):]
+                data += segment
+            else:
+                cuts = [base + len(data)] if data else []
+            start = base
+            for end in cuts:
+                while end - start > CDC_MAX_SIZE:
+                    yield start, CDC_MAX_SIZE, block_digest(data[start - base:start - base + CDC_MAX_SIZE])
+                    start += CDC_MAX_SIZE
+                if end - start >= CDC_MIN_SIZE or not segment:
+                    yield start, end - start, block_digest(data[start - base:end - base])
+                    start = end
+            if not segment:
+                return
+            while base + len(data) - start >= CDC_MAX_SIZE:
+                yield start, CDC_MAX_SIZE, block_digest(data[start - base:start - base + CDC_MAX_SIZE])
+                start += CDC_MAX_SIZE
+            data, base = data[start - base:], start
+
+
+def parse_stripe_label(label):
+    """Returns the transfer id of a stripe channel label, or None for any other channel."""
+    if not label.startswith(STRIPE_LABEL_PREFIX):
+        return None
+    return label[len(STRIPE_LABEL_PREFIX):].rsplit(":", 1)[0]
+
+
+def channel_send(channel, data):
+    """
+    channel.send() for code that just awaited something: a link that dropped
+    meanwhile surfaces as ConnectionError (resumable) rather than aiortc's
+    InvalidStateError.
+    """
+    if channel.readyState != "open":
+        raise ConnectionError(f"data channel {channel.label} closed during transfer")
+    channel.send(data)
+
+
+async def wait_channel_open(channel, timeout=10):
+    if channel.readyState == "open":
+        return
+    opened = asyncio.get_event_loop().create_future()
+    channel.once("open", lambda: opened.done() or opened.set_result(None))
+    await asyncio.wait_for(opened, timeout)
+
+
+class BlockBitmap:
+    """Which fixed-size blocks of a file are complete; travels as hex in file_resume."""
+
+    def __init__(self, count, bits=None):
+        self.count = count
+        self.bits = bytearray(bits) if bits else bytearray((count + 7) // 8)
+        if len(self.bits) != (count + 7) // 8:
+            raise ValueError(f"bitmap for {count} blocks has {len(self.bits)} bytes")
+        self.done = sum(1 for index in range(count) if index in self)
+
+    @classmethod
+    def from_hex(cls, text, count):
+        return cls(count, bytes.fromhex(text)) if text else cls(count)
+
+    def __contains__(self, index):
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index):
+        if index not in self:
+            self.bits[index >> 3] |= 1 << (index & 7)
+            self.done += 1
+
+    @property
+    def full(self):
+        return self.done == self.count
+
+    def hex(self):
+        return self.bits.hex()
+
+
+class ChannelFlowControl:
+    """
+    Event-driven backpressure for an RTCDataChannel.
+
+    The sender queues until bufferedAmount passes the high-water mark, then
+    sleeps on the channel's bufferedamountlow event (fired when aiortc hands the
+    queue down to SCTP below the low-water mark). No polling, no per-chunk sleeps.
+
+    chunk_size starts at INITIAL_CHUNK_SIZE and doubles after every refill up to
+    max_chunk_size; it halves again when a refill wait shows the link cannot keep up.
+    """
+
+    def __init__(self, channel, max_chunk_size=DEFAULT_MAX_MESSAGE_SIZE,
+                 high_water=BUFFER_HIGH_WATER, low_water=BUFFER_LOW_WATER):
+        self.channel = channel
+        self.max_chunk_size = max(INITIAL_CHUNK_SIZE, max_chunk_size)
+        self.chunk_size = INITIAL_CHUNK_SIZE
+        self.high_water = high_water
+        self.low_water = low_water
+        self.stalls = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+        channel.bufferedAmountLowThreshold = low_water
+        channel.on("bufferedamountlow", self._drained.set)
+        channel.on("close", self._drained.set)
+
+    async def wait_writable(self):
+        """Returns how long the sender had to wait for the channel to drain (0 when it did not)."""
+        self._check_open()
+        if self.channel.bufferedAmount <= self.high_water:
+            return 0.0
+        started = time.perf_counter()
+        self.stalls += 1
+        await self._wait_below(self.low_water)
+        waited = time.perf_counter() - started
+        if waited > SLOW_DRAIN_SECONDS:
+            self.chunk_size = max(INITIAL_CHUNK_SIZE, self.chunk_size // 2)
+        else:
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+        return waited
+
+    async def drain(self):
+        """Waits until every queued message has been handed to SCTP."""
+        await self._wait_below(0)
+
+    def detach(self):
+        self.channel.remove_listener("bufferedamountlow", self._drained.set)
+        self.channel.remove_listener("close", self._drained.set)
+
+    async def _wait_below(self, threshold):
+        self.channel.bufferedAmountLowThreshold = threshold
+        while self.channel.bufferedAmount > threshold:
+            self._check_open()
+            self._drained.clear()
+            await self._drained.wait()
+        self._check_open()
+        self.channel.bufferedAmountLowThreshold = self.low_water
+
+    def _check_open(self):
+        if self.channel.readyState != "open":
+            raise ConnectionError("data channel closed during transfer")
+
+
+class FileBundle:
+    """
+    Small files sent as one transfer, so a thousand log files cost one round
+    trip instead of a thousand. Reads as the concatenation of its members;
+    file_start lists (name, size) per member and the receiver splits it up again.
+    """
+
+    def __init__(self, members):
+        self.members = list(members)  # (name, path, size)
+        self.size = sum(size for _, _, size in self.members)
+        key = "\n".join(f"{name}:{size}:{os.stat(path).st_mtime_ns}" for name, path, size in self.members)
+        self.id = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        self.name = f"bundle-{self.id[:8]}"
+
+    def open(self):
+        return _BundleReader(self.members)
+
+
+class _BundleReader:
+    """File-like seek()/readinto() over a FileBundle; each read stops at a member boundary."""
+
+    def __init__(self, members):
+        self.members = members
+        self.starts = []
+        total = 0
+        for _, _, size in members:
+            self.starts.append(total)
+            total += size
+        self.size = total
+        self.position = 0
+
+    def seek(self, position):
+        self.position = position
+
+    def readinto(self, view):
+        if self.position >= self.size:
+            return 0
+        number = bisect.bisect_right(self.starts, self.position) - 1
+        _, path, size = self.members[number]
+        offset = self.position - self.starts[number]
+        with open(path, "rb", buffering=0) as f:
+            f.seek(offset)
+            count = f.readinto(view[:size - offset]) or 0
+        self.position += count
+        return count
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OutgoingFile:
+    """
+    Streams one file: a JSON file_start header on the control channel, the
+    blocks the receiver is missing as offset-framed binary messages, then file_end.
+
+    With stripes > 1 or dedicated=True (and the peer connection to open them on)
+    the blocks go over that many temporary unordered channels instead of the
+    control channel. `path` may also be a FileBundle. When
+    the receiver verifies (its file_resume names HASH_NAME), every block is
+    followed by its digest and send() returns only after file_done, resending
+    any block the receiver rejects. With compress=True the codecs in
+    available_codecs() are offered and used if the receiver accepts one; with
+    delta=True chunks the receiver already has in a file of the same name are
+    copied on its side instead of sent. Delta is off by default: nothing is sent
+    until both ends have chunked the whole file, which only pays off on links
+    slower than the chunking (see content_chunks).
+    """
+
+    def __init__(self, path, channel, max_message_size=DEFAULT_MAX_MESSAGE_SIZE, on_progress=None,
+                 pc=None, stripes=1, compress=True, delta=False, name=None, dedicated=False):
+        if isinstance(path, FileBundle):
+            self.bundle = path
+            self.id, self.size = path.id, path.size
+            name = name or path.name
+            delta = False
+        else:
+            self.bundle = None
+            self.id = file_transfer_id(path)
+            self.size = os.path.getsize(path)
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.blocks = block_ranges(self.size)
+        self.channel = channel
+        self.max_message_size = max_message_size
+        self.on_progress = on_progress
+        self.pc = pc
+        self.stripes = max(1, min(MAX_STRIPES, stripes)) if pc is not None else 1
+        self.striped = pc is not None and (self.stripes > 1 or dedicated)
+        self.verified = False  # receiver checks digests
+        self.offered_codecs = available_codecs() if compress else []
+        self.codec = None      # accepted by the receiver
+        self.level = None
+        self.wire_bytes = 0    # payload bytes actually sent, after compression
+        self.delta = delta
+        self.copied = 0        # bytes the receiver copied from its old version of the file
+        self._copies = {}      # block index -> COPY_RECORD tuples for ranges the receiver already has
+        self._literal = set()  # blocks resent whole after failing verification
+        self.digests = [None] * len(self.blocks)
+        self.sent = 0
+        self.resumed = 0   # bytes the receiver already held from an interrupted attempt
+        self.resent = 0    # bytes sent again after block_nack
+        self.elapsed = 0.0
+        self.stalls = 0
+        self._pending = deque()   # block indices still to send, shared by every channel
+        self._replies = asyncio.Queue()
+        self._flowing = asyncio.Event()  # cleared while the receiver's disk catches up (file_pause)
+        self._flowing.set()
+
+    @property
+    def throughput(self):
+        """Achieved payload rate of this attempt in MB/s (file bytes, before compression)."""
+        return (self.sent - self.resumed) / self.elapsed / 1e6 if self.elapsed else 0.0
+
+    @property
+    def compression_ratio(self):
+        """Bytes on the wire per file byte sent."""
+        return self.wire_bytes / (self.sent - self.resumed) if self.sent > self.resumed else 1.0
+
+    async def send(self):
+        header = {"type": "file_start", "id": self.id, "name": self.name, "size": self.size,
+                  "block_size": BLOCK_SIZE, "framed": True, "hash": HASH_NAME}
+        if self.offered_codecs:
+            header["compression"] = self.offered_codecs
+        if self.delta:
+            header["delta"] = True
+        if self.bundle:
+            header["bundle"] = [[name, size] for name, _, size in self.bundle.members]
+        channels = [self.channel]
+        if self.striped:
+            header["stripes"] = self.stripes
+            channels = [self.pc.createDataChannel(f"{STRIPE_LABEL_PREFIX}{self.id}:{n}", ordered=False)
+                        for n in range(self.stripes)]
+        self.channel.on("message", self._on_reply)
+        self.channel.on("close", self._flowing.set)
+        try:
+            await asyncio.gather(*(wait_channel_open(channel) for channel in channels))
+            have = await self._negotiate_resume(header)
+
+            self._pending.extend(index for index in range(len(self.blocks)) if index not in have)
+            self.resumed = self.sent = self.size - sum(self._block_length(index) for index in self._pending)
+            if self.resumed:
+                logger.info(f"⏯️ {self.name}: receiver holds {self.resumed} bytes, "
+                            f"resending {len(self._pending)} blocks")
+            loop = asyncio.get_event_loop()
+            # Blocks the receiver already holds still count towards the whole-file digest
+            resumed_digests = {index: loop.run_in_executor(HASH_POOL, self._read_digest, index)
+                               for index in range(len(self.blocks)) if self.verified and index in have}
+            started = time.perf_counter()
+            if self._copies is None:
+                await self._plan_delta()
+
+            await self._send_pending(channels)
+            end = {"type": "file_end", "id": self.id}
+            if self.verified:
+                for index, digest in resumed_digests.items():
+                    self.digests[index] = await digest
+                end["digest"] = root_digest(self.digests).hex()
+            channel_send(self.channel, json.dumps(end))
+            if self.verified:
+                await self._await_verdict(channels)
+            self.elapsed = time.perf_counter() - started
+        except BaseException:
+            if self.striped:
+                for channel in channels:
+                    channel.close()
+            raise
+        finally:
+            self.channel.remove_listener("message", self._on_reply)
+            self.channel.remove_listener("close", self._flowing.set)
+        # On success the receiver closes the stripes once it has every byte: a local close
+        # resets the SCTP streams and would discard whatever is still in flight
+
+        logger.info(f"📤 {self.name}: {self.sent - self.resumed} bytes in {self.elapsed:.2f} s "
+                    f"({self.throughput:.1f} MB/s, {self.stripes} channel(s), {self.stalls} stalls"
+                    f"{', verified' if self.verified else ''}{f', {self.resent} bytes resent' if self.resent else ''}"
+                    f"{f', {self.codec} to {self.compression_ratio:.0%}' if self.codec else ''}"
+                    f"{f', {self.copied} bytes reused' if self.copied else ''})")
+        return self
+
+    def _on_reply(self, message):
+        if not isinstance(message, str):
+            return
+        try:
+            reply = json.loads(message)
+        except ValueError:
+            return
+        if reply.get("id") != self.id:
+            return
+        msg_type = reply.get("type")
+        if msg_type == "file_pause":
+            self._flowing.clear()
+        elif msg_type in ("file_continue", "file_done", "file_failed"):
+            self._flowing.set()
+        elif msg_type == "block_nack":
+            for index in reply.get("blocks", []):
+                if isinstance(index, int) and 0 <= index < len(self.blocks) and index not in self._pending:
+                    # Picked up by a channel still sending, or by the next round in _await_verdict
+                    self._pending.append(index)
+                    self._literal.add(index)
+                    self.sent -= self._block_length(index)
+                    self.resent += self._block_length(index)
+                    logger.warning(f"⚠️ {self.name}: block {index} failed verification, resending")
+        self._replies.put_nowait(reply)
+
+    async def _negotiate_resume(self, header):
+        """Sends file_start and returns the receiver's bitmap of blocks it already holds."""
+        count = len(self.blocks)
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + RESUME_REPLY_TIMEOUT
+        channel_send(self.channel, json.dumps(header))
+        try:
+            while True:
+                reply = await asyncio.wait_for(self._replies.get(), max(0.0, deadline - loop.time()))
+                if reply.get("type") == "file_resume":
+                    break
+        except asyncio.TimeoutError:
+            # The header promised digests: sending without them would leave the receiver waiting forever
+            raise ConnectionError(f"no file_resume for {self.name} after {RESUME_REPLY_TIMEOUT:.0f} s")
+        # Older receivers would read digest messages as data: only send them when asked to
+        self.verified = reply.get("hash") == HASH_NAME
+        if self.delta and self.verified and reply.get("delta") is True:
+            self._copies = None  # planned once the receiver's signature is in
+        if reply.get("compression") in self.offered_codecs:
+            self.codec = reply["compression"]
+            self.level = COMPRESSION_LEVELS[self.codec][1]
+        return BlockBitmap.from_hex(reply.get("have", ""), count)
+
+    async def _plan_delta(self):
+        """Chunks the file while the receiver streams its signature, then maps matching chunks to copy records."""
+        loop = asyncio.get_event_loop()
+        chunks = loop.run_in_executor(CDC_POOL, lambda: list(content_chunks(self.path)))
+        basis = {}
+        try:
+            while True:
+                reply = await asyncio.wait_for(self._replies.get(), SIGNATURE_IDLE_TIMEOUT)
+                if reply.get("type") != "file_signature":
+                    continue
+                for offset, length, digest in SIGNATURE_RECORD.iter_unpack(bytes.fromhex(reply.get("chunks", ""))):
+                    basis.setdefault(digest, (offset, length))
+                if reply.get("done"):
+                    break
+        except (asyncio.TimeoutError, ValueError, struct.error) as e:
+            logger.warning(f"No usable signature for {self.name} ({e or 'timed out'}), sending it whole")
+            basis = {}
+
+        copies = {}
+        for offset, length, digest in await chunks:
+            match = basis.get(digest)
+            if match is None or match[1] != length:
+                continue
+            old_offset = match[0]
+            # Split at block boundaries: every block is assembled and verified on its own
+            while length:
+                index = offset // BLOCK_SIZE
+                part = min(length, self.blocks[index][1] - offset)
+                copies.setdefault(index, []).append((offset, old_offset, part))
+                offset, old_offset, length = offset + part, old_offset + part, length - part
+        self._copies = copies
+        reusable = sum(part for records in copies.values() for _, _, part in records)
+        logger.info(f"🧩 {self.name}: receiver already has {reusable} of {self.size} bytes")
+
+    async def _await_verdict(self, channels):
+        while True:
+            try:
+                reply = await asyncio.wait_for(self._replies.get(), FILE_DONE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"No verdict on {self.name} after {FILE_DONE_TIMEOUT:.0f} s, assuming it arrived")
+                return
+            msg_type = reply.get("type")
+            if msg_type == "file_done":
+                return
+            if msg_type == "file_failed":
+                raise IOError(f"receiver rejected {self.name}: {reply.get('reason', 'unknown error')}")
+            if msg_type == "block_nack" and self._pending:
+                await self._send_pending(channels)
+
+    async def _send_pending(self, channels):
+        payload_limit = self.max_message_size - STRIPE_HEADER.size
+        await asyncio.gather(*(self._send_blocks(channel, payload_limit) for channel in channels))
+
+    def _block_length(self, index):
+        start, end = self.blocks[index]
+        return end - start
+
+    async def _send_blocks(self, channel, max_chunk_size):
+        # Whichever channel has room takes the next pending block
+        flow = ChannelFlowControl(channel, max_chunk_size)
+        upcoming = None
+        try:
+            with self._open() as f:
+                upcoming = asyncio.ensure_future(self._load_next(f, max_chunk_size))
+                while True:
+                    # Paused by the receiver: hold the next block (already read ahead) until it continues
+                    await self._flowing.wait()
+                    prepared = await upcoming
+                    if prepared is None:
+                        break
+                    index, block, digest, frames = prepared
+                    # Read, hash and compress the next block while this one is on the wire
+                    upcoming = asyncio.ensure_future(self._load_next(f, max_chunk_size))
+                    copies = self._copies.get(index) if index not in self._literal else None
+                    if copies:
+                        await flow.wait_writable()
+                        channel_send(channel, STRIPE_HEADER.pack(COPY_FLAG | index)
+                                     + b"".join(COPY_RECORD.pack(*c) for c in copies))
+                        copied = sum(length for _, _, length in copies)
+                        self.copied += copied
+                        self._count_sent(copied, 0)
+                    if frames is not None:
+                        await self._send_frames(channel, flow, index, frames)
+                    else:
+                        await self._send_raw(channel, flow, index, block, self._gaps(index))
+                    if digest is not None:
+                        self.digests[index] = await digest
+                        channel_send(channel, STRIPE_HEADER.pack(DIGEST_FLAG | index) + self.digests[index])
+
+            # Everything handed to SCTP before the end marker and the throughput figure
+            await flow.drain()
+        finally:
+            if upcoming is not None and not upcoming.done():
+                upcoming.cancel()
+            self.stalls += flow.stalls
+            flow.detach()
+
+    async def _load_next(self, f, frame_size):
+        """
+        Takes the next pending block, reads it on READ_POOL and starts its digest
+        and compression. The loop never waits on the disk; each channel holds at
+        most the block on the wire and the one read ahead.
+        """
+        if not self._pending:
+            return None
+        index = self._pending.popleft()
+        loop = asyncio.get_event_loop()
+        block = await loop.run_in_executor(READ_POOL, self._read_block, f, index)
+        digest = loop.run_in_executor(HASH_POOL, block_digest, block) if self.verified else None
+        frames = None
+        if self.codec:
+            frames = loop.run_in_executor(CODEC_POOL, compress_block, block, self.codec, self.level, frame_size,
+                                          self._gaps(index))
+        return index, block, digest, frames
+
+    def _open(self):
+        # Unbuffered: readinto() lands in the block buffer directly
+        return self.bundle.open() if self.bundle else open(self.path, "rb", buffering=0)
+
+    def _read_digest(self, index):
+        with self._open() as f:
+            return block_digest(self._read_block(f, index))
+
+    def _read_block(self, f, index):
+        start, end = self.blocks[index]
+        block = bytearray(end - start)
+        view = memoryview(block)
+        f.seek(start)
+        filled = 0
+        while filled < len(block):
+            count = f.readinto(view[filled:])
+            if not count:
+                raise IOError(f"{self.name} shrank during transfer")
+            filled += count
+        return block
+
+    def _gaps(self, index):
+        """(start, end) ranges within block index that have to be sent as data."""
+        start, end = self.blocks[index]
+        position, gaps = start, []
+        if index not in self._literal:
+            for offset, _, length in self._copies.get(index, ()):
+                if offset > position:
+                    gaps.append((position - start, offset - start))
+                position = offset + length
+        if position < end:
+            gaps.append((position - start, end - start))
+        return gaps
+
+    async def _send_raw(self, channel, flow, index, block, gaps):
+        start = self.blocks[index][0]
+        view = memoryview(block)
+        for position, end in gaps:
+            while position < end:
+                await flow.wait_writable()
+                chunk = view[position:min(end, position + flow.chunk_size)]
+                channel_send(channel, STRIPE_HEADER.pack(start + position) + chunk)
+                position += len(chunk)
+                self._count_sent(len(chunk), len(chunk))
+
+    async def _send_frames(self, channel, flow, index, frames):
+        start = self.blocks[index][0]
+        lowest, _, highest = COMPRESSION_LEVELS[self.codec]
+        if not frames.done():
+            # The link outruns the codec: compress faster
+            self.level = max(lowest, self.level - 1)
+        stalls = flow.stalls
+        for position, length, payload, flag in await frames:
+            await flow.wait_writable()
+            channel_send(channel, STRIPE_HEADER.pack(flag | (start + position)) + payload)
+            self._count_sent(length, len(payload))
+        if flow.stalls > stalls:
+            # The link is the bottleneck: spend more CPU on smaller frames
+            self.level = min(highest, self.level + 1)
+
+    def _count_sent(self, length, wire_length):
+        self.sent += length
+        self.wire_bytes += wire_length
+        if self.on_progress:
+            self.on_progress(self.sent, self.size)
+
+
+def expand_paths(paths):
+    """(name, path, size) for every regular file in paths; directories keep their own name and relative layout."""
+    entries = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            parent = os.path.dirname(path)
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file_name in sorted(files):
+                    full = os.path.join(root, file_name)
+                    if os.path.isfile(full):
+                        name = os.path.relpath(full, parent).replace(os.sep, "/")
+                        entries.append((name, full, os.path.getsize(full)))
+        elif os.path.isfile(path):
+            entries.append((os.path.basename(path), path, os.path.getsize(path)))
+    return entries
+
+
+def plan_transfers(entries):
+    """Bundles (FileBundle) of the small files first, then (name, path, size) for every other file."""
+    items, members, bundled = [], [], 0
+    for name, path, size in entries:
+        if size >= SMALL_FILE_SIZE:
+            continue
+        if members and (bundled + size > BUNDLE_SIZE or len(members) >= BUNDLE_MAX_FILES):
+            items.append(FileBundle(members))
+            members, bundled = [], 0
+        members.append((name, path, size))
+        bundled += size
+    if len(members) == 1:
+        items.append(members[0])
+    elif members:
+        items.append(FileBundle(members))
+    items.extend(entry for entry in entries if entry[2] >= SMALL_FILE_SIZE)
+    return items
+
+
+class TransferQueue:
+    """
+    Sends many files, or whole directories, over one connection.
+
+    send() announces the batch with a file_manifest, then runs up to
+    `concurrency` transfers at once, each on its own channel(s), so round trips
+    overlap instead of adding up. Small files travel in FileBundles. Finished
+    items are remembered: after a ConnectionError, send() on the new link
+    continues with the rest (and each file resumes where it stopped).
+    on_progress(sent, total) reports bytes over the whole batch.
+    """
+
+    def __init__(self, paths, concurrency=DEFAULT_CONCURRENCY, stripes=1, compress=True, delta=False, on_progress=None):
+        entries = expand_paths(paths)
+        self.id = uuid.uuid4().hex[:16]
+        self.files = len(entries)
+        self.size = sum(size for _, _, size in entries)
+        self.items = plan_transfers(entries)
+        self.concurrency = max(1, min(MAX_CONCURRENCY, concurrency))
+        self.stripes = stripes
+        self.compress = compress
+        self.delta = delta
+        self.on_progress = on_progress
+        self.done = set()        # indices of finished items
+        self.failed = []         # (name, error) of items the receiver rejected or we could not read
+        self.uploads = []        # finished OutgoingFile objects, for their statistics
+        self.sent = 0
+        self.elapsed = 0.0
+        self._item_sent = {}     # item index -> bytes reported so far
+
+    @property
+    def throughput(self):
+        return sum(upload.sent - upload.resumed for upload in self.uploads) / self.elapsed / 1e6 if self.elapsed else 0.0
+
+    async def send(self, channel, pc, max_message_size=DEFAULT_MAX_MESSAGE_SIZE):
+        pending = [(index, item) for index, item in enumerate(self.items) if index not in self.done]
+        files = sum(len(item.members) if isinstance(item, FileBundle) else 1 for _, item in pending)
+        size = sum(item.size if isinstance(item, FileBundle) else item[2] for _, item in pending)
+        # What this attempt sends, so the receiver's batch progress ends at 100% after a reconnect too
+        channel_send(channel, json.dumps({"type": "file_manifest", "id": self.id, "files": files,
+                                          "size": size, "transfers": len(pending)}))
+        logger.info(f"📦 Sending {files} files ({size} bytes) as {len(pending)} transfers, "
+                    f"{self.concurrency} at a time")
+        slots = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+
+        async def run(index, item):
+            async with slots:
+                if isinstance(item, FileBundle):
+                    path, name = item, None
+                else:
+                    name, path, _ = item
+                upload = OutgoingFile(path, channel, max_message_size, lambda sent, size: self._progress(index, sent),
+                                      pc=pc, stripes=self.stripes, compress=self.compress, delta=self.delta,
+                                      name=name, dedicated=True)
+                await upload.send()
+                self.done.add(index)
+                self.uploads.append(upload)
+
+        results = await asyncio.gather(*(run(index, item) for index, item in pending), return_exceptions=True)
+        self.elapsed += time.perf_counter() - started
+        interrupted = None
+        for (index, item), result in zip(pending, results):
+            if isinstance(result, ConnectionError):
+                interrupted = interrupted or result
+            elif isinstance(result, Exception) and channel.readyState != "open":
+                # Whatever broke while the link went down (e.g. a stripe closed mid-send) resumes too
+                interrupted = interrupted or ConnectionError(f"link lost: {result!r}")
+            elif isinstance(result, BaseException):
+                name = item.name if isinstance(item, FileBundle) else item[0]
+                self.failed.append((name, result))
+                self.done.add(index)  # not retried: a read error or a rejected file fails the same way again
+                logger.error(f"❌ {name}: {result}")
+        if interrupted:
+            raise interrupted
+        return self
+
+    def _progress(self, index, sent):
+        self.sent += sent - self._item_sent.get(index, 0)
+        self._item_sent[index] = sent
+        if self.on_progress:
+            self.on_progress(self.sent, self.size)
+
+
+class BackgroundFileWriter:
+    """
+    Positional writes executed on a dedicated thread.
+
+    Contiguous writes are coalesced into WRITE_BUFFER_SIZE blocks; up to
+    MAX_OPEN_RUNS separate positions (one per stripe) are coalesced at once.
+    write() never blocks, so a stalled SD card cannot freeze the event loop:
+    the caller watches `congested` and awaits drained() before feeding more.
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        if size:
+            # Preallocated, so out-of-order stripes write straight to their final offset
+            os.ftruncate(self.fd, size)
+        self.bytes_written = 0
+        self.error = None
+        self._runs = {}  # end offset -> [start offset, bytearray], least recently extended first
+        self._queue = queue.SimpleQueue()
+        self._queued = 0       # bytes handed to the disk thread (counted on the loop)
+        self._done = 0         # bytes the disk thread is through with (counted on that thread)
+        self._drained = None   # future a drained() caller waits on, woken from the disk thread
+        self._thread = threading.Thread(target=self._run, name=f"writer-{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+
+    def write(self, offset, data):
+        if self.error:
+            raise self.error
+        run = self._runs.pop(offset, None)
+        if run is None and len(data) >= WRITE_BUFFER_SIZE and isinstance(data, bytearray):
+            # A whole verified block: hand it over as is (the caller drops its reference)
+            self._submit(offset, data)
+            return
+        if run is None:
+            if len(self._runs) >= MAX_OPEN_RUNS:
+                self._flush_run(next(iter(self._runs)))
+            run = [offset, bytearray()]
+        run[1] += data
+        if len(run[1]) >= WRITE_BUFFER_SIZE:
+            # Hand the bytearray itself to the disk thread; no copy
+            self._submit(run[0], run[1])
+        else:
+            self._runs[offset + len(data)] = run
+
+    @property
+    def backlog(self):
+        """Bytes handed over but not yet written."""
+        return self._queued - self._done
+
+    @property
+    def congested(self):
+        return self.backlog >= WRITE_QUEUE_DEPTH * WRITE_BUFFER_SIZE
+
+    async def drained(self):
+        """Waits, without blocking the loop, until the backlog is down to half of WRITE_QUEUE_DEPTH."""
+        if self.backlog <= WRITE_QUEUE_DEPTH // 2 * WRITE_BUFFER_SIZE:
+            return
+        self._drained = waiter = asyncio.get_event_loop().create_future()
+        # The disk thread may have caught up before it could see the future
+        if self.backlog <= WRITE_QUEUE_DEPTH // 2 * WRITE_BUFFER_SIZE:
+            return
+        await waiter
+
+    def call_after_writes(self, callback):
+        """Runs callback on the disk thread once everything written so far is on its way to disk."""
+        while self._runs:
+            self._flush_run(next(iter(self._runs)))
+        self._queue.put((None, callback))
+
+    def close(self, sync=True):
+        """Writes out everything still buffered and closes the file (blocking)."""
+        while self._runs:
+            self._flush_run(next(iter(self._runs)))
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if sync and not self.error:
+                os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+        if self.error:
+            raise self.error
+
+    def _flush_run(self, end):
+        self._submit(*self._runs.pop(end))
+
+    def _submit(self, offset, block):
+        self._queued += len(block)
+        self._queue.put((offset, block))
+
+    def _wake(self):
+        waiter = self._drained
+        if waiter is None or self.backlog > WRITE_QUEUE_DEPTH // 2 * WRITE_BUFFER_SIZE:
+            return
+        self._drained = None
+        try:
+            waiter.get_loop().call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+        except RuntimeError:
+            pass  # the loop is gone, and the waiter with it
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            offset, block = item
+            try:
+                if self.error:
+                    continue
+                if offset is None:
+                    block()
+                    continue
+                view = memoryview(block)
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(self.fd, view):]
+                self.bytes_written += len(block)
+            except OSError as e:
+                self.error = e
+                logger.error(f"Disk write failed for {self.path}: {e}")
+            finally:
+                if offset is not None:
+                    # Dropped blocks after an error count too, so a waiting drained() returns
+                    self._done += len(block)
+                    self._wake()
+
+
+class IncomingFile:
+    """
+    One file being received, streamed to disk with a running byte counter.
+
+    Framed transfers feed_framed() offset-prefixed messages in any order and track
+    completed blocks in a BlockBitmap that survives a dropped link; legacy senders
+    feed() raw chunks in order. The file is complete once file_end was seen
+    (ended) and every block has arrived, whichever happens last.
+
+    Hashed transfers assemble each block in memory and write it only after its
+    digest matched (checked on HASH_POOL), then report on_verified(incoming); a
+    mismatch calls on_corrupt(incoming, index) and the block is expected again.
+    Blocks kept from an earlier attempt are hashed from the .part file by finish().
+    After open_basis() copy records fill block ranges from the mapped old file.
+    A bundle (meta "bundle": [[name, size], ...]) is split into its members by finish().
+    """
+
+    def __init__(self, meta, download_dir=DOWNLOAD_DIR, on_verified=None, on_corrupt=None):
+        self.id = meta.get("id") or uuid.uuid4().hex[:8]
+        self.name = safe_relative_path(meta.get("name"))
+        self.size = int(meta.get("size", 0))
+        self.stripes = int(meta.get("stripes", 1))
+        self.striped = "stripes" in meta  # on channels of its own rather than in-band
+        self.framed = bool(meta.get("framed")) or self.striped
+        self.members = [(safe_relative_path(name), int(size)) for name, size in meta.get("bundle") or []]
+        if self.members and sum(size for _, size in self.members) != self.size:
+            raise ValueError(f"bundle members do not add up to {self.size} bytes")
+        self.block_size = int(meta.get("block_size", BLOCK_SIZE))
+        self.resumable = self.framed and "block_size" in meta
+        self.hashed = self.framed and meta.get("hash") == HASH_NAME
+        # First codec the sender offered that we have too; announced back in file_resume
+        offered = meta.get("compression") if self.framed else None
+        self.codec = next((codec for codec in available_codecs() if isinstance(offered, list) and codec in offered), None)
+        self.on_verified = on_verified
+        self.on_corrupt = on_corrupt
+        self.ended = False
+        self.expected_root = None  # whole-file digest from file_end
+        self.download_dir = download_dir
+        self.path = os.path.join(download_dir, self.name)
+        directory, file_name = os.path.split(self.path)
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f".{file_name}.{safe_file_name(self.id)}")
+        self.part_path = base + ".part"
+        self.state_path = base + ".state"
+
+        self.blocks = block_ranges(self.size, self.block_size)
+        self.have = self._load_state() if self.resumable else BlockBitmap(len(self.blocks))
+        self.received = sum(end - start for index, (start, end) in enumerate(self.blocks) if index in self.have)
+        self.resumed = self.received
+        self.digests = {}      # block index -> digest of a block verified in this attempt
+        self.retries = {}      # block index -> failed verifications
+        self._partial = {}     # block index -> bytes received so far
+        self._assembling = {}  # block index -> [block buffer, bytes received so far] (hashed only)
+        self._expected = {}    # block index -> digest announced by the sender
+        self._since_checkpoint = 0
+        self._closed = False
+        self.basis = None      # read-only map of the file being replaced, for delta copies
+        self.writer = BackgroundFileWriter(self.part_path, self.size if self.framed else None)
+
+    @property
+    def progress(self):
+        return int(self.received * 100 / self.size) if self.size else 100
+
+    @property
+    def complete(self):
+        return self.ended and (self.have.full if self.framed else self.received >= self.size)
+
+    def feed(self, chunk):
+        if self.framed:
+            return self.feed_framed(chunk)
+        return self.feed_at(self.received, chunk)
+
+    def feed_framed(self, message):
+        (offset,) = STRIPE_HEADER.unpack_from(message)
+        payload = memoryview(message)[STRIPE_HEADER.size:]
+        if offset & DIGEST_FLAG:
+            return self.expect_digest(offset & ~DIGEST_FLAG, bytes(payload))
+        if offset & COPY_FLAG:
+            return self.copy_from_basis(offset & ~COPY_FLAG, payload)
+        if offset & COMPRESSED_FLAG:
+            if self.codec is None:
+                raise IOError("compressed data on a transfer without a codec")
+            # Inflating a 64 KB frame takes well under a millisecond, so it stays on the loop
+            offset &= ~COMPRESSED_FLAG
+            payload = decompress_frame(payload, self.codec, self.block_size)
+        return self.feed_at(offset, payload)
+
+    def feed_at(self, offset, chunk):
+        if offset + len(chunk) > self.size:
+            raise IOError(f"chunk at {offset} runs past the announced size {self.size}")
+        if self.framed:
+            index = offset // self.block_size
+            if index in self.have:
+                return self.received
+            if self.hashed:
+                return self._assemble(index, offset, chunk)
+            done = self._partial.get(index, 0) + len(chunk)
+            start, end = self.blocks[index]
+            if done >= end - start:
+                self._partial.pop(index, None)
+                self._block_done(index)
+            else:
+                self._partial[index] = done
+        self.writer.write(offset, chunk)
+        self.received += len(chunk)
+        if self._since_checkpoint >= CHECKPOINT_BLOCKS:
+            self.checkpoint()
+        return self.received
+
+    def expect_digest(self, index, digest):
+        if not self.hashed or index >= len(self.blocks):
+            raise IOError(f"unexpected digest for block {index}")
+        if index not in self.have:
+            # Unordered stripes may deliver the digest before the last chunk of its block
+            self._expected[index] = digest
+            self._verify(index)
+        return self.received
+
+    def open_basis(self):
+        """Maps the file at the destination for delta copies; False when there is nothing to reuse."""
+        if self.hashed and self.basis is None:
+            try:
+                with open(self.path, "rb") as f:
+                    self.basis = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):  # missing, or empty (a zero-length map is an error)
+                pass
+        return self.basis is not None
+
+    def copy_from_basis(self, index, records):
+        if self.basis is None or index >= len(self.blocks) or len(records) % COPY_RECORD.size:
+            raise IOError(f"unexpected copy records for block {index}")
+        if index in self.have:
+            return self.received
+        start, end = self.blocks[index]
+        for offset, old_offset, length in COPY_RECORD.iter_unpack(records):
+            if offset < start or offset + length > end or old_offset + length > len(self.basis):
+                raise IOError(f"copy record outside block {index} or the old file")
+            entry = self._assembly(index)
+            entry[0][offset - start:offset - start + length] = self.basis[old_offset:old_offset + length]
+            entry[1] += length
+            self.received += length
+        self._verify(index)
+        return self.received
+
+    def checkpoint(self):
+        """Persists the bitmap once every block it lists has reached the disk (ordered on the writer thread)."""
+        if not self.resumable:
+            return
+        self._since_checkpoint = 0
+        state = {"id": self.id, "name": self.name, "size": self.size,
+                 "block_size": self.block_size, "have": self.have.hex()}
+        self.writer.call_after_writes(lambda: self._save_state(state))
+
+    def stop(self, checkpoint=False):
+        """
+        Stops taking data (on the loop): blocks still being assembled or hashed are
+        dropped, and with checkpoint=True the bitmap is queued behind the writes.
+        Then finish(), suspend() or abort() does the blocking part off the loop.
+        """
+        self._close_assembly()
+        if checkpoint:
+            self.checkpoint()
+
+    def suspend(self):
+        """Link lost: keeps the .part file and its bitmap for a resume (blocking). Non-resumable files are dropped."""
+        if not self.resumable:
+            self.abort()
+            return
+        try:
+            self.writer.close()
+        except OSError as e:
+            logger.error(f"Could not keep partial {self.name}: {e}")
+
+    def finish(self):
+        """Flushes, checks the whole-file digest and atomically renames the .part file into place (blocking)."""
+        try:
+            self.writer.close()
+            if not (self.have.full if self.framed else self.received == self.size):
+                raise IOError(f"expected {self.size} bytes, received {self.received}")
+            if self.hashed and self.expected_root is not None:
+                if self._root_digest() != self.expected_root:
+                    raise IOError(f"{self.name} failed whole-file verification")
+            if self.members:
+                path = self._unpack()
+            else:
+                path = self.path
+                os.replace(self.part_path, path)
+        except Exception:
+            self._remove_files()
+            raise
+        self._remove_files()
+        return path
+
+    def abort(self):
+        try:
+            self.writer.close(sync=False)
+        except OSError:
+            pass
+        self._remove_files()
+
+    def _assemble(self, index, offset, chunk):
+        start, end = self.blocks[index]
+        if offset + len(chunk) > end:
+            raise IOError(f"chunk at {offset} crosses the end of block {index}")
+        entry = self._assembly(index)
+        entry[0][offset - start:offset - start + len(chunk)] = chunk
+        entry[1] += len(chunk)
+        self.received += len(chunk)
+        self._verify(index)
+        return self.received
+
+    def _unpack(self):
+        """Splits a verified bundle into its member files; returns the directory holding them."""
+        paths = []
+        with open(self.part_path, "rb") as source:
+            for name, size in self.members:
+                path = os.path.join(self.download_dir, name)
+                directory, file_name = os.path.split(path)
+                os.makedirs(directory, exist_ok=True)
+                temporary = os.path.join(directory, f".{file_name}.{safe_file_name(self.id)}.tmp")
+                with open(temporary, "wb") as out:
+                    remaining = size
+                    while remaining:
+                        data = source.read(min(remaining, WRITE_BUFFER_SIZE))
+                        if not data:
+                            raise IOError(f"bundle ends inside {name}")
+                        out.write(data)
+                        remaining -= len(data)
+                os.replace(temporary, path)
+                paths.append(path)
+        if hasattr(os, "sync"):
+            # One flush for all members instead of an fsync per small file
+            os.sync()
+        return os.path.commonpath(paths) if len(paths) > 1 else paths[0]
+
+    def _assembly(self, index):
+        entry = self._assembling.get(index)
+        if entry is None:
+            start, end = self.blocks[index]
+            entry = self._assembling[index] = [bytearray(end - start), 0]
+        return entry
+
+    def _verify(self, index):
+        entry = self._assembling.get(index)
+        expected = self._expected.get(index)
+        if entry is None or expected is None or entry[1] < len(entry[0]):
+            return
+        del self._assembling[index]
+        del self._expected[index]
+        block = entry[0]
+        future = asyncio.get_event_loop().run_in_executor(HASH_POOL, block_digest, block)
+        future.add_done_callback(lambda f: self._verified(index, block, expected, f))
+
+    def _verified(self, index, block, expected, future):
+        if self._closed or future.cancelled() or index in self.have:
+            return
+        digest = future.result()
+        if digest != expected:
+            self.received -= len(block)
+            self.retries[index] = self.retries.get(index, 0) + 1
+            if self.on_corrupt:
+                self.on_corrupt(self, index)
+            return
+        try:
+            self.writer.write(self.blocks[index][0], block)
+        except OSError as e:
+            if self.on_verified:
+                self.on_verified(self, e)
+            return
+        self.digests[index] = digest
+        self._block_done(index)
+        if self._since_checkpoint >= CHECKPOINT_BLOCKS:
+            self.checkpoint()
+        if self.on_verified:
+            self.on_verified(self)
+
+    def _block_done(self, index):
+        self.have.add(index)
+        self._since_checkpoint += 1
+
+    def _close_assembly(self):
+        self._closed = True
+        self._assembling.clear()
+        self._expected.clear()
+        if self.basis is not None:
+            # Before finish() renames over the file it maps (Windows refuses to replace a mapped file)
+            self.basis.close()
+            self.basis = None
+
+    def _root_digest(self):
+        # Blocks from an earlier attempt were verified back then; rehash them from disk in case it changed since
+        digests = []
+        with open(self.part_path, "rb") as f:
+            for index, (start, end) in enumerate(self.blocks):
+                digest = self.digests.get(index)
+                if digest is None:
+                    f.seek(start)
+                    digest = block_digest(f.read(end - start))
+                digests.append(digest)
+        return root_digest(digests)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            if (state.get("size"), state.get("block_size")) == (self.size, self.block_size) \
+                    and os.path.exists(self.part_path):
+                return BlockBitmap.from_hex(state.get("have", ""), len(self.blocks))
+        except (OSError, ValueError):
+            pass
+        return BlockBitmap(len(self.blocks))
+
+    def _save_state(self, state):
+        # Runs on the writer thread after the blocks it lists were written: sync them before claiming them
+        os.fsync(self.writer.fd)
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _remove_files(self):
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class FileReceiver:
+    """
+    Receiving end of a control channel and its stripe channels.
+
+    Dispatches file_start / file_end, in-band chunks and offset-framed stripe
+    messages to IncomingFile objects, answers resumable file_starts with the
+    blocks already on disk, asks again for blocks that fail verification
+    (block_nack), pauses the sender while the disk is behind (file_pause /
+    file_continue) and tells the sender how it ended (file_done / file_failed).
+    Reports through callbacks:
+    on_start(incoming), on_progress(incoming), on_complete(incoming, path),
+    on_error(incoming, exc) and on_manifest(batch) when a TransferQueue
+    announces a batch. Completed files are finished off the event loop.
+    """
+
+    def __init__(self, download_dir=DOWNLOAD_DIR, on_start=None, on_progress=None, on_complete=None, on_error=None,
+                 on_manifest=None):
+        self.download_dir = download_dir
+        self.on_manifest = on_manifest
+        self.on_start = on_start
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.channel = None   # control channel, for file_resume replies
+        self.current = None   # transfer whose chunks arrive in-band on the control channel
+        self.transfers = {}   # transfer id -> IncomingFile
+        self._early = {}      # transfer id -> stripe messages that overtook their file_start
+        self._stripes = {}    # transfer id -> its stripe channels, closed when the transfer ends
+        self._parked = {}     # transfer id -> (feed, message) held while its sender is paused
+        self.batch = None     # latest file_manifest, for progress over a whole queue
+        self.batch_done = 0   # bytes of that batch already finished
+
+    def attach(self, channel):
+        self.channel = channel
+        channel.on("message", self.on_message)
+
+    def attach_stripe(self, channel):
+        transfer_id = parse_stripe_label(channel.label)
+        self._stripes.setdefault(transfer_id, []).append(channel)
+        channel.on("message", lambda message: self.on_stripe_message(transfer_id, message))
+
+    def on_message(self, message):
+        if isinstance(message, str):
+            try:
+                self._on_control(json.loads(message))
+            except (ValueError, TypeError, OSError) as e:
+                logger.warning(f"Dropped control message: {e}")
+        elif self.current:
+            self._feed(self.current, self.current.feed, message)
+
+    def on_stripe_message(self, transfer_id, message):
+        incoming = self.transfers.get(transfer_id)
+        if incoming is None:
+            # Stripes are separate SCTP streams and may beat file_start; bounded by the sender's window
+            early = self._early.setdefault(transfer_id, [])
+            if len(early) < BUFFER_HIGH_WATER // INITIAL_CHUNK_SIZE:
+                early.append(message)
+                return
+            # Never drop data silently: closing the stripes fails this attempt, and the sender retries and resumes
+            logger.warning(f"Too much data ahead of file_start for transfer {transfer_id}, resetting its stripes")
+            del self._early[transfer_id]
+            for channel in self._stripes.pop(transfer_id, []):
+                channel.close()
+            return
+        self._feed(incoming, incoming.feed_framed, message)
+
+    async def close(self):
+        """Link lost: resumable transfers keep their partial file and bitmap, others are discarded."""
+        suspended = list(self.transfers.values())
+        for incoming in suspended:
+            incoming.stop(checkpoint=True)
+        self.transfers.clear()
+        self._early.clear()
+        self._parked.clear()
+        for channels in self._stripes.values():
+            for channel in channels:
+                channel.close()
+        self._stripes.clear()
+        self.current = None
+        # Only flushing the .part files blocks; the bookkeeping above stays on the loop with the message handlers
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, incoming.suspend) for incoming in suspended))
+
+    def _on_control(self, meta):
+        msg_type = meta.get("type")
+        if msg_type == "file_start":
+            previous = self.transfers.get(meta.get("id"))
+            # The stripes under this id are already the new attempt's (its sender closes the old ones)
+            if previous and self._forget(previous, keep_stripes=True):
+                # Sender restarted the same transfer: checkpoint what we have before reopening it
+                previous.stop(checkpoint=True)
+                asyncio.ensure_future(self._restart(previous, meta))
+            else:
+                self._start(meta)
+        elif msg_type == "file_manifest":
+            self.batch = meta
+            self.batch_done = 0
+            if self.on_manifest:
+                self.on_manifest(meta)
+        elif msg_type == "file_end":
+            incoming = self.transfers.get(meta.get("id"), self.current)
+            if incoming:
+                incoming.ended = True
+                if meta.get("digest"):
+                    incoming.expected_root = bytes.fromhex(meta["digest"])
+                self._check_complete(incoming)
+
+    def _start(self, meta):
+        incoming = IncomingFile(meta, self.download_dir, self._on_verified, self._on_corrupt)
+        if not incoming.striped:
+            if self.current:
+                self._fail(self.current, ConnectionError("superseded by a new transfer"))
+            self.current = incoming
+        self.transfers[incoming.id] = incoming
+        if incoming.resumable:
+            reply = {"type": "file_resume", "id": incoming.id, "have": incoming.have.hex()}
+            if incoming.hashed:
+                reply["hash"] = HASH_NAME
+            if incoming.codec:
+                reply["compression"] = incoming.codec
+            if meta.get("delta") and incoming.open_basis():
+                reply["delta"] = True
+            self._reply(reply)
+            if reply.get("delta"):
+                asyncio.ensure_future(self._send_signature(incoming))
+        if self.on_start:
+            self.on_start(incoming)
+        for message in self._early.pop(incoming.id, []):
+            self._feed(incoming, incoming.feed_framed, message)
+
+    async def _restart(self, previous, meta):
+        # The new attempt reads the bitmap the old one is still writing out; the sender waits for file_resume
+        await asyncio.get_event_loop().run_in_executor(None, previous.suspend)
+        try:
+            self._start(meta)
+        except (ValueError, TypeError, OSError) as e:
+            logger.warning(f"Dropped control message: {e}")
+
+    def _feed(self, incoming, feed, message):
+        parked = self._parked.get(incoming.id)
+        if parked is not None:
+            # What the sender had in flight when it was paused; fed in order once the disk catches up
+            parked.append((feed, message))
+            return
+        self._deliver(incoming, feed, message)
+        self._throttle(incoming)
+
+    def _deliver(self, incoming, feed, message):
+        try:
+            feed(message)
+        except OSError as e:
+            self._fail(incoming, e)
+            return
+        if self.on_progress:
+            self.on_progress(incoming)
+        self._check_complete(incoming)
+
+    def _throttle(self, incoming):
+        """Pauses the sender of a transfer whose disk writes fall behind; the loop itself never waits for the disk."""
+        if incoming.writer.congested and incoming.id not in self._parked \
+                and self.transfers.get(incoming.id) is incoming:
+            parked = self._parked[incoming.id] = deque()
+            self._reply({"type": "file_pause", "id": incoming.id})
+            asyncio.ensure_future(self._unpark(incoming, parked))
+
+    async def _unpark(self, incoming, parked):
+        while True:
+            await incoming.writer.drained()
+            while parked and self._parked.get(incoming.id) is parked and not incoming.writer.congested:
+                self._deliver(incoming, *parked.popleft())
+            if self._parked.get(incoming.id) is not parked:
+                return  # finished, failed or suspended meanwhile
+            if not parked and not incoming.writer.congested:
+                break
+        del self._parked[incoming.id]
+        self._reply({"type": "file_continue", "id": incoming.id})
+
+    async def _send_signature(self, incoming):
+        """Streams the chunk signature of the file being replaced, computed off the loop."""
+        loop = asyncio.get_event_loop()
+
+        def scan():
+            records = []
+            flushed = time.monotonic()
+            for record in content_chunks(incoming.path):
+                if self.transfers.get(incoming.id) is not incoming:
+                    break
+                records.append(SIGNATURE_RECORD.pack(*record))
+                # Time-bounded too: a slow scan (no numpy) must not look like a stalled one to the sender
+                if len(records) == SIGNATURE_BATCH or time.monotonic() - flushed >= SIGNATURE_FLUSH_INTERVAL:
+                    batch = b"".join(records).hex()
+                    loop.call_soon_threadsafe(self._reply, {"type": "file_signature", "id": incoming.id, "chunks": batch})
+                    records = []
+                    flushed = time.monotonic()
+            return b"".join(records)
+
+        try:
+            rest = await loop.run_in_executor(CDC_POOL, scan)
+        except OSError as e:
+            logger.warning(f"Could not scan {incoming.path} for delta sync: {e}")
+            rest = b""
+        # Queued behind every batch above, so the sender sees done last
+        self._reply({"type": "file_signature", "id": incoming.id, "chunks": rest.hex(), "done": True})
+
+    @property
+    def batch_progress(self):
+        """Percent of the announced batch on disk or in flight, None without a manifest."""
+        if not self.batch:
+            return None
+        size = int(self.batch.get("size", 0))
+        received = self.batch_done + sum(incoming.received for incoming in self.transfers.values())
+        return min(100, int(received * 100 / size)) if size else 100
+
+    @property
+    def batch_complete(self):
+        return bool(self.batch) and not self.transfers and self.batch_done >= int(self.batch.get("size", 0))
+
+    def _on_verified(self, incoming, error=None):
+        if error is not None:
+            self._fail(incoming, error)
+            return
+        if self.on_progress:
+            self.on_progress(incoming)
+        self._check_complete(incoming)
+        self._throttle(incoming)
+
+    def _on_corrupt(self, incoming, index):
+        if incoming.retries[index] > MAX_BLOCK_RETRIES:
+            self._fail(incoming, IOError(f"block {index} failed verification {MAX_BLOCK_RETRIES + 1} times"))
+            return
+        logger.warning(f"⚠️ {incoming.name}: block {index} failed verification, asking for it again")
+        self._reply({"type": "block_nack", "id": incoming.id, "blocks": [index]})
+
+    def _reply(self, message):
+        if self.channel and self.channel.readyState == "open":
+            self.channel.send(json.dumps(message))
+
+    def _check_complete(self, incoming):
+        if incoming.complete and self._forget(incoming):
+            asyncio.ensure_future(self._finish(incoming))
+
+    async def _finish(self, incoming):
+        incoming.stop()
+        try:
+            # Drain the writer, fsync and rename the .part file into place without blocking the loop
+            path = await asyncio.get_event_loop().run_in_executor(None, incoming.finish)
+        except Exception as e:
+            self._reply({"type": "file_failed", "id": incoming.id, "reason": str(e)})
+            if self.on_error:
+                self.on_error(incoming, e)
+            return
+        self._reply({"type": "file_done", "id": incoming.id})
+        self.batch_done += incoming.size
+        if self.on_complete:
+            self.on_complete(incoming, path)
+
+    def _fail(self, incoming, error):
+        if self._forget(incoming):
+            incoming.stop()
+            asyncio.get_event_loop().run_in_executor(None, incoming.abort)
+            self._reply({"type": "file_failed", "id": incoming.id, "reason": str(error)})
+            if self.on_error:
+                self.on_error(incoming, error)
+
+    def _forget(self, incoming, keep_stripes=False):
+        if self.transfers.get(incoming.id) is not incoming:
+            return False
+        del self.transfers[incoming.id]
+        self._parked.pop(incoming.id, None)
+        if self.current is incoming:
+            self.current = None
+        if not keep_stripes:
+            for channel in self._stripes.pop(incoming.id, []):
+                channel.close()
+        return True
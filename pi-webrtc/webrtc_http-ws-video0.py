@@ -1,5 +1,4 @@
 import asyncio
-import json
 import uuid
 import logging
 import numpy as np
@@ -7,13 +6,25 @@ import fractions
 import cv2
 import sys
 from aiohttp import web
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, MediaStreamTrack
+from aiortc import MediaStreamTrack
+from webrtc_certificates import install_certificate_cache
+from webrtc_media_policy import MediaPolicy
+from webrtc_shared_source import SharedTrackSource
+from webrtc_static import StaticAsset, aiohttp_handler
+from webrtc_viewer_sessions import ViewerSessions, MAX_SESSIONS
+from webrtc_whip_whep import WhipWhepEndpoints
 from av import VideoFrame
 
 # Logging Setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 logger = logging.getLogger("WebRTC-CameraServer")
 
+# Codec / bitrate policy applied to every viewer connection (see webrtc_media_policy.py)
+MEDIA_POLICY = MediaPolicy()
+
+# One DTLS certificate per process, rotated daily (see webrtc_certificates.py)
+install_certificate_cache()
+
 class CameraVideoTrack(MediaStreamTrack):
     """
     Captures live frames from the system's hardware camera (Video 0)
@@ -77,165 +88,98 @@ class CameraVideoTrack(MediaStreamTrack):
         super().stop()
 
 
-class WebRTCServer:
-    def __init__(self):
-        self.peer_id = f"live_cam_{uuid.uuid4().hex[:6]}"
-        self.pc = None
-        self.current_track = None
-
-    async def handle_index(self, request):
-        """HTTP Endpoint: Serves the Web Player UI embedded directly into the python script."""
-        html_content = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>WebRTC Live Camera</title>
-            <style>
-                body { font-family: system-ui, sans-serif; text-align: center; background: #111; color: #eee; padding: 40px; }
-                .card { max-width: 640px; margin: 0 auto; background: #222; padding: 25px; border-radius: 12px; border: 1px solid #333; }
-                video { width: 100%; background: #000; border-radius: 8px; margin-top: 20px; border: 1px solid #444; }
-                button { background: #28a745; color: white; border: none; padding: 12px 28px; border-radius: 6px; cursor: pointer; font-size: 16px; font-weight: bold; }
-                button:hover { background: #218838; }
-                #status { color: #28a745; font-weight: bold; }
-            </style>
-        </head>
-        <body>
-            <div class="card">
-                <h2>Live Hardware Camera Streamer</h2>
-                <p>Status: <span id="status">Ready</span></p>
-                <button id="startBtn">Start Live Camera Feed</button>
-                <video id="remoteVideo" autoplay playsinline controls></video>
-            </div>
-            <script>
-                const wsProtocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
-                const socket = new WebSocket(`${wsProtocol}${window.location.host}/ws`);
-                let pc = null;
-
-                document.getElementById('startBtn').onclick = async () => {
-                    document.getElementById('status').innerText = "Initializing connection...";
-                    
-                    if(pc) { pc.close(); }
-                    pc = new RTCPeerConnection();
-                    
-                    pc.addTransceiver('video', { direction: 'recvonly' });
-                    
-                    pc.ontrack = (event) => {
-                        document.getElementById('status').innerText = "Streaming Live!";
-                        document.getElementById('remoteVideo').srcObject = event.streams[0];
-                    };
-
-                    pc.onicecandidate = (event) => {
-                        if (event.candidate) {
-                            socket.send(JSON.stringify({
-                                type: 'ice',
-                                data: {
-                                    sdpMid: event.candidate.sdpMid,
-                                    sdpMLineIndex: event.candidate.sdpMLineIndex,
-                                    candidate: event.candidate.candidate
-                                }
-                            }));
-                        }
-                    };
+# Web Player UI, encoded and precompressed once at startup (see webrtc_static.py)
+INDEX_PAGE = StaticAsset("""\
+<!DOCTYPE html>
+<html>
+<head>
+    <title>WebRTC Live Camera</title>
+    <style>
+        body { font-family: system-ui, sans-serif; text-align: center; background: #111; color: #eee; padding: 40px; }
+        .card { max-width: 640px; margin: 0 auto; background: #222; padding: 25px; border-radius: 12px; border: 1px solid #333; }
+        video { width: 100%; background: #000; border-radius: 8px; margin-top: 20px; border: 1px solid #444; }
+        button { background: #28a745; color: white; border: none; padding: 12px 28px; border-radius: 6px; cursor: pointer; font-size: 16px; font-weight: bold; }
+        button:hover { background: #218838; }
+        #status { color: #28a745; font-weight: bold; }
+    </style>
+</head>
+<body>
+    <div class="card">
+        <h2>Live Hardware Camera Streamer</h2>
+        <p>Status: <span id="status">Ready</span></p>
+        <button id="startBtn">Start Live Camera Feed</button>
+        <video id="remoteVideo" autoplay playsinline controls></video>
+    </div>
+    <script>
+        const wsProtocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+        const socket = new WebSocket(`${wsProtocol}${window.location.host}/ws`);
+        let pc = null;
+
+        document.getElementById('startBtn').onclick = async () => {
+            document.getElementById('status').innerText = "Initializing connection...";
+            
+            if(pc) { pc.close(); }
+            pc = new RTCPeerConnection();
+            
+            pc.addTransceiver('video', { direction: 'recvonly' });
+            
+            pc.ontrack = (event) => {
+                document.getElementById('status').innerText = "Streaming Live!";
+                document.getElementById('remoteVideo').srcObject = event.streams[0];
+            };
 
-                    const offer = await pc.createOffer();
-                    await pc.setLocalDescription(offer);
-                    
+            pc.onicecandidate = (event) => {
+                if (event.candidate) {
                     socket.send(JSON.stringify({
-                        type: 'offer',
-                        data: { sdp: offer.sdp, type: offer.type }
+                        type: 'ice',
+                        data: {
+                            sdpMid: event.candidate.sdpMid,
+                            sdpMLineIndex: event.candidate.sdpMLineIndex,
+                            candidate: event.candidate.candidate
+                        }
                     }));
-                };
-
-                socket.onmessage = async (event) => {
-                    const msg = JSON.parse(event.data);
-                    if (msg.type === 'answer') {
-                        document.getElementById('status').innerText = "SDP Handshake Complete. Activating Feed...";
-                        await pc.setRemoteDescription(new RTCSessionDescription(msg.data));
-                    } else if (msg.type === 'ice') {
-                        await pc.addIceCandidate(new RTCIceCandidate(msg.data));
-                    }
-                };
-            </script>
-        </body>
-        </html>
-        """
-        return web.Response(text=html_content, content_type='text/html')
-
-    async def handle_websocket(self, request):
-        """WebSocket Endpoint: Handles WebRTC signaling handshakes."""
-        ws = web.WebSocketResponse()
-        await ws.prepare(request)
-        logger.info("WebSocket Client handshake active.")
-
-        try:
-            async for msg in ws:
-                if msg.type == web.WSMsgType.TEXT:
-                    payload = json.loads(msg.data)
-                    msg_type = payload.get("type")
-
-                    if msg_type == "offer":
-                        logger.info("📥 WebRTC Offer received via WebSocket connection.")
-                        await self.handle_offer(payload.get("data"), ws)
-                    elif msg_type == "ice":
-                        await self.handle_ice(payload.get("data"))
-        except Exception as e:
-            logger.error(f"WebSocket execution error: {e}")
-        finally:
-            logger.info("WebSocket Client connection lifecycle ended.")
-        return ws
+                }
+            };
 
-    async def handle_offer(self, data, ws):
-        if self.pc: 
-            await self.pc.close()
-            if self.current_track:
-                self.current_track.stop()
+            const offer = await pc.createOffer();
+            await pc.setLocalDescription(offer);
+            
+            socket.send(JSON.stringify({
+                type: 'offer',
+                data: { sdp: offer.sdp, type: offer.type }
+            }));
+        };
+
+        socket.onmessage = async (event) => {
+            const msg = JSON.parse(event.data);
+            if (msg.type === 'answer') {
+                document.getElementById('status').innerText = "SDP Handshake Complete. Activating Feed...";
+                await pc.setRemoteDescription(new RTCSessionDescription(msg.data));
+            } else if (msg.type === 'ice') {
+                await pc.addIceCandidate(new RTCIceCandidate(msg.data));
+            }
+        };
+    </script>
+</body>
+</html>
+""")
 
-        self.pc = RTCPeerConnection()
-        
-        # CHANGED: Hooks directly into system video source index 0 instead of a file string
-        self.current_track = CameraVideoTrack(camera_index=0)
-        self.pc.addTrack(self.current_track)
-        
-        @self.pc.on("icecandidate")
-        async def on_candidate(candidate):
-            if candidate and not ws.closed:
-                await ws.send_str(json.dumps({
-                    "type": "ice", 
-                    "data": {
-                        "sdpMid": candidate.sdpMid, 
-                        "sdpMLineIndex": candidate.sdpMLineIndex, 
-                        "candidate": candidate.candidate
-                    }
-                }))
 
-        @self.pc.on("connectionstatechange")
-        async def on_state_change():
-            logger.info(f"WebRTC Connection State: {self.pc.connectionState}")
-            if self.pc.connectionState in ["failed", "closed"]:
-                if self.current_track: 
-                    self.current_track.stop()
+class WebRTCServer:
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.peer_id = f"live_cam_{uuid.uuid4().hex[:6]}"
+        # One capture for every viewer: opened by the first session, stopped after the last one
+        self.source = SharedTrackSource(lambda: CameraVideoTrack(camera_index=0), "camera")
+        self.sessions = ViewerSessions(self.source, MEDIA_POLICY, max_sessions)
+        self.index_handler = aiohttp_handler(INDEX_PAGE)
 
-        await self.pc.setRemoteDescription(RTCSessionDescription(sdp=data["sdp"], type=data["type"]))
-        answer = await self.pc.createAnswer()
-        await self.pc.setLocalDescription(answer)
-        
-        if not ws.closed:
-            await ws.send_str(json.dumps({
-                "type": "answer", 
-                "data": {
-                    "sdp": self.pc.localDescription.sdp, 
-                    "type": self.pc.localDescription.type
-                }
-            }))
+    async def handle_index(self, request):
+        """HTTP Endpoint: Serves the Web Player UI embedded directly into the script."""
+        return await self.index_handler(request)
 
-    async def handle_ice(self, data):
-        if self.pc:
-            candidate = RTCIceCandidate(
-                sdpMid=data["sdpMid"], 
-                sdpMLineIndex=data["sdpMLineIndex"], 
-                candidate=data["candidate"]
-            )
-            await self.pc.addIceCandidate(candidate)
+    async def handle_websocket(self, request):
+        """WebSocket Endpoint: one independent viewer session per socket."""
+        return await self.sessions.handle_websocket(request)
 
 
 if __name__ == "__main__":
@@ -247,10 +191,17 @@ if __name__ == "__main__":
     
     app.router.add_get('/', server_instance.handle_index)
     app.router.add_get('/ws', server_instance.handle_websocket)
+
+    # Single round-trip WHEP egress (POST /whep) and WHIP ingest (POST /whip/<name>)
+    whip_whep = WhipWhepEndpoints({"camera": server_instance.source}, MEDIA_POLICY, MAX_SESSIONS,
+                                  viewers=server_instance.sessions)
+    whip_whep.register(app)
+    app.on_shutdown.append(server_instance.sessions.close_all)
     
     print("-" * 60)
     print("🚀 UNIFIED LIVE CAMERA SERVER ONLINE")
     print("Open Link: http://localhost")
+    print("WHEP: POST application/sdp to http://localhost/whep")
     print("-" * 60)
     
     web.run_app(app, host='0.0.0.0', port=80)
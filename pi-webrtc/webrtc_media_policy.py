@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+from aiortc import RTCRtpSender
+
+logger = logging.getLogger("WebRTC-MediaPolicy")
+
+
+class MediaPolicy:
+    """
+    Per-source codec and bitrate configuration applied inside handle_offer.
+
+    codec_order lists MIME types in order of preference ("auto" puts H.264 first
+    only when passthrough=True, VP8 otherwise). aiortc always encodes H.264 in
+    software with libx264, so an FFmpeg build shipping h264_v4l2m2m & co. says
+    nothing about the device and is no reason to prefer H.264; set passthrough
+    only for sources that hand aiortc already-encoded H.264.
+    Bitrates are in bits per second; keyframe_interval is in seconds (None = only on PLI).
+    """
+
+    def __init__(self, codec_order="auto", min_bitrate=250_000, start_bitrate=800_000,
+                 max_bitrate=2_000_000, keyframe_interval=2.0, passthrough=False):
+        self.codec_order = codec_order
+        self.min_bitrate = min_bitrate
+        self.start_bitrate = start_bitrate
+        self.max_bitrate = max_bitrate
+        self.keyframe_interval = keyframe_interval
+        self.passthrough = passthrough
+        self._bitrates_installed = False
+
+    def resolved_codec_order(self):
+        if self.codec_order != "auto":
+            return list(self.codec_order)
+
+        if self.passthrough:
+            logger.info("🎛️ Preferring H.264 (passthrough pipeline)")
+            return ["video/H264", "video/VP8"]
+        return ["video/VP8", "video/H264"]
+
+    def install_bitrate_limits(self):
+        """
+        aiortc clamps every REMB-driven target_bitrate update against module level
+        constants, and seeds new encoders with DEFAULT_BITRATE, so the limits are
+        applied process-wide once rather than per encoder instance.
+        """
+        if self._bitrates_installed:
+            return
+
+        from aiortc.codecs import h264, vpx
+        for codec_module in (h264, vpx):
+            codec_module.MIN_BITRATE = self.min_bitrate
+            codec_module.DEFAULT_BITRATE = self.start_bitrate
+            codec_module.MAX_BITRATE = self.max_bitrate
+        self._bitrates_installed = True
+        logger.info(f"📶 Bitrate policy: min={self.min_bitrate} start={self.start_bitrate} max={self.max_bitrate} bps")
+
+
+def apply_media_policy(pc, sender, policy):
+    """
+    Applies a MediaPolicy to the transceiver owning `sender`.
+    Must be called after addTrack and BEFORE setRemoteDescription, because aiortc
+    filters the negotiated codec list against the preferences at that point.
+    """
+    policy.install_bitrate_limits()
+
+    transceiver = next((t for t in pc.getTransceivers() if t.sender is sender), None)
+    if transceiver is None:
+        logger.warning("Media policy skipped: sender is not attached to this peer connection.")
+        return
+
+    capabilities = RTCRtpSender.getCapabilities(transceiver.kind).codecs
+    preferred = []
+    for mime_type in policy.resolved_codec_order():
+        preferred.extend(c for c in capabilities if c.mimeType.lower() == mime_type.lower())
+    # Keep RTX / remaining codecs after the preferred ones so retransmissions still negotiate
+    preferred.extend(c for c in capabilities if c not in preferred)
+    transceiver.setCodecPreferences(preferred)
+
+    if policy.keyframe_interval:
+        keyframe_task = asyncio.ensure_future(_keyframe_ticker(sender, policy.keyframe_interval))
+
+        @pc.on("connectionstatechange")
+        async def on_policy_state_change():
+            if pc.connectionState in ["failed", "closed"]:
+                keyframe_task.cancel()
+
+
+async def _keyframe_ticker(sender, interval):
+    """Periodically raises the same flag an incoming PLI would, forcing an IDR / keyframe."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            sender._RTCRtpSender__force_keyframe = True
+    except asyncio.CancelledError:
+        pass
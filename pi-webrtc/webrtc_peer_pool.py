@@ -0,0 +1,237 @@
+import asyncio
+import time
+import logging
+
+from aiortc import RTCPeerConnection
+
+logger = logging.getLogger("WebRTC-PeerPool")
+
+# LAN budget for a camera tile: offer received -> first frame handed to the encoder
+TTFF_TARGET_MS = 300
+# Idle pool entries are replaced once they reach this fraction of max_age, before they expire
+RENEW_AT = 0.8
+
+
+class FirstFrameHistogram:
+    """
+    Fixed-bucket histogram of time-to-first-frame, split into the phases of a viewer connection:
+      signaling   offer received -> answer published
+      ice         answer published -> ICE completed
+      dtls        ICE completed -> DTLS / connectionState "connected"
+      first_frame connected -> first frame returned by the track (aiortc encodes it as a keyframe)
+    """
+    PHASES = ("signaling", "ice", "dtls", "first_frame", "total")
+    BUCKETS_MS = (50, 100, 200, 300, 500, 1000, 2000, 5000)
+
+    def __init__(self, report_every=10):
+        self.report_every = report_every
+        self.samples = 0
+        self.counts = {phase: [0] * (len(self.BUCKETS_MS) + 1) for phase in self.PHASES}
+
+    def observe(self, phase, ms):
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if ms <= bound:
+                self.counts[phase][i] += 1
+                return
+        self.counts[phase][-1] += 1
+
+    def record(self, phases):
+        for phase, ms in phases.items():
+            self.observe(phase, ms)
+        self.samples += 1
+        if self.report_every and self.samples % self.report_every == 0:
+            logger.info(f"📊 Time-to-first-frame over {self.samples} connections:\n{self.summary()}")
+
+    def summary(self):
+        labels = [f"≤{b}" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}"]
+        lines = ["phase        " + " ".join(f"{label:>6}" for label in labels)]
+        for phase in self.PHASES:
+            lines.append(f"{phase:<12} " + " ".join(f"{n:>6}" for n in self.counts[phase]))
+        return "\n".join(lines)
+
+
+class FirstFrameTimeline:
+    """Timestamps of a single viewer connection, fed into a FirstFrameHistogram once the first frame leaves."""
+
+    def __init__(self, histogram, label=""):
+        self.histogram = histogram
+        self.label = label
+        self.started = time.monotonic()
+        self.marks = {}
+
+    def mark(self, name):
+        self.marks.setdefault(name, time.monotonic())
+        if name == "first_frame":
+            self._finish()
+
+    def watch(self, pc, track):
+        """Hooks the peer connection state events and the first track.recv() of this connection."""
+        @pc.on("iceconnectionstatechange")
+        async def on_ice_state():
+            if pc.iceConnectionState == "completed":
+                self.mark("ice_connected")
+
+        @pc.on("connectionstatechange")
+        async def on_connection_state():
+            if pc.connectionState == "connected":
+                self.mark("ice_connected")
+                self.mark("connected")
+
+        original_recv = track.recv
+
+        async def timed_recv():
+            frame = await original_recv()
+            # Restore the bound method so the steady state pays nothing
+            track.recv = original_recv
+            self.mark("first_frame")
+            return frame
+
+        track.recv = timed_recv
+
+    def _finish(self):
+        if "answer_sent" not in self.marks:
+            return
+        answer = self.marks["answer_sent"]
+        ice = self.marks.get("ice_connected", answer)
+        connected = self.marks.get("connected", ice)
+        first = self.marks["first_frame"]
+        phases = {
+            "signaling": (answer - self.started) * 1000,
+            "ice": (ice - answer) * 1000,
+            "dtls": (connected - ice) * 1000,
+            "first_frame": (first - connected) * 1000,
+            "total": (first - self.started) * 1000,
+        }
+        self.histogram.record(phases)
+
+        breakdown = " / ".join(f"{k} {v:.0f}" for k, v in phases.items() if k != "total")
+        message = f"⏱️ First frame {self.label}after {phases['total']:.0f} ms ({breakdown} ms)"
+        if phases["total"] > TTFF_TARGET_MS:
+            logger.warning(message + f" - over the {TTFF_TARGET_MS} ms target")
+        else:
+            logger.info(message)
+
+
+class WarmPeer:
+    """A peer connection with its track attached and ICE candidates already gathered."""
+
+    def __init__(self, pc, track, sender):
+        self.pc = pc
+        self.track = track
+        self.sender = sender
+        self.created = time.monotonic()
+        self.renewal = None  # timer that replaces it while it sits in the pool
+
+    async def discard(self):
+        self.track.stop()
+        await self.pc.close()
+
+
+class PeerConnectionPool:
+    """
+    Keeps `size` RTCPeerConnections ready for the next offer.
+
+    Creating the connection (DTLS certificate), building the track and gathering
+    host / STUN candidates all happen ahead of time, so handle_offer only has to
+    apply the remote description. aiortc reuses a transceiver created by addTrack
+    when it matches the offered m-line, so the pre-gathered transport is the one
+    that ends up in the answer. Server-reflexive NAT bindings go stale while
+    idle, so every entry is rebuilt in the background at RENEW_AT of max_age
+    and an idle source still has a fresh one ready; acquire() skips any entry
+    older than max_age in case that rebuild failed.
+    """
+
+    def __init__(self, track_factory, size=1, max_age=60.0, configuration=None, histogram=None):
+        self.track_factory = track_factory
+        self.size = size
+        self.max_age = max_age
+        self.configuration = configuration
+        self.histogram = histogram or FirstFrameHistogram()
+        self._ready = []
+        self._refill_task = None
+        self._renewing = set()  # replacement builds in flight
+        self._closed = False
+
+    async def start(self):
+        await self._refill()
+        logger.info(f"🔥 Peer connection pool warmed ({len(self._ready)}/{self.size} ready)")
+
+    async def acquire(self):
+        """Returns a WarmPeer immediately if one is ready, otherwise builds one on the spot."""
+        warm = None
+        while self._ready:
+            candidate = self._ready.pop(0)
+            candidate.renewal.cancel()
+            if time.monotonic() - candidate.created <= self.max_age:
+                warm = candidate
+                break
+            asyncio.ensure_future(candidate.discard())
+
+        if warm is None:
+            logger.info("🧊 Pool empty, building a cold peer connection")
+            warm = await self._build()
+
+        self._schedule_refill()
+        return warm
+
+    def timeline(self, label=""):
+        return FirstFrameTimeline(self.histogram, label)
+
+    async def close(self):
+        self._closed = True
+        if self._refill_task:
+            self._refill_task.cancel()
+        for task in list(self._renewing):
+            task.cancel()
+        while self._ready:
+            warm = self._ready.pop()
+            warm.renewal.cancel()
+            await warm.discard()
+
+    def _schedule_refill(self):
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self._refill())
+
+    async def _refill(self):
+        try:
+            while len(self._ready) < self.size:
+                self._add(await self._build())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to pre-warm peer connection: {e}")
+
+    def _add(self, warm, position=None):
+        self._ready.insert(len(self._ready) if position is None else position, warm)
+        warm.renewal = asyncio.get_event_loop().call_later(self.max_age * RENEW_AT, self._renew, warm)
+
+    def _renew(self, warm):
+        task = asyncio.ensure_future(self._replace(warm))
+        self._renewing.add(task)
+        task.add_done_callback(self._renewing.discard)
+
+    async def _replace(self, warm):
+        # Build the replacement first: the old entry stays usable until it is ready
+        try:
+            fresh = await self._build()
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.error(f"Failed to renew pre-warmed peer connection: {e}")
+            return
+        if self._closed or warm not in self._ready:
+            # Closed, or taken by acquire() meanwhile, which refills the pool itself
+            await fresh.discard()
+            return
+        position = self._ready.index(warm)
+        del self._ready[position]
+        self._add(fresh, position)
+        await warm.discard()
+
+    async def _build(self):
+        pc = RTCPeerConnection(self.configuration)
+        track = self.track_factory()
+        sender = pc.addTrack(track)
+        # Same call setLocalDescription would make later; it is a no-op once gathering completed
+        await sender.transport.transport.iceGatherer.gather()
+        return WarmPeer(pc, track, sender)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+import time
+import uuid
+import logging
+import statistics
+from aiortc import RTCPeerConnection, RTCConfiguration, RTCSessionDescription
+from webrtc_certificates import install_certificate_cache, uninstall_certificate_cache
+from webrtc_transports import SIGNALING_ENV, create_signaling
+
+# Logging Setup
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s | %(levelname)s | %(message)s')
+logger = logging.getLogger("WebRTC-SetupBenchmark")
+
+# Loopback only: no STUN round trips, so the numbers are CPU / handshake cost
+LOOPBACK_CONFIG = RTCConfiguration(iceServers=[])
+
+
+async def negotiate_once():
+    """Creates an offerer/answerer pair in-process and waits for the data channel to open."""
+    started = time.perf_counter()
+    offerer = RTCPeerConnection(LOOPBACK_CONFIG)
+    answerer = RTCPeerConnection(LOOPBACK_CONFIG)
+    constructed = time.perf_counter()
+
+    opened = asyncio.Event()
+    channel = offerer.createDataChannel("bench")
+
+    @channel.on("open")
+    def on_open():
+        opened.set()
+
+    await offerer.setLocalDescription(await offerer.createOffer())
+    await answerer.setRemoteDescription(offerer.localDescription)
+    await answerer.setLocalDescription(await answerer.createAnswer())
+    await offerer.setRemoteDescription(answerer.localDescription)
+    await asyncio.wait_for(opened.wait(), timeout=10)
+    connected = time.perf_counter()
+
+    await offerer.close()
+    await answerer.close()
+    return (constructed - started) * 1000, (connected - started) * 1000
+
+
+async def negotiate_via_signaling(transport):
+    """Same loopback, but offer and answer travel through a signaling backend (in-process by default)."""
+    run_id = uuid.uuid4().hex[:6]
+    offer_side = create_signaling(f"bench_off_{run_id}", transport=transport, on_message=lambda p: on_offerer_message(p))
+    answer_side = create_signaling(f"bench_ans_{run_id}", transport=transport, on_message=lambda p: on_answerer_message(p))
+    await offer_side.start()
+    await answer_side.start()
+    # Connecting to the backend is not part of the measured setup
+    while not (offer_side.connected and answer_side.connected):
+        await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    offerer = RTCPeerConnection(LOOPBACK_CONFIG)
+    answerer = RTCPeerConnection(LOOPBACK_CONFIG)
+    constructed = time.perf_counter()
+
+    opened = asyncio.Event()
+    channel = offerer.createDataChannel("bench")
+
+    @channel.on("open")
+    def on_open():
+        opened.set()
+
+    async def on_answerer_message(payload):
+        if payload.get("type") == "offer":
+            await answerer.setRemoteDescription(RTCSessionDescription(**payload["data"]))
+            await answerer.setLocalDescription(await answerer.createAnswer())
+            answer_side.send("answer", payload["from"], {
+                "sdp": answerer.localDescription.sdp,
+                "type": answerer.localDescription.type
+            })
+
+    async def on_offerer_message(payload):
+        if payload.get("type") == "answer":
+            await offerer.setRemoteDescription(RTCSessionDescription(**payload["data"]))
+
+    await offerer.setLocalDescription(await offerer.createOffer())
+    offer_side.send("offer", answer_side.peer_id, {
+        "sdp": offerer.localDescription.sdp,
+        "type": offerer.localDescription.type
+    })
+    await asyncio.wait_for(opened.wait(), timeout=10)
+    connected = time.perf_counter()
+
+    offer_side.close()
+    answer_side.close()
+    await offerer.close()
+    await answerer.close()
+    return (constructed - started) * 1000, (connected - started) * 1000
+
+
+async def run_series(label, runs, negotiate=negotiate_once):
+    constructs, setups = [], []
+    for _ in range(runs):
+        construct_ms, setup_ms = await negotiate()
+        constructs.append(construct_ms)
+        setups.append(setup_ms)
+
+    def describe(values):
+        values = sorted(values)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        return f"mean {statistics.mean(values):7.1f}  median {statistics.median(values):7.1f}  p95 {p95:7.1f}"
+
+    print(f"{label:<18} construct (2 pcs) | {describe(constructs)} ms")
+    print(f"{'':<18} connected         | {describe(setups)} ms")
+
+
+async def main(runs):
+    print("-" * 80)
+    print(f"⏱️ DTLS SETUP BENCHMARK ({runs} loopback connections per series)")
+    print("-" * 80)
+
+    uninstall_certificate_cache()
+    await run_series("without cache", runs)
+
+    cache = install_certificate_cache()
+    await run_series("with cache", runs)
+
+    # Set WEBRTC_SIGNALING (e.g. ws://hub:8765/ws) to compare a real backend against in-process
+    transport = os.environ.get(SIGNALING_ENV, "inprocess")
+    await run_series(f"via {transport}"[:18], runs, lambda: negotiate_via_signaling(transport))
+    print(f"certificates generated with cache: {cache.generated}")
+    uninstall_certificate_cache()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
+    except KeyboardInterrupt:
+        print("\nBenchmark interrupted.")
@@ -0,0 +1,58 @@
+import logging
+
+from aiortc.contrib.media import MediaRelay
+
+logger = logging.getLogger("WebRTC-SharedSource")
+
+
+class SharedTrackSource:
+    """
+    One capture track fanned out to any number of peer connections.
+
+    The track is only built when the first consumer acquires it and is stopped
+    again when the last one releases it, so a camera is opened exactly once no
+    matter how many viewers are attached. Every consumer gets its own
+    MediaRelay proxy (unbuffered: a slow viewer drops frames instead of lagging).
+    """
+
+    def __init__(self, track_factory, name="video"):
+        self.track_factory = track_factory
+        self.name = name
+        self.track = None
+        self.consumers = 0
+        self._relay = None
+
+    def acquire(self):
+        if self.track is None:
+            self.track = self.track_factory()
+            self._relay = MediaRelay()
+            logger.info(f"🎬 Capture source '{self.name}' started")
+        self.consumers += 1
+        return self._relay.subscribe(self.track, buffered=False)
+
+    def release(self, proxy):
+        proxy.stop()
+        self.consumers = max(0, self.consumers - 1)
+        if self.consumers == 0 and self.track is not None:
+            self.track.stop()
+            self.track = None
+            self._relay = None
+            logger.info(f"🛑 Capture source '{self.name}' stopped (no consumers left)")
+
+
+class IngestedTrackSource:
+    """A track received over WHIP, exposed with the same acquire/release interface as SharedTrackSource."""
+
+    def __init__(self, track, name):
+        self.track = track
+        self.name = name
+        self.consumers = 0
+        self._relay = MediaRelay()
+
+    def acquire(self):
+        self.consumers += 1
+        return self._relay.subscribe(self.track, buffered=False)
+
+    def release(self, proxy):
+        proxy.stop()
+        self.consumers = max(0, self.consumers - 1)
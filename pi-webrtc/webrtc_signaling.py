@@ -0,0 +1,539 @@
+"""
+Shared MQTT signaling conventions for the pi-webrtc sources, GUIs and viewers.
+
+Topic layout (for a base topic such as "webrtc/signaling"):
+    <base>/<peer_id>            -> personal inbox, carries offer / answer / ice addressed to peer_id
+    <base>/presence/<peer_id>   -> retained presence record, cleared by the peer's MQTT Last Will
+    <base>                      -> legacy broadcast topic, kept alive by webrtc_signaling_bridge.py
+
+Payloads are compact JSON by default. With compact=True (and msgpack installed) they are
+msgpack maps whose SDP is zlib-compressed bytes; decode_signal() accepts both formats.
+ICE "data" may be a single candidate dict or a list of them (batched trickle).
+
+SignalingTransport is the backend-independent client interface; MqttSignaling is its
+MQTT implementation and webrtc_transports.py adds the other backends.
+"""
+import abc
+import asyncio
+import heapq
+import json
+import os
+import time
+import zlib
+import logging
+import paho.mqtt.client as mqtt
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger("WebRTC-Signaling")
+
+# HiveMQ Cloud broker shared by every node
+BROKER_HOST = "e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud"
+BROKER_PORT = 8883
+BROKER_USERNAME = "admin"
+BROKER_PASSWORD = "admin1234S"
+
+# WEBRTC_BROKER=<host>:<port> points every node at a plain-TCP broker on the LAN instead,
+# e.g. the MQTT listener of webrtc_signaling_hub.py
+LOCAL_BROKER_ENV = "WEBRTC_BROKER"
+
+SIGNALING_TOPIC = "webrtc/signaling"
+PRESENCE_SUFFIX = "presence"
+
+# Presence is retained, so refreshes only guard against a broker losing its retained store
+PRESENCE_KEEPALIVE = 60  # seconds
+PRESENCE_TIMEOUT = PRESENCE_KEEPALIVE * 3
+# How long aclose() waits for the goodbye (presence clear, DISCONNECT) to leave the socket
+CLOSE_TIMEOUT = 2.0
+
+
+def broker_settings():
+    """Returns (host, port, use_tls) for the broker this process should use."""
+    local = os.environ.get(LOCAL_BROKER_ENV)
+    if local:
+        host, _, port = local.partition(":")
+        return host, int(port or 1883), False
+    return BROKER_HOST, BROKER_PORT, True
+
+
+def inbox_topic(base_topic, peer_id):
+    """Topic on which `peer_id` receives addressed signaling messages."""
+    return f"{base_topic}/{peer_id}"
+
+
+def presence_topic(base_topic, peer_id):
+    """Retained presence topic owned by `peer_id`."""
+    return f"{base_topic}/{PRESENCE_SUFFIX}/{peer_id}"
+
+
+def presence_filter(base_topic):
+    """Subscription filter matching every peer's presence topic in a namespace."""
+    return f"{base_topic}/{PRESENCE_SUFFIX}/+"
+
+
+def peer_from_presence_topic(topic):
+    return topic.rsplit("/", 1)[-1]
+
+
+def encode_signal(payload, compact=False):
+    """Serializes a signaling message; compact mode needs msgpack and falls back to JSON without it."""
+    if compact and msgpack is not None:
+        data = payload.get("data")
+        if isinstance(data, dict) and isinstance(data.get("sdp"), str):
+            payload = dict(payload, data=dict(data, sdp=zlib.compress(data["sdp"].encode(), 9)))
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def decode_signal(raw):
+    """Parses either wire format: JSON text always starts with '{', msgpack maps never do."""
+    if raw[:1] == b"{":
+        return json.loads(raw)
+    if msgpack is None:
+        raise ValueError("Received a compact (msgpack) signaling payload but msgpack is not installed")
+    payload = msgpack.unpackb(raw, raw=False)
+    data = payload.get("data")
+    if isinstance(data, dict) and isinstance(data.get("sdp"), bytes):
+        data["sdp"] = zlib.decompress(data["sdp"]).decode()
+    return payload
+
+
+def parse_ice_candidates(data):
+    """
+    Converts browser-style {"candidate", "sdpMid", "sdpMLineIndex"} dicts (single or
+    batched list) into aiortc RTCIceCandidate objects, skipping end-of-candidates markers.
+    """
+    from aiortc.sdp import candidate_from_sdp
+
+    candidates = []
+    for item in (data if isinstance(data, list) else [data]):
+        line = (item or {}).get("candidate")
+        if not line:
+            continue
+        candidate = candidate_from_sdp(line.split(":", 1)[1] if line.startswith("candidate:") else line)
+        candidate.sdpMid = item.get("sdpMid")
+        candidate.sdpMLineIndex = item.get("sdpMLineIndex")
+        candidates.append(candidate)
+    return candidates
+
+
+def configure_presence(mqtt_client, base_topic, peer_id):
+    """
+    Registers a Last Will that publishes an empty retained payload on our presence
+    topic. The broker fires it when the connection drops, which deletes the retained
+    record and tells every subscriber we are gone. Must be called before connect().
+    """
+    mqtt_client.will_set(presence_topic(base_topic, peer_id), payload=None, qos=1, retain=True)
+
+
+def announce_presence(mqtt_client, base_topic, peer_id):
+    """Publishes (or refreshes) our retained presence record."""
+    msg = {"type": "presence", "from": peer_id}
+    mqtt_client.publish(presence_topic(base_topic, peer_id), json.dumps(msg), qos=1, retain=True)
+
+
+def clear_presence(mqtt_client, base_topic, peer_id):
+    """Removes our retained presence record on a graceful shutdown (the Last Will is skipped then)."""
+    mqtt_client.publish(presence_topic(base_topic, peer_id), payload=None, qos=1, retain=True)
+
+
+class PresenceTable:
+    """
+    Peers seen on a presence topic, in first-seen order, each expiring `timeout`
+    seconds after its latest announcement.
+
+    Deadlines sit in a min-heap with lazy deletion: a refresh pushes a new entry and
+    leaves the old one behind, and expire() pops only entries that are due, dropping
+    the stale ones. Each tick costs O(expired) instead of a scan over every peer.
+    """
+
+    def __init__(self, timeout=PRESENCE_TIMEOUT, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.deadlines = {}  # peer_id -> deadline, in first-seen order
+        self._heap = []      # (deadline, peer_id), possibly stale
+
+    def __contains__(self, peer_id):
+        return peer_id in self.deadlines
+
+    def __iter__(self):
+        return iter(self.deadlines)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def touch(self, peer_id):
+        """Records an announcement; True if the peer is new."""
+        new = peer_id not in self.deadlines
+        deadline = self.clock() + self.timeout
+        self.deadlines[peer_id] = deadline
+        heapq.heappush(self._heap, (deadline, peer_id))
+        if len(self._heap) > 4 * len(self.deadlines) + 64:
+            # Peers refreshing far more often than they expire: drop the stale entries
+            self._heap = [(deadline, pid) for pid, deadline in self.deadlines.items()]
+            heapq.heapify(self._heap)
+        return new
+
+    def discard(self, peer_id):
+        """Forgets a peer (it left cleanly); True if it was known. Its heap entries go stale."""
+        return self.deadlines.pop(peer_id, None) is not None
+
+    def expire(self):
+        """Removes and returns the peers whose deadline has passed."""
+        now = self.clock()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, peer_id = heapq.heappop(self._heap)
+            if self.deadlines.get(peer_id) == deadline:
+                del self.deadlines[peer_id]
+                expired.append(peer_id)
+        return expired
+
+
+class SignalingTransport(abc.ABC):
+    """
+    Backend-independent half of every signaling client (see webrtc_transports.py for
+    the WebSocket, Socket.IO and in-process backends). Callers only ever use:
+
+        await start() / close()
+        await aclose()               close() that waits until the goodbye is sent (before exiting)
+        send(msg_type, to, data)     addressed offer / answer
+        send_ice(to, candidate)      trickled ICE, coalesced per destination for ice_batch_window seconds
+
+    Callbacks (plain functions or coroutine functions, always run on the loop):
+        on_message(payload_dict)      offer / answer / ice addressed to this peer
+        on_presence(peer_id, online)  peers appearing / leaving, where the backend reports them
+        on_connect()                  after every successful (re)connect
+
+    Outbound messages wait in a bounded queue while the link is down and the oldest
+    one is dropped when it is full. on_message handlers run one after another, in
+    arrival order. Subclasses connect, call _link_up()/_link_down(),
+    feed decoded payloads to _receive() and implement _transmit(item).
+    """
+    name = "base"
+
+    def __init__(self, peer_id, base_topic=SIGNALING_TOPIC, on_message=None, on_presence=None,
+                 on_connect=None, subscribe_presence=False, outbound_limit=256, compact=False,
+                 ice_batch_window=0.05):
+        self.peer_id = peer_id
+        self.base_topic = base_topic
+        self.on_message = on_message
+        self.on_presence = on_presence
+        self.on_connect = on_connect
+        self.subscribe_presence = subscribe_presence
+        self.outbound_limit = outbound_limit
+        self.compact = compact
+        self.ice_batch_window = ice_batch_window
+        self.dropped = 0
+
+        self._ice_pending = {}
+        self._loop = None
+        self._outbound = None
+        self._inbound = None
+        self._connected = None
+        self._tasks = []
+
+    # --- Lifecycle ---
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._outbound = asyncio.Queue()
+        self._inbound = asyncio.Queue()
+        self._connected = asyncio.Event()
+        self._tasks = [
+            asyncio.ensure_future(self._sender_loop()),
+            asyncio.ensure_future(self._receiver_loop()),
+            asyncio.ensure_future(self._presence_keepalive()),
+        ]
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def aclose(self, timeout=CLOSE_TIMEOUT):
+        """close() for a process about to exit; backends with a goodbye to flush wait for it up to `timeout`."""
+        self.close()
+
+    async def _presence_keepalive(self):
+        # Slow refresh so peers that age out presence (the GUIs) keep seeing us
+        while True:
+            await asyncio.sleep(PRESENCE_KEEPALIVE)
+            if self.connected:
+                self._announce_presence()
+
+    def _announce_presence(self):
+        """Unaddressed presence; backends deliver messages without "to" to everyone in the namespace."""
+        self._enqueue({"type": "presence", "from": self.peer_id})
+
+    @property
+    def connected(self):
+        return self._connected is not None and self._connected.is_set()
+
+    def _link_up(self):
+        self._connected.set()
+        if self.on_connect:
+            self._dispatch(self.on_connect)
+
+    def _link_down(self):
+        self._connected.clear()
+
+    # --- Outbound ---
+
+    def send(self, msg_type, to, data):
+        payload = {"type": msg_type, "from": self.peer_id, "to": to, "data": data}
+        self._send_payload(to, payload)
+
+    def send_ice(self, to, candidate):
+        if not self.ice_batch_window:
+            self.send("ice", to, candidate)
+            return
+        pending = self._ice_pending.get(to)
+        if pending is None:
+            pending = self._ice_pending[to] = []
+            self._loop.call_later(self.ice_batch_window, self._flush_ice, to)
+        pending.append(candidate)
+
+    def _flush_ice(self, to):
+        candidates = self._ice_pending.pop(to, None)
+        if candidates:
+            self.send("ice", to, candidates)
+
+    def _send_payload(self, to, payload):
+        self._enqueue(payload)
+
+    def _enqueue(self, item):
+        if self._outbound.qsize() >= self.outbound_limit:
+            # Stale signaling is worthless; make room for the newest message
+            self._outbound.get_nowait()
+            self.dropped += 1
+            logger.warning(f"Outbound signaling queue full, dropped oldest message ({self.dropped} total)")
+        self._outbound.put_nowait(item)
+
+    async def _sender_loop(self):
+        while True:
+            item = await self._outbound.get()
+            await self._connected.wait()
+            try:
+                await self._transmit(item)
+            except Exception as e:
+                logger.error(f"{self.name} signaling send failed: {e}")
+
+    @abc.abstractmethod
+    async def _transmit(self, item):
+        """Sends one outbound item over the backend's link (only called while connected)."""
+
+    # --- Inbound ---
+
+    def _receive(self, payload):
+        """Routes one decoded message: presence / leave to on_presence, the rest to on_message."""
+        sender = payload.get("from")
+        if sender is not None and sender == self.peer_id:
+            return
+        msg_type = payload.get("type")
+        if msg_type in ("presence", "leave"):
+            if sender and self.on_presence:
+                self._dispatch(self.on_presence, sender, msg_type == "presence")
+            return
+        to = payload.get("to")
+        if to and to != self.peer_id:
+            return
+        if self.on_message:
+            self._inbound.put_nowait(payload)
+
+    async def _receiver_loop(self):
+        # One message at a time, so trickled ICE never overtakes the offer it belongs to
+        while True:
+            payload = await self._inbound.get()
+            try:
+                result = self.on_message(payload)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Signaling Error: {e}")
+
+    def _dispatch(self, callback, *args):
+        result = callback(*args)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+
+class MqttSignaling(SignalingTransport):
+    """
+    MQTT signaling transport driven entirely by the caller's asyncio event loop.
+
+    paho-mqtt is used without loop_forever()/loop_start(): its socket is registered
+    with add_reader/add_writer, so incoming messages are dispatched straight into
+    aiortc's loop with no helper threads and no run_coroutine_threadsafe hop.
+    Reconnects with exponential backoff, resubscribes and re-announces presence
+    after every CONNACK. Presence comes from retained topics and is only
+    subscribed to with subscribe_presence=True.
+    """
+    name = "MQTT"
+
+    def __init__(self, peer_id, base_topic=SIGNALING_TOPIC, client_id=None, **kwargs):
+        super().__init__(peer_id, base_topic, **kwargs)
+
+        self.subscriptions = [inbox_topic(base_topic, peer_id)]
+        if self.subscribe_presence:
+            self.subscriptions.append(presence_filter(base_topic))
+
+        self._client = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id=client_id or peer_id,
+            protocol=mqtt.MQTTv5
+        )
+        self.broker_host, self.broker_port, use_tls = broker_settings()
+        if use_tls:
+            self._client.tls_set()
+        self._client.username_pw_set(BROKER_USERNAME, BROKER_PASSWORD)
+        configure_presence(self._client, base_topic, peer_id)
+
+        self._client.on_connect = self._handle_connect
+        self._client.on_disconnect = self._handle_disconnect
+        self._client.on_message = self._handle_message
+        self._client.on_socket_open = self._on_socket_open
+        self._client.on_socket_close = self._on_socket_close
+        self._client.on_socket_register_write = self._on_socket_register_write
+        self._client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        self._disconnected = None
+        self._goodbye = None
+
+    # --- Lifecycle ---
+
+    async def start(self):
+        await super().start()
+        self._tasks += [
+            asyncio.ensure_future(self._connection_manager()),
+            asyncio.ensure_future(self._misc_loop()),
+        ]
+
+    def close(self):
+        """Graceful shutdown: clear our retained presence (the Last Will is skipped) and disconnect."""
+        super().close()
+        if self._client.is_connected():
+            clear_presence(self._client, self.base_topic, self.peer_id)
+            self._client.disconnect()
+
+    async def aclose(self, timeout=CLOSE_TIMEOUT):
+        """
+        close() only queues the presence clear and the DISCONNECT; paho writes them
+        from the loop's add_writer callback. Waits for on_disconnect, which paho
+        raises once the DISCONNECT (queued after the clear) has been written.
+        """
+        super().close()  # no reconnect once the DISCONNECT lands
+        if self._client.is_connected():
+            self._goodbye = self._loop.create_future()
+            clear_presence(self._client, self.base_topic, self.peer_id)
+            self._client.disconnect()
+            try:
+                await asyncio.wait_for(self._goodbye, timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ MQTT goodbye not flushed within {timeout}s; the Last Will clears presence")
+
+    async def _connection_manager(self):
+        backoff = 1
+        while True:
+            self._disconnected = self._loop.create_future()
+            try:
+                logger.info(f"Connecting to MQTT broker {self.broker_host}:{self.broker_port}...")
+                # connect() resolves DNS and runs the TLS handshake synchronously; keep it off the loop
+                await self._loop.run_in_executor(None, self._client.connect, self.broker_host, self.broker_port, 60)
+                backoff = 1
+                await self._disconnected
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"MQTT Connect Failed: {e}")
+
+            self._link_down()
+            logger.warning(f"MQTT link down, reconnecting in {backoff}s...")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def _misc_loop(self):
+        # Drives paho's keepalive PINGREQ / retry timers
+        while True:
+            await asyncio.sleep(1)
+            self._client.loop_misc()
+
+    def _announce_presence(self):
+        # Presence is retained and cleared by our Last Will; this is only a slow refresh
+        announce_presence(self._client, self.base_topic, self.peer_id)
+
+    # --- Outbound ---
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self._enqueue((topic, payload, qos, retain))
+
+    def _send_payload(self, to, payload):
+        self.publish(inbox_topic(self.base_topic, to), encode_signal(payload, self.compact))
+
+    async def _transmit(self, item):
+        topic, payload, qos, retain = item
+        self._client.publish(topic, payload, qos=qos, retain=retain)
+
+    # --- paho callbacks (all invoked on the event loop thread) ---
+
+    def _handle_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error(f"MQTT broker refused connection: {reason_code}")
+            return
+        for topic in self.subscriptions:
+            client.subscribe(topic)
+        # Retained record: peers that subscribe later discover us instantly
+        announce_presence(client, self.base_topic, self.peer_id)
+        self._link_up()
+
+    def _handle_disconnect(self, client, userdata, flags, reason_code, properties):
+        self._link_down()
+        for waiter in (self._disconnected, self._goodbye):
+            if waiter and not waiter.done():
+                waiter.set_result(reason_code)
+
+    def _handle_message(self, client, userdata, msg):
+        try:
+            if msg.topic.startswith(f"{self.base_topic}/{PRESENCE_SUFFIX}/"):
+                pid = peer_from_presence_topic(msg.topic)
+                if pid != self.peer_id and self.on_presence:
+                    # Empty retained payload: the peer's Last Will (or clean exit) cleared its presence
+                    self._dispatch(self.on_presence, pid, bool(msg.payload))
+                return
+            self._receive(decode_signal(msg.payload))
+        except Exception as e:
+            logger.error(f"Signaling Error: {e}")
+
+    # --- Socket registration (may be called from the connect executor thread) ---
+
+    def _in_loop(self, fn, *args):
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._in_loop(self._loop.add_reader, sock, self._on_readable)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._in_loop(self._loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self._loop.remove_writer, sock)
+
+    def _on_readable(self):
+        self._client.loop_read()
+        # TLS can hold decrypted records the selector never sees; drain them now
+        sock = self._client.socket()
+        while sock is not None and hasattr(sock, "pending") and sock.pending():
+            self._client.loop_read()
+            sock = self._client.socket()
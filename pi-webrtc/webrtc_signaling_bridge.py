@@ -0,0 +1,119 @@
+import json
+import sys
+import time
+import uuid
+import threading
+import logging
+import paho.mqtt.client as mqtt
+from webrtc_signaling import (
+    BROKER_USERNAME, BROKER_PASSWORD, SIGNALING_TOPIC, broker_settings,
+    inbox_topic, presence_topic, presence_filter, peer_from_presence_topic, decode_signal,
+)
+
+# Logging Setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+logger = logging.getLogger("WebRTC-Bridge")
+
+
+class LegacyTopicBridge:
+    """
+    Keeps nodes still publishing on the old single broadcast topic working
+    while the fleet migrates to per-peer inbox topics.
+
+      legacy <base>          --(to)-->  <base>/<to>   or   <base>/presence/<from>
+      <base>/<peer>          -------->  legacy <base>
+      <base>/presence/<peer> -------->  2 s legacy heartbeats while the retained record exists
+
+    Every republished message is tagged with "bridged": true so the bridge
+    never picks up its own output again. Compact (msgpack) payloads are
+    re-encoded as JSON, since legacy nodes only understand JSON.
+    """
+    LEGACY_HEARTBEAT = 2  # seconds, matches the expiry window of legacy viewers
+
+    def __init__(self, base_topics):
+        self.base_topics = list(base_topics)
+        self.mqtt_client = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f"bridge_{uuid.uuid4().hex[:6]}",
+            protocol=mqtt.MQTTv5
+        )
+        self.broker_host, self.broker_port, use_tls = broker_settings()
+        if use_tls:
+            self.mqtt_client.tls_set()
+        self.mqtt_client.username_pw_set(BROKER_USERNAME, BROKER_PASSWORD)
+        self.forwarded = 0
+        # base topic -> peers with a live retained presence record
+        self.online_peers = {base: set() for base in self.base_topics}
+        self.lock = threading.Lock()
+
+    def on_connect(self, client, userdata, flags, rc, properties):
+        for base in self.base_topics:
+            client.subscribe(base)
+            client.subscribe(f"{base}/+")
+            client.subscribe(presence_filter(base))
+        logger.info(f"🌉 Bridging legacy topics: {', '.join(self.base_topics)}")
+
+    def on_message(self, client, userdata, msg):
+        base = next((b for b in self.base_topics if msg.topic.startswith(f"{b}/presence/")), None)
+        if base and not msg.payload:
+            # Retained presence cleared by a Last Will: stop the legacy heartbeats for that peer
+            with self.lock:
+                self.online_peers[base].discard(peer_from_presence_topic(msg.topic))
+            return
+
+        try:
+            payload = decode_signal(msg.payload)
+        except Exception as e:
+            logger.debug(f"Dropping undecodable payload on {msg.topic}: {e}")
+            return
+        if payload.get("bridged"):
+            return
+        payload["bridged"] = True
+
+        if base:
+            with self.lock:
+                self.online_peers[base].add(peer_from_presence_topic(msg.topic))
+            return
+
+        if msg.topic in self.base_topics:
+            # Legacy broadcast -> addressed inbox or presence topic
+            base = msg.topic
+            if payload.get("type") == "presence":
+                target = presence_topic(base, payload.get("from"))
+            elif payload.get("to"):
+                target = inbox_topic(base, payload["to"])
+            else:
+                return
+        else:
+            # New-style inbox -> legacy broadcast
+            target = msg.topic.rsplit("/", 1)[0]
+
+        client.publish(target, json.dumps(payload))
+        self.forwarded += 1
+
+    def legacy_heartbeat_loop(self):
+        """Legacy viewers expect a presence broadcast every 2 s; synthesize it for retained peers."""
+        while True:
+            time.sleep(self.LEGACY_HEARTBEAT)
+            with self.lock:
+                snapshot = [(base, sorted(peers)) for base, peers in self.online_peers.items()]
+            for base, peers in snapshot:
+                for pid in peers:
+                    msg = {"type": "presence", "from": pid, "bridged": True}
+                    self.mqtt_client.publish(base, json.dumps(msg))
+
+    def run(self):
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_message = self.on_message
+        logger.info(f"Connecting to MQTT broker {self.broker_host}:{self.broker_port}...")
+        self.mqtt_client.connect(self.broker_host, self.broker_port, 60)
+        threading.Thread(target=self.legacy_heartbeat_loop, daemon=True).start()
+        self.mqtt_client.loop_forever()
+
+
+if __name__ == "__main__":
+    topics = sys.argv[1:] or [SIGNALING_TOPIC, "webrtc/file_signaling"]
+    try:
+        LegacyTopicBridge(topics).run()
+    except KeyboardInterrupt:
+        print("\nShutting down bridge...")
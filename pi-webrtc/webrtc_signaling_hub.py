@@ -0,0 +1,582 @@
+"""
+Self-hosted signaling hub: a LAN / offline stand-in for the HiveMQ cloud broker.
+
+WebSocket (JSON)   ws://<host>:8765/ws?room=<room>&peer=<peer_id>
+    Speaks the existing message format ({"type", "from", "to", "data"}). A message
+    with "to" is delivered to that peer only, through a dict lookup in its room;
+    messages without "to" (presence, legacy broadcasts) go to the rest of the room.
+    Frames are forwarded verbatim, so each message is parsed once and never re-encoded.
+    {"type": "join", "room": ...} moves a connection to another room, and the hub
+    announces {"type": "leave", "from": ...} when a peer's socket closes.
+    A connection's peer id is bound once (by ?peer=, its join or its first
+    message); later messages claiming another "from" are dropped.
+
+MQTT subset        mqtt://<host>:1883  and  ws://<host>:8765/mqtt (subprotocol "mqtt")
+    MQTT 3.1.1 / 5 CONNECT, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, PING and DISCONNECT with
+    retained messages, Last Will and +/# wildcards. Everything is delivered at QoS 0
+    and no sessions persist, which is all the per-peer inbox / retained presence
+    layout of webrtc_signaling.py needs. Exact-topic subscriptions (the inboxes) are a
+    dict lookup; only wildcard filters are matched one by one.
+
+Run:  python webrtc_signaling_hub.py [--port 8765] [--mqtt-port 1883]
+Then point the Python nodes at it with WEBRTC_BROKER=<hub-ip>:1883.
+"""
+import argparse
+import asyncio
+import json
+import time
+import logging
+from collections import defaultdict, deque
+from aiohttp import web
+
+# Logging Setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+logger = logging.getLogger("WebRTC-Hub")
+
+DEFAULT_ROOM = "default"
+OUTBOUND_LIMIT = 256  # queued frames per connection before the oldest is dropped
+SLOW_CONSUMER_BYTES = 1 << 20  # MQTT/TCP clients with more unsent data than this are disconnected
+
+# MQTT control packet types
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+# --- WebSocket JSON hub ---
+
+class HubPeer:
+    """One WebSocket connection; outbound frames go through a bounded queue drained by its own task."""
+
+    def __init__(self, ws, room, peer_id=None):
+        self.ws = ws
+        self.room = room
+        self.peer_id = peer_id
+        self.dropped = 0
+        self._outbound = deque()
+        self._wakeup = asyncio.Event()
+
+    def send(self, text):
+        if len(self._outbound) >= OUTBOUND_LIMIT:
+            self._outbound.popleft()
+            self.dropped += 1
+        self._outbound.append(text)
+        self._wakeup.set()
+
+    async def write_loop(self):
+        while not self.ws.closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._outbound and not self.ws.closed:
+                await self.ws.send_str(self._outbound.popleft())
+
+
+class SignalingHub:
+    """Room-scoped, addressed delivery of JSON signaling messages over WebSocket."""
+
+    def __init__(self):
+        self.rooms = defaultdict(dict)  # room -> {peer_id: HubPeer}
+        self.connections = 0
+        self.delivered = 0
+        self.broadcasts = 0
+        self.undeliverable = 0
+        self.spoofed = 0
+
+    async def handle_websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        peer = HubPeer(ws, request.query.get("room", DEFAULT_ROOM))
+        writer = asyncio.ensure_future(peer.write_loop())
+        self.connections += 1
+        if request.query.get("peer"):
+            self.register(peer, request.query["peer"])
+
+        try:
+            async for msg in ws:
+                if msg.type == web.WSMsgType.TEXT:
+                    self.route(peer, msg.data)
+        finally:
+            self.unregister(peer)
+            self.connections -= 1
+            writer.cancel()
+        return ws
+
+    def route(self, peer, text):
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(payload, dict):
+            return
+
+        if payload.get("type") == "join":
+            self.unregister(peer)
+            peer.room = str(payload.get("room") or DEFAULT_ROOM)
+            # join only moves a bound id between rooms; it never renames the connection
+            peer_id = peer.peer_id or payload.get("from")
+            if peer_id:
+                self.register(peer, str(peer_id))
+            return
+
+        sender = payload.get("from")
+        if sender and sender != peer.peer_id:
+            if peer.peer_id or not isinstance(sender, str):
+                # Rebinding would evict whoever owns that id and take over their inbox
+                self.spoofed += 1
+                peer.send(json.dumps({"type": "error", "reason": "wrong-sender", "from": peer.peer_id}))
+                return
+            self.register(peer, sender)
+
+        room = self.rooms.get(peer.room, {})
+        to = payload.get("to")
+        if to:
+            target = room.get(to)
+            if target is None:
+                self.undeliverable += 1
+                peer.send(json.dumps({"type": "error", "reason": "unknown-peer", "to": to}))
+                return
+            target.send(text)
+            self.delivered += 1
+        else:
+            for other in room.values():
+                if other is not peer:
+                    other.send(text)
+            self.broadcasts += 1
+
+    def register(self, peer, peer_id):
+        if peer.peer_id:
+            self.unregister(peer)
+        room = self.rooms[peer.room]
+        previous = room.get(peer_id)
+        if previous is not None and previous is not peer:
+            # Same peer id reconnected: the newest socket wins
+            asyncio.ensure_future(previous.ws.close())
+        peer.peer_id = peer_id
+
+        # Introduce the room to the newcomer and the newcomer to the room
+        for other_id, other in room.items():
+            if other_id != peer_id:
+                peer.send(json.dumps({"type": "presence", "from": other_id}))
+                other.send(json.dumps({"type": "presence", "from": peer_id}))
+        room[peer_id] = peer
+        logger.info(f"➕ {peer_id} joined room '{peer.room}' ({len(room)} peers)")
+
+    def unregister(self, peer):
+        room = self.rooms.get(peer.room)
+        if not peer.peer_id or room is None or room.get(peer.peer_id) is not peer:
+            return
+        del room[peer.peer_id]
+        notice = json.dumps({"type": "leave", "from": peer.peer_id})
+        for other in room.values():
+            other.send(notice)
+        if not room:
+            del self.rooms[peer.room]
+        logger.info(f"➖ {peer.peer_id} left room '{peer.room}'")
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "rooms": {name: len(peers) for name, peers in self.rooms.items()},
+            "delivered": self.delivered,
+            "broadcasts": self.broadcasts,
+            "undeliverable": self.undeliverable,
+            "spoofed": self.spoofed,
+        }
+
+
+# --- Minimal MQTT broker ---
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def _read_varint(buf, pos):
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _read_bytes(buf, pos):
+    length = int.from_bytes(buf[pos:pos + 2], "big")
+    return bytes(buf[pos + 2:pos + 2 + length]), pos + 2 + length
+
+
+def _read_str(buf, pos):
+    raw, pos = _read_bytes(buf, pos)
+    return raw.decode("utf-8"), pos
+
+
+def _encode_str(value):
+    raw = value.encode("utf-8")
+    return len(raw).to_bytes(2, "big") + raw
+
+
+def _packet(first_byte, body=b""):
+    return bytes([first_byte]) + _encode_varint(len(body)) + body
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class MqttPacketReader:
+    """Incremental MQTT framer: feed raw bytes (TCP reads or WebSocket frames), get whole packets back."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        packets = []
+        while len(self._buffer) >= 2:
+            length, pos = 0, 1
+            for shift in (0, 7, 14, 21):
+                if pos >= len(self._buffer):
+                    return packets
+                byte = self._buffer[pos]
+                pos += 1
+                length |= (byte & 0x7F) << shift
+                if not byte & 0x80:
+                    break
+            if len(self._buffer) < pos + length:
+                return packets
+            first = self._buffer[0]
+            packets.append((first >> 4, first & 0x0F, bytes(self._buffer[pos:pos + length])))
+            del self._buffer[:pos + length]
+        return packets
+
+
+class MqttSession:
+    """State of one MQTT client connection, independent of whether it arrived over TCP or WebSocket."""
+
+    def __init__(self, broker, write, close, remote):
+        self.broker = broker
+        self.write = write
+        self.close = close
+        self.remote = remote
+        self.client_id = None
+        self.level = 4
+        self.keepalive = 60
+        self.will = None
+        self.filters = set()
+        self.last_seen = time.monotonic()
+        self.reader = MqttPacketReader()
+
+    def feed(self, data):
+        self.last_seen = time.monotonic()
+        for packet_type, flags, body in self.reader.feed(data):
+            if self.client_id is None and packet_type != CONNECT:
+                raise ValueError("First packet was not CONNECT")
+            self.handle(packet_type, flags, body)
+
+    def handle(self, packet_type, flags, body):
+        if packet_type == CONNECT:
+            self._on_connect(body)
+        elif packet_type == PUBLISH:
+            self._on_publish(flags, body)
+        elif packet_type == SUBSCRIBE:
+            self._on_subscribe(body)
+        elif packet_type == UNSUBSCRIBE:
+            self._on_unsubscribe(body)
+        elif packet_type == PINGREQ:
+            self.write(_packet(PINGRESP << 4))
+        elif packet_type == DISCONNECT:
+            # v5 reason 0x04 asks the broker to publish the will anyway
+            if not (self.level == 5 and body[:1] == b"\x04"):
+                self.will = None
+            self.close()
+
+    def _skip_properties(self, body, pos):
+        if self.level < 5:
+            return pos
+        length, pos = _read_varint(body, pos)
+        return pos + length
+
+    def _on_connect(self, body):
+        _, pos = _read_str(body, 0)
+        self.level = body[pos]
+        flags = body[pos + 1]
+        self.keepalive = int.from_bytes(body[pos + 2:pos + 4], "big")
+        pos = self._skip_properties(body, pos + 4)
+        self.client_id, pos = _read_str(body, pos)
+        if not self.client_id:
+            self.client_id = f"anon_{id(self):x}"
+
+        if flags & 0x04:
+            pos = self._skip_properties(body, pos)
+            will_topic, pos = _read_str(body, pos)
+            will_payload, pos = _read_bytes(body, pos)
+            self.will = (will_topic, will_payload, bool(flags & 0x20))
+        # Credentials are accepted as-is: the hub is meant for a trusted LAN
+
+        self.broker.attach(self)
+        connack = b"\x00\x00\x00" if self.level == 5 else b"\x00\x00"
+        self.write(_packet(CONNACK << 4, connack))
+
+    def _on_publish(self, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic, pos = _read_str(body, 0)
+        packet_id = None
+        if qos:
+            packet_id = body[pos:pos + 2]
+            pos += 2
+        pos = self._skip_properties(body, pos)
+        self.broker.publish(topic, body[pos:], retain=bool(flags & 0x01))
+        if qos == 1:
+            self.write(_packet(PUBACK << 4, packet_id))
+        elif qos == 2:
+            logger.warning(f"QoS 2 publish from {self.client_id} delivered as QoS 0 without PUBREC")
+
+    def _on_subscribe(self, body):
+        packet_id = body[:2]
+        pos = self._skip_properties(body, 2)
+        granted = bytearray()
+        new_filters = []
+        while pos < len(body):
+            topic_filter, pos = _read_str(body, pos)
+            pos += 1  # subscription options / requested QoS
+            new_filters.append(topic_filter)
+            granted.append(0)
+        properties = b"\x00" if self.level == 5 else b""
+        self.write(_packet(SUBACK << 4, packet_id + properties + bytes(granted)))
+        for topic_filter in new_filters:
+            self.broker.subscribe(self, topic_filter)
+
+    def _on_unsubscribe(self, body):
+        packet_id = body[:2]
+        pos = self._skip_properties(body, 2)
+        count = 0
+        while pos < len(body):
+            topic_filter, pos = _read_str(body, pos)
+            self.broker.unsubscribe(self, topic_filter)
+            count += 1
+        payload = packet_id + (b"\x00" + b"\x00" * count if self.level == 5 else b"")
+        self.write(_packet(UNSUBACK << 4, payload))
+
+    def deliver(self, topic, payload, retain=False):
+        properties = b"\x00" if self.level == 5 else b""
+        self.write(_packet((PUBLISH << 4) | (0x01 if retain else 0), _encode_str(topic) + properties + payload))
+
+
+class MqttBroker:
+    """Routing table shared by every MQTT session; retained messages and wills live here."""
+
+    def __init__(self):
+        self.sessions = {}  # client_id -> MqttSession
+        self.exact = defaultdict(set)  # topic -> sessions subscribed without wildcards
+        self.wildcards = defaultdict(set)  # filter with + or # -> sessions
+        self.retained = {}
+        self.published = 0
+
+    def attach(self, session):
+        previous = self.sessions.get(session.client_id)
+        if previous is not None and previous is not session:
+            # Session takeover: the same client reconnected, so its old will must not clear fresh state
+            previous.will = None
+            previous.close()
+        self.sessions[session.client_id] = session
+        logger.info(f"📡 MQTT client {session.client_id} connected from {session.remote}")
+
+    def detach(self, session):
+        for topic_filter in list(session.filters):
+            self.unsubscribe(session, topic_filter)
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+        if session.will:
+            topic, payload, retain = session.will
+            session.will = None
+            self.publish(topic, payload, retain)
+        if session.client_id:
+            logger.info(f"📴 MQTT client {session.client_id} disconnected")
+
+    def subscribe(self, session, topic_filter):
+        table = self.wildcards if ("+" in topic_filter or "#" in topic_filter) else self.exact
+        table[topic_filter].add(session)
+        session.filters.add(topic_filter)
+        if table is self.exact:
+            if topic_filter in self.retained:
+                session.deliver(topic_filter, self.retained[topic_filter], retain=True)
+        else:
+            for topic, payload in self.retained.items():
+                if topic_matches(topic_filter, topic):
+                    session.deliver(topic, payload, retain=True)
+
+    def unsubscribe(self, session, topic_filter):
+        session.filters.discard(topic_filter)
+        for table in (self.exact, self.wildcards):
+            subscribers = table.get(topic_filter)
+            if subscribers is not None:
+                subscribers.discard(session)
+                if not subscribers:
+                    del table[topic_filter]
+
+    def publish(self, topic, payload, retain=False):
+        self.published += 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+        targets = set(self.exact.get(topic, ()))
+        for topic_filter, subscribers in self.wildcards.items():
+            if topic_matches(topic_filter, topic):
+                targets |= subscribers
+        for session in targets:
+            session.deliver(topic, payload)
+
+    async def expire_idle_sessions(self):
+        """Drops clients silent for 1.5x their keepalive, which fires their Last Will."""
+        while True:
+            await asyncio.sleep(5)
+            now = time.monotonic()
+            for session in list(self.sessions.values()):
+                if session.keepalive and now - session.last_seen > session.keepalive * 1.5:
+                    logger.warning(f"⌛ MQTT client {session.client_id} missed its keepalive")
+                    session.close()
+
+    async def handle_tcp(self, reader, writer):
+        remote = writer.get_extra_info("peername")
+        closed = asyncio.Event()
+
+        def write(data):
+            if writer.transport.get_write_buffer_size() > SLOW_CONSUMER_BYTES:
+                logger.warning(f"MQTT client {session.client_id} is not reading, disconnecting")
+                close()
+                return
+            writer.write(data)
+
+        def close():
+            closed.set()
+            writer.close()
+
+        session = MqttSession(self, write, close, remote)
+        try:
+            while not closed.is_set():
+                data = await reader.read(65536)
+                if not data:
+                    break
+                session.feed(data)
+        except Exception as e:
+            logger.debug(f"MQTT connection from {remote} failed: {e}")
+        finally:
+            writer.close()
+            self.detach(session)
+
+    async def handle_websocket(self, request):
+        ws = web.WebSocketResponse(protocols=("mqtt",), heartbeat=30)
+        await ws.prepare(request)
+        outbound = deque()
+        wakeup = asyncio.Event()
+
+        def write(data):
+            if len(outbound) >= OUTBOUND_LIMIT:
+                outbound.popleft()
+            outbound.append(data)
+            wakeup.set()
+
+        def close():
+            asyncio.ensure_future(ws.close())
+
+        async def write_loop():
+            while not ws.closed:
+                await wakeup.wait()
+                wakeup.clear()
+                while outbound and not ws.closed:
+                    await ws.send_bytes(outbound.popleft())
+
+        session = MqttSession(self, write, close, request.remote)
+        writer = asyncio.ensure_future(write_loop())
+        try:
+            async for msg in ws:
+                if msg.type == web.WSMsgType.BINARY:
+                    session.feed(msg.data)
+        except Exception as e:
+            logger.debug(f"MQTT-over-WebSocket connection from {request.remote} failed: {e}")
+        finally:
+            writer.cancel()
+            self.detach(session)
+        return ws
+
+
+def build_app(hub, broker):
+    app = web.Application()
+    app.router.add_get('/ws', hub.handle_websocket)
+    app.router.add_get('/mqtt', broker.handle_websocket)
+
+    async def handle_health(request):
+        stats = hub.stats()
+        stats["mqtt_clients"] = len(broker.sessions)
+        stats["mqtt_retained"] = len(broker.retained)
+        stats["mqtt_published"] = broker.published
+        return web.json_response(stats)
+
+    app.router.add_get('/health', handle_health)
+    return app
+
+
+async def main(host, port, mqtt_port):
+    hub = SignalingHub()
+    broker = MqttBroker()
+
+    runner = web.AppRunner(build_app(hub, broker))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    servers = []
+    if mqtt_port:
+        servers.append(await asyncio.start_server(broker.handle_tcp, host, mqtt_port))
+    expiry_task = asyncio.ensure_future(broker.expire_idle_sessions())
+
+    print("-" * 60)
+    print("🛰️ LOCAL SIGNALING HUB ONLINE")
+    print(f"JSON WebSocket : ws://{host}:{port}/ws?room=<room>&peer=<id>")
+    print(f"MQTT WebSocket : ws://{host}:{port}/mqtt")
+    if mqtt_port:
+        print(f"MQTT TCP       : mqtt://{host}:{mqtt_port}")
+    print("-" * 60)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        expiry_task.cancel()
+        for server in servers:
+            server.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Self-hosted WebRTC signaling hub")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mqtt-port", type=int, default=1883, help="0 disables the plain TCP MQTT listener")
+    args = parser.parse_args()
+
+    try:
+        import uvloop  # Optional: roughly doubles connections per core
+        uvloop.install()
+    except ImportError:
+        pass
+
+    try:
+        asyncio.run(main(args.host, args.port, args.mqtt_port))
+    except KeyboardInterrupt:
+        print("\nShutting down hub...")
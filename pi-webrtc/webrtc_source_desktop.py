@@ -1,5 +1,4 @@
 import asyncio
-import json
 import time
 import uuid
 import threading
@@ -8,14 +7,24 @@ import fractions
 import cv2
 import numpy as np
 import mss  # High performance desktop capture frame mechanism
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, MediaStreamTrack
-import paho.mqtt.client as mqtt
+from aiortc import RTCSessionDescription, MediaStreamTrack
+from webrtc_certificates import install_certificate_cache
+from webrtc_media_policy import MediaPolicy, apply_media_policy
+from webrtc_peer_pool import PeerConnectionPool
+from webrtc_signaling import parse_ice_candidates
+from webrtc_transports import create_signaling
 from av import VideoFrame
 
 # Logging Setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 logger = logging.getLogger("WebRTC-ScreenShare")
 
+# Codec / bitrate policy applied to every viewer connection (see webrtc_media_policy.py)
+MEDIA_POLICY = MediaPolicy(max_bitrate=4_000_000, keyframe_interval=4.0)
+
+# One DTLS certificate per process, rotated daily (see webrtc_certificates.py)
+install_certificate_cache()
+
 # Downscaled target resolution dimensions for WebRTC frame pipeline processing
 WIDTH, HEIGHT = 640, 480
 
@@ -114,74 +123,56 @@ class CameraVideoTrack(MediaStreamTrack):
 class RemoteCameraSource:
     def __init__(self):
         self.peer_id = f"desktop_{uuid.uuid4().hex[:6]}"
-        self._loop = None
         self.signaling_topic = "webrtc/signaling"
         
-        self.mqtt_client = mqtt.Client(
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2, 
-            client_id=f"desktop_{self.peer_id}", 
-            protocol=mqtt.MQTTv5
+        # Signaling backend picked per deployment (WEBRTC_SIGNALING, MQTT by default), run on the aiortc loop
+        self.signaling = create_signaling(
+            self.peer_id,
+            base_topic=self.signaling_topic,
+            client_id=f"desktop_{self.peer_id}",
+            on_message=self.on_signal
         )
         
-        self.mqtt_client.tls_set()
-        self.mqtt_client.username_pw_set("admin", "admin1234S")
-        
         self.pc = None
         self.viewer_id = None
-        self.running = True
         self.current_track = None
+        # Pre-warmed peer connections + time-to-first-frame histogram
+        self.pool = PeerConnectionPool(CameraVideoTrack)
 
-    def connect(self):
-        self.mqtt_client.on_connect = lambda c, u, f, rc, p: c.subscribe(self.signaling_topic)
-        self.mqtt_client.on_message = self.on_mqtt_message
-        try:
-            logger.info("Connecting to HiveMQ Cloud...")
-            self.mqtt_client.connect("e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud", 8883, 60)
-            
-            threading.Thread(target=self.mqtt_client.loop_forever, daemon=True).start()
-            threading.Thread(target=self.presence_loop, daemon=True).start()
-        except Exception as e:
-            logger.error(f"MQTT Transport Setup Failure: {e}")
-
-    def presence_loop(self):
-        while self.running:
-            msg = {"type": "presence", "from": self.peer_id}
-            try:
-                self.mqtt_client.publish(self.signaling_topic, json.dumps(msg))
-            except Exception as e:
-                logger.debug(f"Failed to publish heartbeat metadata payload: {e}")
-            time.sleep(2)
+    async def connect(self):
+        await self.pool.start()
+        await self.signaling.start()
 
-    def on_mqtt_message(self, client, userdata, msg):
+    async def on_signal(self, payload):
+        # Only our personal inbox is subscribed, so every message is addressed to us
         try:
-            payload = json.loads(msg.payload.decode())
-            if payload.get("to") != self.peer_id: 
-                return
-            
             msg_type = payload.get("type")
             if msg_type == "offer":
                 self.viewer_id = payload.get("from")
                 logger.info(f"📥 Received Offer from {self.viewer_id}")
-                asyncio.run_coroutine_threadsafe(self.handle_offer(payload.get("data")), self._loop)
+                await self.handle_offer(payload.get("data"))
             elif msg_type == "ice" and self.pc:
-                asyncio.run_coroutine_threadsafe(self.handle_ice(payload.get("data")), self._loop)
+                await self.handle_ice(payload.get("data"))
         except Exception as e:
             logger.error(f"Signaling Error Encountered: {e}")
 
     async def handle_offer(self, data):
         global streaming_allowed
+        timeline = self.pool.timeline(f"for {self.viewer_id} ")
         if self.pc: 
             await self.pc.close()
             streaming_allowed.clear()
 
-        self.pc = RTCPeerConnection()
-        self.current_track = CameraVideoTrack()
-        self.pc.addTrack(self.current_track)
+        # Certificate, track and ICE candidates were prepared before the offer arrived
+        warm = await self.pool.acquire()
+        self.pc, self.current_track = warm.pc, warm.track
+        apply_media_policy(self.pc, warm.sender, MEDIA_POLICY)
+        timeline.watch(self.pc, self.current_track)
         
         @self.pc.on("icecandidate")
         async def on_candidate(candidate):
             if candidate:
-                self.send_signal("ice", {
+                self.signaling.send_ice(self.viewer_id, {
                     "sdpMid": candidate.sdpMid, 
                     "sdpMLineIndex": candidate.sdpMLineIndex, 
                     "candidate": candidate.candidate
@@ -207,24 +198,16 @@ class RemoteCameraSource:
             "sdp": self.pc.localDescription.sdp, 
             "type": self.pc.localDescription.type
         })
+        timeline.mark("answer_sent")
 
     async def handle_ice(self, data):
         if self.pc:
-            candidate = RTCIceCandidate(
-                sdpMid=data["sdpMid"], 
-                sdpMLineIndex=data["sdpMLineIndex"], 
-                candidate=data["candidate"]
-            )
-            await self.pc.addIceCandidate(candidate)
+            # Accepts a single trickled candidate or a batched list
+            for candidate in parse_ice_candidates(data):
+                await self.pc.addIceCandidate(candidate)
 
     def send_signal(self, msg_type, data):
-        payload = {
-            "type": msg_type, 
-            "from": self.peer_id, 
-            "to": self.viewer_id, 
-            "data": data
-        }
-        self.mqtt_client.publish(self.signaling_topic, json.dumps(payload))
+        self.signaling.send(msg_type, self.viewer_id, data)
 
 
 async def main():
@@ -238,8 +221,7 @@ async def main():
     logger.info("🚀 Desktop screen capture pipeline is running and buffered.")
 
     source = RemoteCameraSource()
-    source._loop = loop_ref
-    source.connect()
+    await source.connect()
     
     print("-" * 40)
     print(f"🚀 READY-GATED DESKTOP WEBRTC ONLINE")
@@ -1,17 +1,19 @@
 import asyncio
-import json
-import time
 import uuid
-import threading
 import logging
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate
-import paho.mqtt.client as mqtt
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from webrtc_certificates import install_certificate_cache
+from webrtc_signaling import parse_ice_candidates
+from webrtc_transports import create_signaling
 from picamera2 import Picamera2
 
 # Logging Setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 logger = logging.getLogger("WebRTC-NativeMJPEG")
 
+# One DTLS certificate per process, rotated daily (see webrtc_certificates.py)
+install_certificate_cache()
+
 WIDTH, HEIGHT = 640, 480
 
 # --- Global Frame Sync & Stream Controls ---
@@ -34,59 +36,34 @@ def native_frame_callback(request):
 class RemoteCameraSource:
     def __init__(self):
         self.peer_id = f"mjpeg_picam_{uuid.uuid4().hex[:6]}"
-        self._loop = None
         self.signaling_topic = "webrtc/signaling"
         
-        # MQTT Client Configuration
-        self.mqtt_client = mqtt.Client(
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2, 
-            client_id=f"cam_{self.peer_id}", 
-            protocol=mqtt.MQTTv5
+        # Signaling backend picked per deployment (WEBRTC_SIGNALING, MQTT by default), run on the aiortc loop
+        self.signaling = create_signaling(
+            self.peer_id,
+            base_topic=self.signaling_topic,
+            client_id=f"cam_{self.peer_id}",
+            on_message=self.on_signal
         )
         
-        self.mqtt_client.tls_set()
-        self.mqtt_client.username_pw_set("admin", "admin1234S")
-        
         self.pc = None
         self.viewer_id = None
-        self.running = True
         self.data_channel = None
         self.stream_task = None
 
-    def connect(self):
-        self.mqtt_client.on_connect = lambda c, u, f, rc, p: c.subscribe(self.signaling_topic)
-        self.mqtt_client.on_message = self.on_mqtt_message
-        try:
-            logger.info("Connecting to HiveMQ Cloud...")
-            self.mqtt_client.connect("e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud", 8883, 60)
-            
-            threading.Thread(target=self.mqtt_client.loop_forever, daemon=True).start()
-            threading.Thread(target=self.presence_loop, daemon=True).start()
-        except Exception as e:
-            logger.error(f"MQTT Connect Failed: {e}")
-
-    def presence_loop(self):
-        while self.running:
-            msg = {"type": "presence", "from": self.peer_id}
-            try:
-                self.mqtt_client.publish(self.signaling_topic, json.dumps(msg))
-            except Exception as e:
-                logger.debug(f"Failed to publish presence payload: {e}")
-            time.sleep(2)
-
-    def on_mqtt_message(self, client, userdata, msg):
+    async def connect(self):
+        await self.signaling.start()
+
+    async def on_signal(self, payload):
+        # Only our personal inbox is subscribed, so every message is addressed to us
         try:
-            payload = json.loads(msg.payload.decode())
-            if payload.get("to") != self.peer_id: 
-                return
-            
             msg_type = payload.get("type")
             if msg_type == "offer":
                 self.viewer_id = payload.get("from")
                 logger.info(f"📥 Received Offer from {self.viewer_id}")
-                asyncio.run_coroutine_threadsafe(self.handle_offer(payload.get("data")), self._loop)
+                await self.handle_offer(payload.get("data"))
             elif msg_type == "ice" and self.pc:
-                asyncio.run_coroutine_threadsafe(self.handle_ice(payload.get("data")), self._loop)
+                await self.handle_ice(payload.get("data"))
         except Exception as e:
             logger.error(f"Signaling Error: {e}")
 
@@ -116,7 +93,7 @@ class RemoteCameraSource:
         @self.pc.on("icecandidate")
         async def on_candidate(candidate):
             if candidate:
-                self.send_signal("ice", {
+                self.signaling.send_ice(self.viewer_id, {
                     "sdpMid": candidate.sdpMid, 
                     "sdpMLineIndex": candidate.sdpMLineIndex, 
                     "candidate": candidate.candidate
@@ -141,12 +118,9 @@ class RemoteCameraSource:
 
     async def handle_ice(self, data):
         if self.pc:
-            candidate = RTCIceCandidate(
-                sdpMid=data["sdpMid"], 
-                sdpMLineIndex=data["sdpMLineIndex"], 
-                candidate=data["candidate"]
-            )
-            await self.pc.addIceCandidate(candidate)
+            # Accepts a single trickled candidate or a batched list
+            for candidate in parse_ice_candidates(data):
+                await self.pc.addIceCandidate(candidate)
 
     async def mjpeg_stream_loop(self):
         """Pulls the hot native MJPEG binary buffer and pumps it down the Data Channel wire."""
@@ -170,13 +144,7 @@ class RemoteCameraSource:
             logger.error(f"Streaming loop error: {err}")
 
     def send_signal(self, msg_type, data):
-        payload = {
-            "type": msg_type, 
-            "from": self.peer_id, 
-            "to": self.viewer_id, 
-            "data": data
-        }
-        self.mqtt_client.publish(self.signaling_topic, json.dumps(payload))
+        self.signaling.send(msg_type, self.viewer_id, data)
 
 
 async def main():
@@ -195,8 +163,7 @@ async def main():
     logger.info("🚀 Camera processing pipeline active in Native MJPEG Mode.")
 
     source = RemoteCameraSource()
-    source._loop = loop_ref
-    source.connect()
+    await source.connect()
     
     print("-" * 50)
     print(f"🚀 PICAMERA2 NATIVE MJPEG WEBRTC RUNNING")
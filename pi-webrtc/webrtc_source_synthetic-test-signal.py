@@ -1,21 +1,29 @@
 import asyncio
-import json
 import time
 import uuid
-import threading
 import logging
 import numpy as np
 import fractions
 import cv2
 import psutil
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, MediaStreamTrack
-import paho.mqtt.client as mqtt
+from aiortc import RTCSessionDescription, MediaStreamTrack
+from webrtc_certificates import install_certificate_cache
+from webrtc_media_policy import MediaPolicy, apply_media_policy
+from webrtc_peer_pool import PeerConnectionPool
+from webrtc_signaling import parse_ice_candidates
+from webrtc_transports import create_signaling
 from av import VideoFrame
 
 # Logging Setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 logger = logging.getLogger("WebRTC-Synth")
 
+# Codec / bitrate policy applied to every viewer connection (see webrtc_media_policy.py)
+MEDIA_POLICY = MediaPolicy()
+
+# One DTLS certificate per process, rotated daily (see webrtc_certificates.py)
+install_certificate_cache()
+
 class SyntheticVideoTrack(MediaStreamTrack):
     """
     Generates a synthetic animated graphic using OpenCV.
@@ -96,75 +104,54 @@ class SyntheticVideoTrack(MediaStreamTrack):
 class RemoteCameraSource:
     def __init__(self):
         self.peer_id = f"synth_cam_{uuid.uuid4().hex[:6]}"
-        self._loop = None
         self.signaling_topic = "webrtc/signaling"
         
-        # MQTT Client Configuration
-        self.mqtt_client = mqtt.Client(
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2, 
-            client_id=f"cam_{self.peer_id}", 
-            protocol=mqtt.MQTTv5
+        # Signaling backend picked per deployment (WEBRTC_SIGNALING, MQTT by default), run on the aiortc loop
+        self.signaling = create_signaling(
+            self.peer_id,
+            base_topic=self.signaling_topic,
+            client_id=f"cam_{self.peer_id}",
+            on_message=self.on_signal
         )
         
-        # IMPORTANT: These credentials match your snippet
-        self.mqtt_client.tls_set()
-        self.mqtt_client.username_pw_set("admin", "admin1234S")
-        
         self.pc = None
         self.viewer_id = None
-        self.running = True
         self.current_track = None
+        # Pre-warmed peer connections + time-to-first-frame histogram
+        self.pool = PeerConnectionPool(SyntheticVideoTrack)
 
-    def connect(self):
-        self.mqtt_client.on_connect = lambda c, u, f, rc, p: c.subscribe(self.signaling_topic)
-        self.mqtt_client.on_message = self.on_mqtt_message
-        try:
-            logger.info("Connecting to HiveMQ Cloud...")
-            self.mqtt_client.connect("e5122a5328ea4986a0295fa6e037655a.s2.eu.hivemq.cloud", 8883, 60)
-            
-            # Run MQTT in background thread
-            threading.Thread(target=self.mqtt_client.loop_forever, daemon=True).start()
-            # Run Presence heartbeat in background thread
-            threading.Thread(target=self.presence_loop, daemon=True).start()
-        except Exception as e:
-            logger.error(f"MQTT Connect Failed: {e}")
-
-    def presence_loop(self):
-        """Informs the signaling server that this camera is online."""
-        while self.running:
-            msg = {"type": "presence", "from": self.peer_id}
-            self.mqtt_client.publish(self.signaling_topic, json.dumps(msg))
-            time.sleep(2)
+    async def connect(self):
+        await self.pool.start()
+        await self.signaling.start()
 
-    def on_mqtt_message(self, client, userdata, msg):
+    async def on_signal(self, payload):
+        # Only our personal inbox is subscribed, so every message is addressed to us
         try:
-            payload = json.loads(msg.payload.decode())
-            # Only handle messages explicitly sent to us
-            if payload.get("to") != self.peer_id: 
-                return
-            
             msg_type = payload.get("type")
             if msg_type == "offer":
                 self.viewer_id = payload.get("from")
                 logger.info(f"📥 Received Offer from {self.viewer_id}")
-                asyncio.run_coroutine_threadsafe(self.handle_offer(payload.get("data")), self._loop)
+                await self.handle_offer(payload.get("data"))
             elif msg_type == "ice" and self.pc:
-                asyncio.run_coroutine_threadsafe(self.handle_ice(payload.get("data")), self._loop)
+                await self.handle_ice(payload.get("data"))
         except Exception as e:
             logger.error(f"Signaling Error: {e}")
 
     async def handle_offer(self, data):
+        timeline = self.pool.timeline(f"for {self.viewer_id} ")
         if self.pc: 
             await self.pc.close()
 
-        self.pc = RTCPeerConnection()
-        self.current_track = SyntheticVideoTrack()
-        self.pc.addTrack(self.current_track)
+        # Certificate, track and ICE candidates were prepared before the offer arrived
+        warm = await self.pool.acquire()
+        self.pc, self.current_track = warm.pc, warm.track
+        apply_media_policy(self.pc, warm.sender, MEDIA_POLICY)
+        timeline.watch(self.pc, self.current_track)
         
         @self.pc.on("icecandidate")
         async def on_candidate(candidate):
             if candidate:
-                self.send_signal("ice", {
+                self.signaling.send_ice(self.viewer_id, {
                     "sdpMid": candidate.sdpMid, 
                     "sdpMLineIndex": candidate.sdpMLineIndex, 
                     "candidate": candidate.candidate
@@ -186,29 +173,20 @@ class RemoteCameraSource:
             "sdp": self.pc.localDescription.sdp, 
             "type": self.pc.localDescription.type
         })
+        timeline.mark("answer_sent")
 
     async def handle_ice(self, data):
         if self.pc:
-            candidate = RTCIceCandidate(
-                sdpMid=data["sdpMid"], 
-                sdpMLineIndex=data["sdpMLineIndex"], 
-                candidate=data["candidate"]
-            )
-            await self.pc.addIceCandidate(candidate)
+            # Accepts a single trickled candidate or a batched list
+            for candidate in parse_ice_candidates(data):
+                await self.pc.addIceCandidate(candidate)
 
     def send_signal(self, msg_type, data):
-        payload = {
-            "type": msg_type, 
-            "from": self.peer_id, 
-            "to": self.viewer_id, 
-            "data": data
-        }
-        self.mqtt_client.publish(self.signaling_topic, json.dumps(payload))
+        self.signaling.send(msg_type, self.viewer_id, data)
 
 async def main():
     source = RemoteCameraSource()
-    source._loop = asyncio.get_running_loop()
-    source.connect()
+    await source.connect()
     
     print("-" * 30)
     print(f"🚀 SYNTHETIC WEBRTC SOURCE ONLINE")
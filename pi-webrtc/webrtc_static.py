@@ -0,0 +1,267 @@
+"""
+Static delivery for the embedded viewer pages.
+
+Every page is encoded once at startup, precompressed with gzip (and brotli when the
+optional `brotli` package is installed) and given a strong ETag per encoding.
+Requests then only pick a ready-made bytes object: a repeat visit with
+If-None-Match costs a 304 and no body. Works with aiohttp (aiohttp_handler) and
+with the standard library's threading HTTP server (serve_threaded).
+
+Third-party browser libraries can be vendored under vendor/ and are then served
+under a content-hashed URL with immutable caching. Each is an exact release
+whose sha256 goes into vendor/SHA256SUMS; a download or a vendored file that
+does not match it is refused. vendor/mqtt.min.js and SHA256SUMS are not in the
+tree yet, so until they are fetched (and committed) the pages load the same
+pinned release from the CDN and need internet access:
+
+    python webrtc_static.py --fetch         # download VENDORED_SCRIPTS and check them against SHA256SUMS
+    python webrtc_static.py --fetch --pin   # after a version bump (and deleting its old line): record the new sha256
+"""
+import argparse
+import gzip
+import hashlib
+import http.server
+import logging
+import os
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("WebRTC-Static")
+
+# Pages are tiny and change on deploy: always revalidate, which costs a 304 when nothing changed
+DEFAULT_CACHE_CONTROL = "no-cache"
+# Content-hashed URLs never change meaning, so browsers may keep them for a year without asking
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Below this size compression does not pay for its headers
+MIN_COMPRESS_BYTES = 512
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendor")
+# vendor/<name> -> the exact release `--fetch` downloads (also the pages' CDN fallback)
+MQTT_VERSION = "5.10.1"
+VENDORED_SCRIPTS = {
+    "mqtt.min.js": f"https://unpkg.com/mqtt@{MQTT_VERSION}/dist/mqtt.min.js",
+}
+# sha256sum format ("<hex>  <name>"), kept next to the files and committed with them
+CHECKSUM_FILE = os.path.join(VENDOR_DIR, "SHA256SUMS")
+
+
+class StaticAsset:
+    """One response body in every encoding we can serve, computed once."""
+
+    def __init__(self, body, content_type="text/html; charset=utf-8", cache_control=DEFAULT_CACHE_CONTROL):
+        raw = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = digest = hashlib.sha256(raw).hexdigest()[:20]
+
+        # encoding -> (bytes, etag); identity is always available
+        self.variants = {"identity": (raw, f'"{digest}"')}
+        if len(raw) >= MIN_COMPRESS_BYTES:
+            self.variants["gzip"] = (gzip.compress(raw, compresslevel=9, mtime=0), f'"{digest}-gz"')
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(raw, quality=11), f'"{digest}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+        sizes = ", ".join(f"{name} {len(data)} B" for name, (data, _) in self.variants.items())
+        logger.debug(f"Static asset prepared ({sizes})")
+
+    def select(self, accept_encoding):
+        """Returns (encoding, body, etag) for the best encoding the client accepts."""
+        accepted = _parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return (encoding,) + self.variants[encoding]
+        return ("identity",) + self.variants["identity"]
+
+    def not_modified(self, if_none_match):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return not tags.isdisjoint(self.etags)
+
+    def headers(self, encoding, etag):
+        headers = {
+            "Content-Type": self.content_type,
+            "Cache-Control": self.cache_control,
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return headers
+
+
+def _parse_accept_encoding(header):
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def read_checksums():
+    """{name: sha256 hex} from CHECKSUM_FILE; empty when nothing was pinned yet."""
+    checksums = {}
+    try:
+        with open(CHECKSUM_FILE, "r") as f:
+            for line in f:
+                digest, _, name = line.strip().partition("  ")
+                if digest and name:
+                    checksums[name.lstrip("*")] = digest.lower()
+    except FileNotFoundError:
+        pass
+    return checksums
+
+
+def write_checksums(checksums):
+    with open(CHECKSUM_FILE + ".tmp", "w") as f:
+        f.writelines(f"{digest}  {name}\n" for name, digest in sorted(checksums.items()))
+    os.replace(CHECKSUM_FILE + ".tmp", CHECKSUM_FILE)
+
+
+def vendored_script(name):
+    """
+    Loads vendor/<name> as an immutable asset; its `url` embeds the content hash.
+    None if it was never fetched or does not match its pinned sha256.
+    """
+    path = os.path.join(VENDOR_DIR, name)
+    try:
+        with open(path, "rb") as f:
+            body = f.read()
+    except FileNotFoundError:
+        logger.warning(f"⚠️ {path} missing, pages fall back to the CDN (run: python webrtc_static.py --fetch)")
+        return None
+    expected = read_checksums().get(name)
+    if hashlib.sha256(body).hexdigest() != expected:
+        reason = "does not match vendor/SHA256SUMS" if expected else "has no sha256 in vendor/SHA256SUMS"
+        logger.error(f"❌ {path} {reason}, not serving it; pages fall back to the CDN")
+        return None
+
+    asset = StaticAsset(body, "text/javascript; charset=utf-8", IMMUTABLE_CACHE_CONTROL)
+    stem, ext = os.path.splitext(name)
+    asset.url = f"/vendor/{stem}.{asset.digest[:12]}{ext}"
+    return asset
+
+
+def fetch_vendored_scripts(force=False, pin=False):
+    """
+    Downloads VENDORED_SCRIPTS into VENDOR_DIR (needs internet once, at install time)
+    and checks each against CHECKSUM_FILE. A file without a recorded sha256 is only
+    kept with pin=True, which records it; a mismatch raises ValueError.
+    """
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    checksums = read_checksums()
+    for name, url in VENDORED_SCRIPTS.items():
+        path = os.path.join(VENDOR_DIR, name)
+        if os.path.exists(path) and not force:
+            print(f"{name}: already vendored")
+            continue
+        with urllib.request.urlopen(url, timeout=30) as response:
+            body = response.read()
+        digest = hashlib.sha256(body).hexdigest()
+        expected = checksums.get(name)
+        if expected is None and not pin:
+            raise ValueError(f"{name}: no sha256 pinned for {url} (got {digest}); rerun with --pin to record it")
+        if expected is not None and digest != expected:
+            raise ValueError(f"{name}: sha256 {digest} from {url} does not match the pinned {expected}")
+        # Write then rename, so a server starting meanwhile never reads half a file
+        with open(path + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+        if expected is None:
+            checksums[name] = digest
+            write_checksums(checksums)
+            print(f"{name}: pinned sha256 {digest}")
+        print(f"{name}: {len(body)} bytes from {url}")
+
+
+def aiohttp_handler(asset):
+    """aiohttp GET handler serving `asset` (replaces rebuilding a web.Response from a literal per request)."""
+    from aiohttp import web
+
+    async def handle(request):
+        encoding, body, etag = asset.select(request.headers.get("Accept-Encoding"))
+        headers = asset.headers(encoding, etag)
+        if asset.not_modified(request.headers.get("If-None-Match")):
+            del headers["Content-Type"]
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, headers=headers)
+
+    return handle
+
+
+class AssetRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Stdlib handler; `assets` maps a path to a StaticAsset (set by serve_threaded)."""
+    assets = {}
+    protocol_version = "HTTP/1.1"  # keep-alive: a kiosk refresh reuses its connection
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        asset = self.assets.get(self.path.split("?", 1)[0])
+        if asset is None:
+            self.send_error(404)
+            return
+
+        encoding, body, etag = asset.select(self.headers.get("Accept-Encoding"))
+        headers = asset.headers(encoding, etag)
+        if asset.not_modified(self.headers.get("If-None-Match")):
+            self.send_response(304)
+            del headers["Content-Type"]
+            body, send_body = b"", False
+        else:
+            self.send_response(200)
+            headers["Content-Length"] = str(len(body))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve_threaded(assets, port, host=""):
+    """Serves `assets` ({path: StaticAsset}) with one thread per connection until interrupted."""
+    handler = type("BoundAssetRequestHandler", (AssetRequestHandler,), {"assets": dict(assets)})
+    http.server.ThreadingHTTPServer.allow_reuse_address = True
+    with http.server.ThreadingHTTPServer((host, port), handler) as httpd:
+        httpd.daemon_threads = True
+        httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vendored browser libraries for the viewer pages")
+    parser.add_argument("--fetch", action="store_true", help="download VENDORED_SCRIPTS into vendor/")
+    parser.add_argument("--force", action="store_true", help="re-download files that already exist")
+    parser.add_argument("--pin", action="store_true", help="record the sha256 of downloads not yet in SHA256SUMS")
+    args = parser.parse_args()
+    if args.fetch:
+        try:
+            fetch_vendored_scripts(force=args.force, pin=args.pin)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
+    for name in VENDORED_SCRIPTS:
+        asset = vendored_script(name)
+        if asset is not None:
+            print(f"{name} -> {asset.url} ({', '.join(asset.variants)})")
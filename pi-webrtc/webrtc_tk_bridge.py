@@ -0,0 +1,145 @@
+"""
+Keeps Tk and networking on separate threads.
+
+The GUIs used to pump root.update() every 30 ms from the asyncio loop that runs
+aiortc, SCTP and signaling, so every redraw (or a modal messagebox) stalled the
+network and every network callback waited for the next poll. Now:
+
+    network = NetworkThread().start()  # asyncio loop in a daemon thread
+    ui = TkDispatcher(root)            # drained on the Tk thread with root.after()
+    asyncio.run_coroutine_threadsafe(coro, network.loop)   # Tk -> network
+    ui.post(fn) / ui.append(widget, s)                     # network -> Tk, applied once per frame
+    root.mainloop()
+
+Per frame, everything queued runs in order. Updates posted with the same `key`
+keep only the latest (progress, status, list refreshes), and text appended to a
+widget goes in as one insert. sync_listbox() then applies a refreshed list as a
+diff, so a long peer list is not redrawn for every change.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+
+logger = logging.getLogger("WebRTC-TkBridge")
+
+# One Tk frame at 60 Hz: fast enough to feel immediate, slow enough to batch
+FRAME_INTERVAL_MS = 16
+
+
+class NetworkThread:
+    """An asyncio event loop running forever in a daemon thread."""
+
+    def __init__(self, name="webrtc-network"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call(self, fn, *args, timeout=None):
+        """Runs fn(*args) on the network loop and waits for its result (from any other thread)."""
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return future.result(timeout)
+
+
+class TkDispatcher:
+    """
+    Thread-safe mailbox into Tk. Other threads only enqueue; the Tk thread drains
+    the queue once per frame, coalescing keyed updates and log text.
+    """
+
+    def __init__(self, root, interval_ms=FRAME_INTERVAL_MS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._queue = queue.SimpleQueue()
+        self.root.after(self.interval_ms, self._drain)
+
+    def post(self, fn, key=None):
+        """Runs fn() on the Tk thread. With a key, only the latest fn posted under it in a frame runs."""
+        self._queue.put((fn, key, None))
+
+    def append(self, widget, text):
+        """Appends text to a Text widget (disabled ones too) and scrolls to the end."""
+        self._queue.put((None, widget, text))
+
+    def _drain(self):
+        actions = []        # callables in arrival order; a keyed one is replaced in place
+        keyed = {}          # key -> index into actions
+        appends = {}        # widget -> [text, ...], flushed where its first line arrived
+        while True:
+            try:
+                fn, key, text = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if fn is None:
+                if key not in appends:
+                    appends[key] = []
+                    actions.append(lambda widget=key: self._flush(widget, "".join(appends[widget])))
+                appends[key].append(text)
+            elif key is None:
+                actions.append(fn)
+            elif key in keyed:
+                actions[keyed[key]] = fn
+            else:
+                keyed[key] = len(actions)
+                actions.append(fn)
+
+        for fn in actions:
+            try:
+                fn()
+            except Exception:
+                # A failing update must not stop the pump
+                logger.exception("UI update failed")
+        self.root.after(self.interval_ms, self._drain)
+
+    @staticmethod
+    def _flush(widget, text):
+        restore = str(widget.cget("state")) == "disabled"
+        if restore:
+            widget.config(state="normal")
+        widget.insert("end", text)
+        if restore:
+            widget.config(state="disabled")
+        widget.see("end")
+
+
+def sync_listbox(listbox, items):
+    """
+    Makes a Listbox show `items` by deleting and inserting only the rows that changed,
+    so the selection and active row survive. Expects the list's usual shape (survivors
+    keep their order, newcomers are appended); any other change is a full rebuild.
+    """
+    wanted = set(items)
+    current = listbox.get(0, "end")
+    index = len(current)
+    while index > 0:
+        index -= 1
+        if current[index] in wanted:
+            continue
+        # Delete whole runs of departed rows at once, from the bottom so indices stay valid
+        last = index
+        while index > 0 and current[index - 1] not in wanted:
+            index -= 1
+        listbox.delete(index, last)
+
+    kept = [item for item in current if item in wanted]
+    if kept != items[:len(kept)]:
+        listbox.delete(0, "end")
+        listbox.insert("end", *items)
+    elif len(items) > len(kept):
+        listbox.insert("end", *items[len(kept):])
@@ -0,0 +1,259 @@
+"""
+Signaling backends besides MQTT, all implementing webrtc_signaling.SignalingTransport.
+
+Pick one per deployment with create_signaling() / the WEBRTC_SIGNALING variable:
+    mqtt                          MqttSignaling (HiveMQ Cloud, or WEBRTC_BROKER=<host>:<port>)   [default]
+    ws://<hub>:8765/ws            WebSocketSignaling against webrtc_signaling_hub.py, room = base topic
+    socketio+http://<host>:3000   SocketIOSignaling against socketio-signaling-server.js
+    inprocess                     InProcessSignaling on a shared in-memory bus (loopback benchmarks)
+"""
+import asyncio
+import json
+import os
+import logging
+from urllib.parse import urlencode
+
+from webrtc_signaling import (
+    CLOSE_TIMEOUT, SIGNALING_TOPIC, SignalingTransport, MqttSignaling, encode_signal, decode_signal,
+)
+
+logger = logging.getLogger("WebRTC-Signaling")
+
+SIGNALING_ENV = "WEBRTC_SIGNALING"
+
+
+class WebSocketSignaling(SignalingTransport):
+    """JSON over a WebSocket to webrtc_signaling_hub.py; the hub delivers by peer id within the room."""
+    name = "WebSocket"
+
+    def __init__(self, peer_id, url, base_topic=SIGNALING_TOPIC, **kwargs):
+        super().__init__(peer_id, base_topic, **kwargs)
+        self.url = url
+        self._ws = None
+
+    async def start(self):
+        await super().start()
+        self._tasks.append(asyncio.ensure_future(self._connection_manager()))
+
+    def close(self):
+        super().close()
+        if self._ws is not None and not self._ws.closed:
+            asyncio.ensure_future(self._ws.close())
+
+    async def aclose(self, timeout=CLOSE_TIMEOUT):
+        # Close the socket before close() cancels the connection manager and its ClientSession
+        if self._ws is not None and not self._ws.closed:
+            try:
+                await asyncio.wait_for(self._ws.close(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.close()
+
+    async def _connection_manager(self):
+        import aiohttp
+
+        query = urlencode({"room": self.base_topic, "peer": self.peer_id})
+        backoff = 1
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    logger.info(f"Connecting to signaling hub {self.url}...")
+                    async with session.ws_connect(f"{self.url}?{query}", heartbeat=30) as ws:
+                        self._ws = ws
+                        backoff = 1
+                        await ws.send_str(json.dumps({"type": "presence", "from": self.peer_id}))
+                        self._link_up()
+                        async for msg in ws:
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                self._on_text(msg.data)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Signaling hub connection failed: {e}")
+
+                self._link_down()
+                logger.warning(f"Signaling hub link down, reconnecting in {backoff}s...")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _on_text(self, text):
+        try:
+            payload = json.loads(text)
+            if payload.get("type") == "error":
+                logger.warning(f"Hub could not deliver to {payload.get('to')}: {payload.get('reason')}")
+                return
+            self._receive(payload)
+        except Exception as e:
+            logger.error(f"Signaling Error: {e}")
+
+    async def _transmit(self, payload):
+        # The hub routes on the JSON envelope, so compact mode does not apply here
+        await self._ws.send_str(json.dumps(payload, separators=(",", ":")))
+
+
+class SocketIOSignaling(SignalingTransport):
+    """
+    Speaks the event protocol of socketio-signaling-server.js ("join", "signal").
+    That server addresses by Socket.IO socket id rather than peer id, so messages are
+    sent to the room and the receiving side filters on our own "to" field.
+    Needs the optional python-socketio package.
+    """
+    name = "Socket.IO"
+
+    def __init__(self, peer_id, url, base_topic=SIGNALING_TOPIC, **kwargs):
+        super().__init__(peer_id, base_topic, **kwargs)
+        self.url = url
+        self._sio = None
+
+    async def start(self):
+        import socketio
+
+        await super().start()
+        self._sio = socketio.AsyncClient(reconnection=True, reconnection_delay_max=30)
+        self._sio.on("connect", self._on_connect)
+        self._sio.on("disconnect", self._link_down)
+        self._sio.on("signal", self._on_signal)
+        self._tasks.append(asyncio.ensure_future(self._connect()))
+
+    def close(self):
+        super().close()
+        if self._sio is not None:
+            asyncio.ensure_future(self._sio.disconnect())
+
+    async def aclose(self, timeout=CLOSE_TIMEOUT):
+        if self._sio is not None and self._sio.connected:
+            try:
+                await asyncio.wait_for(self._sio.disconnect(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.close()
+
+    async def _connect(self):
+        logger.info(f"Connecting to Socket.IO signaling server {self.url}...")
+        # After the first success python-socketio handles reconnects itself
+        await self._sio.connect(self.url, retry=True)
+
+    async def _on_connect(self):
+        await self._sio.emit("join", self.base_topic)
+        await self._sio.emit("signal", {"room": self.base_topic,
+                                        "signalData": {"type": "presence", "from": self.peer_id}})
+        self._link_up()
+
+    def _on_signal(self, message):
+        payload = (message or {}).get("signalData")
+        if isinstance(payload, dict):
+            self._receive(payload)
+
+    async def _transmit(self, payload):
+        await self._sio.emit("signal", {"room": self.base_topic, "signalData": payload})
+
+
+class InProcessBus:
+    """Shared mailbox for InProcessSignaling peers living in the same process."""
+
+    def __init__(self):
+        self.peers = {}  # (base_topic, peer_id) -> InProcessSignaling
+
+    def members(self, base_topic):
+        return [t for (base, _), t in self.peers.items() if base == base_topic]
+
+
+DEFAULT_BUS = InProcessBus()
+
+
+class InProcessSignaling(SignalingTransport):
+    """
+    Broker-less loopback: messages go through the same encode/decode path as the
+    network backends but are handed over with call_soon, so benchmarks measure
+    WebRTC setup rather than signaling latency.
+    """
+    name = "in-process"
+
+    def __init__(self, peer_id, base_topic=SIGNALING_TOPIC, bus=None, **kwargs):
+        super().__init__(peer_id, base_topic, **kwargs)
+        self.bus = bus or DEFAULT_BUS
+
+    async def start(self):
+        await super().start()
+        for other in self.bus.members(self.base_topic):
+            other._deliver(encode_signal({"type": "presence", "from": self.peer_id}))
+            self._deliver(encode_signal({"type": "presence", "from": other.peer_id}))
+        self.bus.peers[(self.base_topic, self.peer_id)] = self
+        self._link_up()
+
+    def close(self):
+        super().close()
+        if self.bus.peers.get((self.base_topic, self.peer_id)) is self:
+            del self.bus.peers[(self.base_topic, self.peer_id)]
+            for other in self.bus.members(self.base_topic):
+                other._deliver(encode_signal({"type": "leave", "from": self.peer_id}))
+
+    async def _transmit(self, payload):
+        if not payload.get("to"):
+            raw = encode_signal(payload, self.compact)
+            for other in self.bus.members(self.base_topic):
+                if other is not self:
+                    other._deliver(raw)
+            return
+        target = self.bus.peers.get((self.base_topic, payload.get("to")))
+        if target is None:
+            logger.warning(f"In-process signaling: no peer {payload.get('to')} on {self.base_topic}")
+            return
+        target._deliver(encode_signal(payload, self.compact))
+
+    def _deliver(self, raw):
+        if isinstance(raw, str):
+            raw = raw.encode()
+        self._loop.call_soon_threadsafe(lambda: self._receive(decode_signal(raw)))
+
+
+class AcceptedWebSocketSignaling(SignalingTransport):
+    """
+    Server side of a browser's /ws socket on the webrtc_http-ws-* pages: one socket is
+    one remote peer, so every send goes down this socket regardless of "to".
+    ICE is sent unbatched because those pages expect one candidate per message.
+    """
+    name = "WebSocket (server)"
+
+    def __init__(self, ws, peer_id="server", **kwargs):
+        kwargs.setdefault("ice_batch_window", 0)
+        super().__init__(peer_id, **kwargs)
+        self.ws = ws
+
+    async def run(self):
+        """Serves the socket until the browser goes away."""
+        from aiohttp import WSMsgType
+
+        await self.start()
+        self._link_up()
+        try:
+            async for msg in self.ws:
+                if msg.type == WSMsgType.TEXT:
+                    try:
+                        self._receive(json.loads(msg.data))
+                    except Exception as e:
+                        logger.error(f"Signaling Error: {e}")
+        finally:
+            self._link_down()
+            self.close()
+
+    async def _transmit(self, payload):
+        if not self.ws.closed:
+            await self.ws.send_str(json.dumps(payload))
+
+
+def create_signaling(peer_id, base_topic=SIGNALING_TOPIC, transport=None, client_id=None, **kwargs):
+    """
+    Builds the signaling backend named by `transport` (or $WEBRTC_SIGNALING, default "mqtt").
+    Keyword arguments are the SignalingTransport callbacks and options.
+    """
+    transport = transport or os.environ.get(SIGNALING_ENV, "mqtt")
+    if transport == "mqtt":
+        return MqttSignaling(peer_id, base_topic, client_id=client_id, **kwargs)
+    if transport.startswith(("ws://", "wss://")):
+        return WebSocketSignaling(peer_id, transport, base_topic, **kwargs)
+    if transport.startswith("socketio+"):
+        return SocketIOSignaling(peer_id, transport[len("socketio+"):], base_topic, **kwargs)
+    if transport == "inprocess":
+        return InProcessSignaling(peer_id, base_topic, **kwargs)
+    raise ValueError(f"Unknown signaling transport: {transport}")
@@ -0,0 +1,128 @@
+import uuid
+import logging
+from aiohttp import web, WSCloseCode
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from webrtc_media_policy import apply_media_policy
+from webrtc_signaling import parse_ice_candidates
+from webrtc_transports import AcceptedWebSocketSignaling
+
+logger = logging.getLogger("WebRTC-Sessions")
+
+MAX_SESSIONS = 16
+
+
+class ViewerSession:
+    """One browser tab: its /ws signaling socket, its own peer connection and its relay of the shared capture."""
+
+    def __init__(self, source, media_policy=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.source = source
+        self.media_policy = media_policy
+        self.signaling = None
+        self.pc = None
+        self.proxy = None
+
+    async def on_signal(self, payload):
+        msg_type = payload.get("type")
+        if msg_type == "offer":
+            logger.info(f"📥 WebRTC Offer received from session {self.id}.")
+            await self.handle_offer(payload.get("data"))
+        elif msg_type == "ice":
+            await self.handle_ice(payload.get("data"))
+
+    async def handle_offer(self, data):
+        # A repeated offer from the same tab (the page's connect button) replaces only this session's pc
+        await self._close_pc()
+
+        self.pc = pc = RTCPeerConnection()
+        self.proxy = self.source.acquire()
+        sender = pc.addTrack(self.proxy)
+        if self.media_policy:
+            apply_media_policy(pc, sender, self.media_policy)
+
+        @pc.on("icecandidate")
+        async def on_candidate(candidate):
+            if candidate:
+                self.signaling.send_ice(None, {
+                    "sdpMid": candidate.sdpMid,
+                    "sdpMLineIndex": candidate.sdpMLineIndex,
+                    "candidate": candidate.candidate
+                })
+
+        @pc.on("connectionstatechange")
+        async def on_state_change():
+            logger.info(f"Session {self.id} WebRTC Connection State: {pc.connectionState}")
+            if pc.connectionState in ["failed", "closed"] and pc is self.pc:
+                await self._close_pc()
+
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=data["sdp"], type=data["type"]))
+        await pc.setLocalDescription(await pc.createAnswer())
+
+        self.signaling.send("answer", None, {
+            "sdp": pc.localDescription.sdp,
+            "type": pc.localDescription.type
+        })
+
+    async def handle_ice(self, data):
+        if self.pc:
+            # Accepts a single trickled candidate or a batched list
+            for candidate in parse_ice_candidates(data):
+                await self.pc.addIceCandidate(candidate)
+
+    async def close(self):
+        await self._close_pc()
+        if self.signaling and not self.signaling.ws.closed:
+            await self.signaling.ws.close(code=WSCloseCode.GOING_AWAY)
+
+    async def _close_pc(self):
+        pc, proxy = self.pc, self.proxy
+        self.pc = self.proxy = None
+        if proxy is not None:
+            self.source.release(proxy)
+        if pc is not None:
+            await pc.close()
+
+
+class ViewerSessions:
+    """
+    Serves /ws with one ViewerSession per socket, all fed from a single
+    SharedTrackSource, so extra tabs no longer close earlier viewers or open
+    the camera a second time. Sockets beyond max_sessions are refused with
+    close code 1013 (try again later).
+    """
+
+    def __init__(self, source, media_policy=None, max_sessions=MAX_SESSIONS):
+        self.source = source
+        self.media_policy = media_policy
+        self.max_sessions = max_sessions
+        self.sessions = {}
+
+    async def handle_websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        if len(self.sessions) >= self.max_sessions:
+            logger.warning(f"Refusing viewer from {request.remote}: {self.max_sessions} sessions active")
+            await ws.send_json({"type": "error", "reason": "session-limit"})
+            await ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"session limit")
+            return ws
+
+        session = ViewerSession(self.source, self.media_policy)
+        session.signaling = AcceptedWebSocketSignaling(ws, on_message=session.on_signal)
+        self.sessions[session.id] = session
+        logger.info(f"WebSocket session {session.id} opened ({len(self.sessions)}/{self.max_sessions}).")
+
+        try:
+            await session.signaling.run()
+        except Exception as e:
+            logger.error(f"WebSocket execution error: {e}")
+        finally:
+            # Socket gone: release this viewer's relay and peer connection, nobody else's
+            del self.sessions[session.id]
+            await session.close()
+            logger.info(f"WebSocket session {session.id} closed ({len(self.sessions)} remaining).")
+        return ws
+
+    async def close_all(self, app=None):
+        for session in list(self.sessions.values()):
+            await session.close()
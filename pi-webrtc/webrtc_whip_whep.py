@@ -0,0 +1,222 @@
+"""
+WHEP egress and WHIP ingest for the aiohttp WebRTC servers.
+
+    POST    /whep[/<name>]                  viewer SDP offer  -> 201 + SDP answer
+    POST    /whip/<name>                    publisher offer   -> 201 + SDP answer; the received
+                                            video becomes available as /whep/<name>
+    PATCH   /whip|whep/<name>/<session>     trickle ICE (application/trickle-ice-sdpfrag)
+    DELETE  /whip|whep/<name>/<session>     tear the session down
+
+aiortc gathers every candidate inside setLocalDescription, so the answer in the
+POST response is complete and media can flow after this single round trip.
+Standard WHEP players (and mediamtx / ffmpeg / curl) can pull from us directly.
+ICE restarts through PATCH are not supported.
+"""
+import uuid
+import logging
+from aiohttp import web
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.sdp import candidate_from_sdp
+from webrtc_media_policy import apply_media_policy
+from webrtc_shared_source import IngestedTrackSource
+
+logger = logging.getLogger("WebRTC-WHIP-WHEP")
+
+ICE_SERVERS = ["stun:stun.l.google.com:19302"]
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST, PATCH, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, If-Match, Authorization",
+    "Access-Control-Expose-Headers": "Location, Link, ETag",
+}
+
+
+class HttpSession:
+    """A WHIP or WHEP peer connection, addressed by the resource URL returned in Location."""
+
+    def __init__(self, kind, name, pc, source=None, proxy=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.name = name
+        self.pc = pc
+        self.source = source
+        self.proxy = proxy
+        self.closed = False
+
+    @property
+    def location(self):
+        return f"/{self.kind}/{self.name}/{self.id}"
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.proxy is not None:
+            self.source.release(self.proxy)
+        await self.pc.close()
+
+
+class WhipWhepEndpoints:
+    """
+    Adds WHIP/WHEP routes to an existing web.Application.
+
+    `sources` maps a track name to a SharedTrackSource; the first one also answers
+    on plain /whep. WHIP publishers add ingested sources under their own name for
+    as long as their session lasts. With `viewers` (the server's ViewerSessions)
+    WHEP sessions are entered in its sessions too, so /ws viewers and WHEP share
+    one cap on encoders.
+    """
+
+    def __init__(self, sources, media_policy=None, max_sessions=32, viewers=None):
+        self.sources = dict(sources)
+        self.default = next(iter(self.sources))
+        self.media_policy = media_policy
+        self.max_sessions = max_sessions
+        self.viewers = viewers
+        self.sessions = {}
+
+    def register(self, app):
+        app.router.add_post('/whep', self.handle_whep)
+        app.router.add_post('/whep/{name}', self.handle_whep)
+        app.router.add_post('/whip/{name}', self.handle_whip)
+        app.router.add_route('PATCH', '/{kind:wh[ie]p}/{name}/{session}', self.handle_patch)
+        app.router.add_delete('/{kind:wh[ie]p}/{name}/{session}', self.handle_delete)
+        for path in ('/whep', '/whep/{name}', '/whip/{name}', '/{kind:wh[ie]p}/{name}/{session}'):
+            app.router.add_route('OPTIONS', path, self.handle_options)
+        app.on_shutdown.append(self.close_all)
+
+    # --- Egress ---
+
+    async def handle_whep(self, request):
+        error = self._check_request(request, "application/sdp")
+        if error:
+            return error
+        name = request.match_info.get("name", self.default)
+        source = self.sources.get(name)
+        if source is None:
+            return self._error(404, f"No track named '{name}'")
+        if self.viewers is not None and len(self.viewers.sessions) >= self.viewers.max_sessions:
+            return self._busy()
+
+        pc = RTCPeerConnection()
+        proxy = source.acquire()
+        session = HttpSession("whep", name, pc, source, proxy)
+        sender = pc.addTrack(proxy)
+        if self.media_policy:
+            apply_media_policy(pc, sender, self.media_policy)
+        return await self._answer(request, session)
+
+    # --- Ingest ---
+
+    async def handle_whip(self, request):
+        error = self._check_request(request, "application/sdp")
+        if error:
+            return error
+        name = request.match_info["name"]
+        if name in self.sources:
+            return self._error(409, f"Track '{name}' is already being served")
+
+        pc = RTCPeerConnection()
+        session = HttpSession("whip", name, pc)
+
+        @pc.on("track")
+        def on_track(track):
+            if track.kind != "video" or name in self.sources:
+                return
+            # Unregistered with the session (DELETE, failed or closed publisher): the track's
+            # own "ended" only fires from recv(), which nothing calls while nobody watches
+            session.source = self.sources[name] = IngestedTrackSource(track, name)
+            logger.info(f"📥 WHIP ingest '{name}' is live, pull it from /whep/{name}")
+
+        return await self._answer(request, session)
+
+    # --- Session resources ---
+
+    async def handle_patch(self, request):
+        session = self.sessions.get(request.match_info["session"])
+        if session is None:
+            return self._error(404, "Unknown session")
+        if request.content_type != "application/trickle-ice-sdpfrag":
+            return self._error(415, "Expected application/trickle-ice-sdpfrag")
+
+        mid = None
+        for line in (await request.text()).splitlines():
+            line = line.strip()
+            if line.startswith("a=mid:"):
+                mid = line[len("a=mid:"):]
+            elif line.startswith("a=candidate:"):
+                candidate = candidate_from_sdp(line[len("a=candidate:"):])
+                candidate.sdpMid = mid
+                candidate.sdpMLineIndex = None if mid is not None else 0
+                await session.pc.addIceCandidate(candidate)
+        return web.Response(status=204, headers=CORS_HEADERS)
+
+    async def handle_delete(self, request):
+        session = self.sessions.get(request.match_info["session"])
+        if session is None:
+            return self._error(404, "Unknown session")
+        await self._close_session(session)
+        return web.Response(status=200, headers=CORS_HEADERS)
+
+    async def handle_options(self, request):
+        headers = dict(CORS_HEADERS, **{"Accept-Post": "application/sdp"})
+        return web.Response(status=204, headers=headers)
+
+    async def close_all(self, app=None):
+        for session in list(self.sessions.values()):
+            await self._close_session(session)
+
+    # --- Helpers ---
+
+    def _check_request(self, request, content_type):
+        if request.content_type != content_type:
+            return self._error(415, f"Expected {content_type}")
+        if len(self.sessions) >= self.max_sessions:
+            return self._busy()
+        return None
+
+    def _busy(self):
+        response = self._error(503, "Session limit reached")
+        response.headers["Retry-After"] = "5"
+        return response
+
+    async def _answer(self, request, session):
+        pc = session.pc
+
+        @pc.on("connectionstatechange")
+        async def on_state_change():
+            logger.info(f"{session.kind.upper()} session {session.id[:8]} state: {pc.connectionState}")
+            if pc.connectionState in ["failed", "closed"]:
+                await self._close_session(session)
+
+        try:
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=await request.text(), type="offer"))
+            await pc.setLocalDescription(await pc.createAnswer())
+        except Exception as e:
+            await self._close_session(session)
+            return self._error(400, f"Could not negotiate: {e}")
+
+        self.sessions[session.id] = session
+        if session.kind == "whep" and self.viewers is not None:
+            self.viewers.sessions[session.id] = session
+        logger.info(f"🤝 {session.kind.upper()} session {session.id[:8]} for '{session.name}' "
+                    f"({len(self.sessions)} active)")
+        headers = dict(CORS_HEADERS)
+        headers["Location"] = session.location
+        headers["ETag"] = f'"{session.id}"'
+        headers["Link"] = ", ".join(f'<{url}>; rel="ice-server"' for url in ICE_SERVERS)
+        return web.Response(status=201, text=pc.localDescription.sdp,
+                            content_type="application/sdp", headers=headers)
+
+    async def _close_session(self, session):
+        self.sessions.pop(session.id, None)
+        if self.viewers is not None:
+            self.viewers.sessions.pop(session.id, None)
+        if session.kind == "whip" and session.source is not None and self.sources.get(session.name) is session.source:
+            del self.sources[session.name]
+            logger.info(f"WHIP ingest '{session.name}' ended")
+        await session.close()
+
+    def _error(self, status, reason):
+        return web.Response(status=status, text=reason, headers=CORS_HEADERS)